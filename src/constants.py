@@ -44,6 +44,11 @@ def get_eeprom_extension_database_file():
     return "/opt/openmotics/etc/eeprom_ext.db"
 
 
+def get_eeprom_image_file():
+    """ Get the filename of the persisted image of the master EEPROM. """
+    return "/opt/openmotics/etc/eeprom.img"
+
+
 def get_metrics_database_file():
     """ Get the filename of the metrics database file. This file is in sqlite format. """
     return "/opt/openmotics/etc/metrics.db"
@@ -0,0 +1,215 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The event bus module delivers the asynchronous messages of the master (OL, IL, SO, EV, ...) to
+the subscribers on a pool of dispatch threads, the serial read thread only has to enqueue them.
+"""
+
+import logging
+from collections import deque
+from threading import Lock, Thread
+from Queue import Queue
+
+LOGGER = logging.getLogger("openmotics")
+
+TOPIC_OUTPUTS = 'outputs'  # OL: the outputs that are on
+TOPIC_OUTPUT_CHANGES = 'output_changes'  # The transitions of the outputs that changed
+TOPIC_INPUTS = 'inputs'  # IL: an input was pressed
+TOPIC_SHUTTERS = 'shutters'  # SO: the status of a shutter module
+TOPIC_EVENTS = 'events'  # EV: an event was triggered
+TOPIC_MODULES = 'modules'  # A module was initialized
+TOPICS = [TOPIC_OUTPUTS, TOPIC_OUTPUT_CHANGES, TOPIC_INPUTS, TOPIC_SHUTTERS, TOPIC_EVENTS, TOPIC_MODULES]
+
+POLICY_DROP_OLDEST = 'drop_oldest'  # A full queue drops its oldest message
+POLICY_DROP_NEWEST = 'drop_newest'  # A full queue drops the published message
+POLICY_MERGE = 'merge'  # A full queue merges the published message into its newest message
+POLICIES = [POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_MERGE]
+
+
+class Subscription(object):
+    """ The queue of the messages of a topic that are not yet delivered to a subscriber. """
+
+    def __init__(self, topic, callback, max_queue, policy, merge, name):
+        """
+        :param topic: One of TOPICS.
+        :param callback: Function that is called with the data of a message.
+        :param max_queue: The maximum number of messages that are waiting for delivery.
+        :param policy: One of POLICIES, what to do with a message when the queue is full.
+        :param merge: Function that merges a pending message and a published message, \
+        used for POLICY_MERGE.
+        :param name: Name of the subscription, used in the statistics.
+        """
+        self.topic = topic
+        self.callback = callback
+        self.max_queue = max_queue
+        self.policy = policy
+        self.merge = merge
+        self.name = name
+
+        self.queue = deque()
+        self.scheduled = False
+        self.delivered = 0
+        self.dropped = 0
+        self.merged = 0
+        self.max_depth = 0
+
+    def get_statistics(self):
+        """ Get the statistics of the subscription. """
+        return {'topic': self.topic,
+                'policy': self.policy,
+                'queue_depth': len(self.queue),
+                'max_depth': self.max_depth,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'merged': self.merged}
+
+
+class EventBus(object):
+    """ Delivers the published messages to the subscribers of their topic. Every subscriber has a
+    bounded queue, a slow subscriber drops or merges its own messages but does not delay the
+    publisher or the other subscribers. The messages of a subscriber are delivered one at a time,
+    in the order they were published. """
+
+    def __init__(self, workers=2):
+        """
+        :param workers: The number of dispatch threads.
+        :type workers: int
+        """
+        self.__workers = workers
+        self.__lock = Lock()
+        self.__subscriptions = dict((topic, []) for topic in TOPICS)
+        self.__ready = Queue()
+        self.__threads = []
+
+    def start(self):
+        """ Start the dispatch threads. """
+        for i in range(self.__workers):
+            thread = Thread(target=self.__dispatch, name='EventBus dispatch thread {0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def stop(self):
+        """ Stop the dispatch threads, after the messages that are ready were delivered. """
+        for _ in self.__threads:
+            self.__ready.put(None)
+        self.__threads = []
+
+    def subscribe(self, topic, callback, max_queue=100, policy=POLICY_DROP_OLDEST, merge=None,
+                  name=None):
+        """ Subscribe to the messages of a topic.
+
+        :param topic: One of TOPICS.
+        :param callback: Function that is called with the data of a message.
+        :param max_queue: The maximum number of messages that are waiting for delivery.
+        :param policy: One of POLICIES, what to do with a message when the queue is full.
+        :param merge: Function that merges a pending message and a published message into a \
+        new message, used for POLICY_MERGE. By default the published message replaces the \
+        pending message.
+        :param name: Name of the subscription, used in the statistics.
+        :returns: the Subscription, required to unsubscribe.
+        """
+        if topic not in TOPICS:
+            raise ValueError('Unknown topic: {0}'.format(topic))
+        if policy not in POLICIES:
+            raise ValueError('Unknown policy: {0}'.format(policy))
+        if max_queue < 1:
+            raise ValueError('The queue should hold at least 1 message')
+
+        if merge is None:
+            merge = lambda pending, data: data
+        if name is None:
+            name = getattr(callback, '__name__', 'subscriber')
+
+        subscription = Subscription(topic, callback, max_queue, policy, merge, name)
+        with self.__lock:
+            self.__subscriptions[topic].append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """ Stop the delivery of the messages to a subscription, pending messages are dropped. """
+        with self.__lock:
+            if subscription in self.__subscriptions[subscription.topic]:
+                self.__subscriptions[subscription.topic].remove(subscription)
+            subscription.queue.clear()
+
+    def publish(self, topic, data):
+        """ Publish a message, this does not wait for the delivery of the message.
+
+        :param topic: One of TOPICS.
+        :param data: The data of the message.
+        """
+        if topic not in TOPICS:
+            raise ValueError('Unknown topic: {0}'.format(topic))
+
+        with self.__lock:
+            for subscription in self.__subscriptions[topic]:
+                EventBus.__enqueue(subscription, data)
+                if not subscription.scheduled:
+                    subscription.scheduled = True
+                    self.__ready.put(subscription)
+
+    @staticmethod
+    def __enqueue(subscription, data):
+        """ Add a message to the queue of a subscription, the lock should be held. """
+        queue = subscription.queue
+        if len(queue) < subscription.max_queue:
+            queue.append(data)
+        elif subscription.policy == POLICY_DROP_NEWEST:
+            subscription.dropped += 1
+        elif subscription.policy == POLICY_DROP_OLDEST:
+            queue.popleft()
+            queue.append(data)
+            subscription.dropped += 1
+        else:
+            queue[-1] = subscription.merge(queue[-1], data)
+            subscription.merged += 1
+        subscription.max_depth = max(subscription.max_depth, len(queue))
+
+    def __dispatch(self):
+        """ Deliver the messages of the subscriptions that are ready, until stopped. """
+        while True:
+            subscription = self.__ready.get()
+            if subscription is None:
+                break
+
+            with self.__lock:
+                if len(subscription.queue) == 0:  # Unsubscribed
+                    subscription.scheduled = False
+                    continue
+                data = subscription.queue.popleft()
+
+            try:
+                subscription.callback(data)
+            except Exception:
+                LOGGER.exception('Error while delivering a message of topic %s to %s',
+                                 subscription.topic, subscription.name)
+
+            with self.__lock:
+                subscription.delivered += 1
+                if len(subscription.queue) > 0:
+                    self.__ready.put(subscription)
+                else:
+                    subscription.scheduled = False
+
+    def get_statistics(self):
+        """ Get the statistics of the subscriptions.
+
+        :returns: dict mapping the name of the subscription on its statistics.
+        """
+        with self.__lock:
+            return dict((subscription.name, subscription.get_statistics())
+                        for subscriptions in self.__subscriptions.values()
+                        for subscription in subscriptions)
@@ -30,15 +30,19 @@ import glob
 import shutil
 import subprocess
 import tempfile
+import functools
 from threading import Timer
 from serial_utils import CommunicationTimedOutException
 import master.master_api as master_api
 from master.outputs import OutputStatus
 from master.inputs import InputStatus
-from master.thermostats import ThermostatStatus
+from master.thermostats import ThermostatStatus, ThermostatStateStore
 from master.shutters import ShutterStatus
-from master.master_communicator import BackgroundConsumer
-from master.eeprom_controller import EepromController, EepromFile
+from master.home_state import HomeState
+from master.master_communicator import BackgroundConsumer, InMaintenanceModeException
+from master.command_scheduler import command_priority, set_thread_priority, PRIORITY_BACKGROUND
+from master.eeprom_controller import EepromController, EepromFile, EepromAddress, EepromData
+from master.eeprom_image import NUM_BANKS, BANK_SIZE
 from master.eeprom_extension import EepromExtension
 from master.eeprom_models import OutputConfiguration, InputConfiguration, ThermostatConfiguration, \
     SensorConfiguration, PumpGroupConfiguration, GroupActionConfiguration, \
@@ -46,8 +50,10 @@ from master.eeprom_models import OutputConfiguration, InputConfiguration, Thermo
     ShutterConfiguration, ShutterGroupConfiguration, DimmerConfiguration, \
     GlobalThermostatConfiguration, CoolingConfiguration, CoolingPumpGroupConfiguration, \
     GlobalRTD10Configuration, RTD10HeatingConfiguration, RTD10CoolingConfiguration, \
-    CanLedConfiguration, RoomConfiguration, ThermostatSetpointConfiguration
+    CanLedConfiguration, RoomConfiguration, ThermostatSetpointConfiguration, MODULE_BANKS
 import power.power_api as power_api
+from gateway.event_bus import EventBus, TOPIC_OUTPUTS, TOPIC_OUTPUT_CHANGES, TOPIC_INPUTS, \
+    TOPIC_SHUTTERS, TOPIC_EVENTS, TOPIC_MODULES, POLICY_MERGE
 
 LOGGER = logging.getLogger('openmotics')
 
@@ -59,16 +65,54 @@ def convert_nan(number):
     return 0.0 if math.isnan(number) else number
 
 
+# Maps the configuration types of set_configurations on their EepromModel
+CONFIGURATION_MODELS = {'output': OutputConfiguration,
+                        'shutter': ShutterConfiguration,
+                        'shutter_group': ShutterGroupConfiguration,
+                        'input': InputConfiguration,
+                        'thermostat': ThermostatConfiguration,
+                        'sensor': SensorConfiguration,
+                        'pump_group': PumpGroupConfiguration,
+                        'cooling': CoolingConfiguration,
+                        'cooling_pump_group': CoolingPumpGroupConfiguration,
+                        'global_rtd10': GlobalRTD10Configuration,
+                        'rtd10_heating': RTD10HeatingConfiguration,
+                        'rtd10_cooling': RTD10CoolingConfiguration,
+                        'group_action': GroupActionConfiguration,
+                        'scheduled_action': ScheduledActionConfiguration,
+                        'pulse_counter': PulseCounterConfiguration,
+                        'startup_action': StartupActionConfiguration,
+                        'dimmer': DimmerConfiguration,
+                        'global_thermostat': GlobalThermostatConfiguration,
+                        'can_led': CanLedConfiguration,
+                        'room': RoomConfiguration}
+
+
 def check_basic_action(ret_dict):
     """ Checks if the response is 'OK', throws a ValueError otherwise. """
     if ret_dict['resp'] != 'OK':
         raise ValueError('Basic action did not return OK.')
 
 
+def check_outputs(outputs):
+    """ Checks if the outputs are a list of dicts with an integer 'id', throws a ValueError
+    otherwise. """
+    if not isinstance(outputs, list):
+        raise ValueError('Outputs is not a list: {0}'.format(outputs))
+    for output in outputs:
+        if not isinstance(output, dict):
+            raise ValueError('Output is not a dict: {0}'.format(output))
+        output_id = output.get('id')
+        if not isinstance(output_id, (int, long)) or isinstance(output_id, bool):
+            raise ValueError('Output id is not an integer: {0}'.format(output_id))
+
+
 class GatewayApi(object):
     """ The GatewayApi combines master_api functions into high level functions. """
 
-    def __init__(self, master_communicator, power_communicator, power_controller):
+    def __init__(self, master_communicator, power_communicator, power_controller,
+                 output_refresh_period=3600, thermostat_refresh_period=10, stale_status_age=300,
+                 max_status_age=600):
         """
         :param master_communicator: Master communicator
         :type master_communicator: master.master_communicator.MasterCommunicator
@@ -76,12 +120,25 @@ class GatewayApi(object):
         :type power_communicator: power.power_communicator.PowerCommunicator
         :param power_controller: Power controller
         :type power_controller: power.power_controller.PowerController
+        :param output_refresh_period: Number of seconds between the background refreshes of all \
+        outputs, in between the output status is kept current by the OL messages.
+        :type output_refresh_period: int
+        :param thermostat_refresh_period: Number of seconds between the background refreshes of \
+        the thermostat status.
+        :type thermostat_refresh_period: int
+        :param stale_status_age: Age in seconds after which the output and thermostat status is \
+        stale: it is still returned right away, but it is refreshed in the background.
+        :type stale_status_age: int
+        :param max_status_age: Maximum age in seconds of the output and thermostat status served \
+        from memory, an older status is refreshed before it is returned.
+        :type max_status_age: int
         """
         self.__master_communicator = master_communicator
         self.__eeprom_controller = EepromController(
-            EepromFile(self.__master_communicator),
+            EepromFile(self.__master_communicator, constants.get_eeprom_image_file()),
             EepromExtension(constants.get_eeprom_extension_database_file())
         )
+        self.__eeprom_verify = threading.Event()
         self.__power_communicator = power_communicator
         self.__power_controller = power_controller
         self.__plugin_controller = None
@@ -92,31 +149,74 @@ class GatewayApi(object):
         self.__discover_mode_timer = None
 
         self.__output_status = None
+        self.__output_status_seeded = threading.Event()
+        self.__output_refresh_period = output_refresh_period
+        self.__output_refresh_lock = threading.Lock()
+        self.__output_refresh = threading.Event()
+        self.__stale_status_age = stale_status_age
+        self.__max_status_age = max_status_age
         self.__input_status = InputStatus()
         self.__module_log = []
         self.__thermostat_status = None
+        self.__thermostat_state = ThermostatStateStore(self.__read_thermostat_status)
+        self.__thermostat_refresh = threading.Event()
         self.__shutter_status = ShutterStatus()
-
-        self.__master_communicator.register_consumer(
-                BackgroundConsumer(master_api.module_initialize(), 0, self.__update_modules)
-        )
-        self.__master_communicator.register_consumer(
-            BackgroundConsumer(master_api.event_triggered(), 0, self.__event_triggered, True)
-        )
+        self.__home_state = HomeState()
+
+        self.__event_bus = EventBus()
+        self.__event_bus.subscribe(TOPIC_MODULES, self.__update_modules)
+        self.__event_bus.subscribe(TOPIC_OUTPUTS, self.on_outputs, max_queue=1, policy=POLICY_MERGE)
+        self.__event_bus.subscribe(TOPIC_INPUTS, self.on_inputs)
+        self.__event_bus.subscribe(TOPIC_SHUTTERS, self.__on_shutter_update)
+        self.__event_bus.start()
+
+        # The read thread of the master communicator only publishes the messages on the event bus
+        for (cmd, topic, single) in [(master_api.module_initialize(), TOPIC_MODULES, False),
+                                     (master_api.event_triggered(), TOPIC_EVENTS, True),
+                                     (master_api.output_list(), TOPIC_OUTPUTS, True),
+                                     (master_api.input_list(), TOPIC_INPUTS, False),
+                                     (master_api.shutter_status(), TOPIC_SHUTTERS, False)]:
+            self.__master_communicator.register_consumer(
+                BackgroundConsumer(cmd, 0, functools.partial(self.__event_bus.publish, topic), single)
+            )
 
         self.__init_shutter_status()
-        self.__master_communicator.register_consumer(
-                BackgroundConsumer(master_api.shutter_status(), 0,
-                                   self.__on_shutter_update)
-        )
 
         self.__extend_method('set_shutter_configuration', self.__init_shutter_status)
         self.__extend_method('set_shutter_configurations', self.__init_shutter_status)
 
+        self.__init_command_coalescing()
         self.__init_master()
         self.__load_thermostat_setpoints()
         self.__run_master_timer()
 
+        output_thread = threading.Thread(target=self.__run_output_engine,
+                                         name='GatewayApi output state thread')
+        output_thread.daemon = True
+        output_thread.start()
+
+        self.__eeprom_verify.set()  # The banks in the persisted image are not verified yet
+        eeprom_thread = threading.Thread(target=self.__run_eeprom_verifier,
+                                         name='GatewayApi eeprom verifier thread')
+        eeprom_thread.daemon = True
+        eeprom_thread.start()
+
+        thermostat_thread = threading.Thread(target=self.__run_thermostat_engine,
+                                             args=(thermostat_refresh_period,),
+                                             name='GatewayApi thermostat state thread')
+        thermostat_thread.daemon = True
+        thermostat_thread.start()
+
+        state_thread = threading.Thread(target=self.__run_state_poller,
+                                        name='GatewayApi state poller thread')
+        state_thread.daemon = True
+        state_thread.start()
+
+        # Rooms are not warmed: they are only stored in the eeprom extension
+        self.__eeprom_controller.start_warmer([OutputConfiguration, InputConfiguration,
+                                               ThermostatConfiguration, GroupActionConfiguration,
+                                               SensorConfiguration, ShutterConfiguration])
+
     def __extend_method(self, method_name, extension):
         """ Extend a method of the object to call the extension function after method execution.
         This is used to add an event to the auto-generated code. This way, we don't have to modify
@@ -131,10 +231,52 @@ class GatewayApi(object):
 
         setattr(self, method_name, override)
 
+    def __init_command_coalescing(self, ttl=0.5):
+        """ Let concurrent API calls, metric collectors and plugins share the round trips of
+        the read-only master commands that are polled the most.
+
+        :param ttl: Number of seconds the results of the read-only commands are cached.
+        """
+        thermostat_writes = [master_api.basic_action(), master_api.write_setpoint(),
+                             master_api.thermostat_mode(), master_api.write_eeprom(),
+                             master_api.activate_eeprom()]
+        sensor_writes = [master_api.set_virtual_sensor()]
+
+        for (cmd, invalidated_by) in [
+                (master_api.thermostat_list(), thermostat_writes),
+                (master_api.thermostat_mode_list(), thermostat_writes),
+                (master_api.read_airco_status_bits(),
+                 thermostat_writes + [master_api.write_airco_status_bit()]),
+                (master_api.sensor_temperature_list(), sensor_writes),
+                (master_api.sensor_humidity_list(), sensor_writes),
+                (master_api.sensor_brightness_list(), sensor_writes),
+                (master_api.pulse_list(), []),
+                (master_api.error_list(), [master_api.clear_error_list()])]:
+            self.__master_communicator.enable_coalescing(cmd, ttl, invalidated_by)
+
     def set_plugin_controller(self, plugin_controller):
-        """ Set the plugin controller. """
+        """ Set the plugin controller, the plugins get the messages of the master on their own
+        subscriptions: slow plugins don't delay the status of the gateway. """
         self.__plugin_controller = plugin_controller
 
+        self.__event_bus.subscribe(
+            TOPIC_OUTPUTS, lambda data: plugin_controller.process_output_status(data['outputs']),
+            max_queue=1, policy=POLICY_MERGE, name='plugin_output_status'
+        )
+        self.__event_bus.subscribe(
+            TOPIC_INPUTS,
+            lambda data: plugin_controller.process_input_status((data['input'], data['output'])),
+            name='plugin_input_status'
+        )
+        self.__event_bus.subscribe(
+            TOPIC_EVENTS, lambda data: plugin_controller.process_event(data['code']),
+            name='plugin_event'
+        )
+
+    def get_event_bus(self):
+        """ Get the event bus that delivers the messages of the master (OL, IL, SO, EV). """
+        return self.__event_bus
+
     def __init_master(self):
         """ Initialize the master: disable the async RO messages, enable async OL, IL and SO
         messages, enables multi-tenant thermostats. """
@@ -195,6 +337,7 @@ class GatewayApi(object):
 
             if write:
                 self.__master_communicator.do_command(master_api.activate_eeprom(), {'eep': 0})
+                self.__eeprom_controller.invalidate_cache([0])
 
             LOGGER.info('Turn master leds ON - disable low power mode')
             self.set_master_status_leds(True)
@@ -240,7 +383,9 @@ class GatewayApi(object):
             LOGGER.error('Got error while setting the time on the master.')
             traceback.print_exc()
         finally:
-            Timer(120, self.__run_master_timer).start()
+            timer = Timer(120, self.__run_master_timer)
+            timer.daemon = True
+            timer.start()
 
     def sync_master_time(self, reset_thermostats):
         """ Set the time on the master. """
@@ -296,20 +441,15 @@ class GatewayApi(object):
                                                                 {'module_nr': i})['status'])
 
         self.__shutter_status.init(configs, status)
+        self.__update_shutter_state()
 
     def __on_shutter_update(self, update):
         self.__shutter_status.handle_shutter_update(update)
+        self.__update_shutter_state()
 
         if self.__plugin_controller is not None:
             self.__plugin_controller.process_shutter_status(self.__shutter_status.get_status())
 
-    def __event_triggered(self, ev_output):
-        """ Handle an event triggered by the master. """
-        code = ev_output['code']
-
-        if self.__plugin_controller is not None:
-            self.__plugin_controller.process_event(code)
-
     # Maintenance functions
 
     def start_maintenance_mode(self, timeout=600):
@@ -321,7 +461,6 @@ class GatewayApi(object):
             msg = 'Exception while setting status leds before maintenance mode:' + str(exception)
             LOGGER.warning(msg)
 
-        self.__eeprom_controller.invalidate_cache()  # Eeprom can be changed in maintenance mode.
         self.__master_communicator.start_maintenance_mode()
 
         def check_maintenance_timeout():
@@ -364,12 +503,13 @@ class GatewayApi(object):
 
         if self.__thermostat_status is not None:
             self.__thermostat_status.force_refresh()
+        self.__thermostat_refresh.set()
 
         if self.__maintenance_timeout_timer is not None:
             self.__maintenance_timeout_timer.cancel()
             self.__maintenance_timeout_timer = None
 
-        self.__eeprom_controller.invalidate_cache()  # Eeprom can be changed in maintenance mode.
+        self.__verify_eeprom_cache()  # Eeprom can be changed in maintenance mode.
         self.__init_shutter_status()
 
         try:
@@ -460,9 +600,12 @@ class GatewayApi(object):
         ret = self.__master_communicator.do_command(master_api.module_discover_stop())
 
         self.__module_log = []
-        self.__eeprom_controller.invalidate_cache()
+        self.__verify_eeprom_cache(MODULE_BANKS)
         self.__eeprom_controller.dirty = True
 
+        if self.__output_status is not None:
+            self.__output_status.force_refresh()  # The number of outputs might have changed
+
         return {'status': ret['resp']}
 
     def module_discover_status(self):
@@ -496,27 +639,22 @@ class GatewayApi(object):
         shutters = []
         can_inputs = []
 
-        for i in range(mods['in']):
-            ret = self.__master_communicator.do_command(
-                master_api.read_eeprom(),
-                {'bank': 2 + i, 'addr': 252, 'num': 1}
-            )
-            is_can = ret['data'][0] == 'C'
-            ret = self.__master_communicator.do_command(
-                master_api.read_eeprom(),
-                {'bank': 2 + i, 'addr': 0, 'num': 1}
-            )
+        # Read the module types in one go, the eeprom file reads only the bytes that are not cached
+        input_addresses = [(EepromAddress(2 + i, 252, 1), EepromAddress(2 + i, 0, 1)) for i in range(mods['in'])]
+        output_addresses = [EepromAddress(33 + i, 0, 1) for i in range(mods['out'])]
+        eeprom_data = self.__eeprom_controller.read_addresses(
+            [address for addresses in input_addresses for address in addresses] + output_addresses
+        )
+
+        for (can_address, type_address) in input_addresses:
+            is_can = eeprom_data[can_address].bytes[0] == 'C'
             if is_can:
-                can_inputs.append(ret['data'][0])
+                can_inputs.append(eeprom_data[type_address].bytes[0])
             else:
-                inputs.append(ret['data'][0])
+                inputs.append(eeprom_data[type_address].bytes[0])
 
-        for i in range(mods['out']):
-            ret = self.__master_communicator.do_command(
-                master_api.read_eeprom(),
-                {'bank': 33 + i, 'addr': 0, 'num': 1}
-            )
-            outputs.append(ret['data'][0])
+        for address in output_addresses:
+            outputs.append(eeprom_data[address].bytes[0])
 
         for shutter in range(mods['shutter']):
             shutters.append('S')
@@ -555,15 +693,169 @@ class GatewayApi(object):
                                                                  {'id': i}))
         return outputs
 
+    def __run_output_engine(self, batch_size=8, tick=10):
+        """ Keeps the OutputStatus current, runs in a background thread with a low priority on
+        the master bus. The OutputStatus is seeded once by reading all outputs. Afterwards the
+        status is kept current by the OL messages, and batch_size outputs are reconciled with the
+        master every tick seconds (to update the timers and catch missed OL messages). A full
+        refresh is done every output_refresh_period seconds, when the OutputStatus is forced to
+        refresh (eg. after maintenance) or when a caller got a stale status, the callers get the
+        current status in the meantime.
+        """
+        set_thread_priority(PRIORITY_BACKGROUND)
+        while True:
+            requested = self.__output_refresh.is_set()
+            self.__output_refresh.clear()
+            try:
+                if not self.__output_status_seeded.is_set():
+                    self.__seed_output_status()
+                elif self.__output_status.should_refresh():
+                    self.__refresh_output_status()
+                elif requested:
+                    self.__refresh_output_status(self.__stale_status_age)
+                else:
+                    partial_updates = self.__output_status.get_partial_updates()
+                    outputs = [self.__master_communicator.do_command(master_api.read_output(),
+                                                                     {'id': output_id})
+                               for output_id in self.__output_status.get_reconcile_ids(batch_size)]
+                    self.__publish_output_changes(self.__output_status.update_outputs(outputs, partial_updates))
+                self.__update_output_state()
+            except InMaintenanceModeException:
+                pass
+            except CommunicationTimedOutException:
+                LOGGER.error('Got CommunicationTimedOutException while reading the outputs.')
+            except Exception:
+                LOGGER.exception('Got error while reading the outputs.')
+            self.__output_refresh.wait(tick if self.__output_status_seeded.is_set() else 1)
+
+    def __seed_output_status(self):
+        """ Create the OutputStatus by reading all outputs from the master, unless it was
+        created already. The read is shared: the callers that arrive while the outputs are read
+        (by the output engine or by another caller) wait for it. """
+        with self.__output_refresh_lock:
+            if self.__output_status is None:
+                self.__output_status = OutputStatus(self.__read_outputs(),
+                                                    refresh_period=self.__output_refresh_period)
+                self.__output_status_seeded.set()
+
+    def __update_output_state(self):
+        """ Update the outputs in the HomeState using the OutputStatus. """
+        self.__home_state.update_all('output', dict(
+            (output['id'], {'status': output['status'], 'dimmer': output['dimmer'], 'ctimer': output['ctimer']})
+            for output in self.__output_status.get_outputs()
+        ), complete=True)
+
+    def __refresh_output_status(self, max_age=None):
+        """ Read all outputs from the master, only one refresh runs at a time.
+
+        :param max_age: Skip the refresh if the status is not older than max_age seconds once \
+        the refresh can start (eg. because the caller waited for another refresh), None to \
+        always refresh.
+        """
+        with self.__output_refresh_lock:
+            if max_age is not None and self.__output_status.get_age() <= max_age:
+                return
+            self.__publish_output_changes(self.__output_status.full_update(self.__read_outputs()))
+
+    def __publish_output_changes(self, transitions):
+        """ Update the outputs that changed in the HomeState and publish their transitions. """
+        if len(transitions) == 0:
+            return
+        states = {}
+        for transition in transitions:
+            output = self.__output_status.get_output(transition['id'])
+            if output is not None:
+                states[output['id']] = {'status': output['status'], 'dimmer': output['dimmer'],
+                                        'ctimer': output['ctimer']}
+        self.__home_state.update_all('output', states)
+        self.__event_bus.publish(TOPIC_OUTPUT_CHANGES, transitions)
+
+    def __update_shutter_state(self):
+        """ Update the shutters in the HomeState using the ShutterStatus. """
+        self.__home_state.update_all('shutter', dict(
+            (shutter_id, {'status': status}) for shutter_id, status in enumerate(self.__shutter_status.get_status())
+        ), complete=True)
+
+    def __update_thermostat_state(self):
+        """ Update the thermostats in the HomeState using the thermostat status. """
+        status = self.get_thermostat_status()
+        self.__home_state.update('thermostat_group', 0, dict(
+            (key, status[key]) for key in ['thermostats_on', 'automatic', 'setpoint', 'cooling']
+        ))
+        self.__home_state.update_all('thermostat', dict(
+            (thermostat['id'], dict((key, value) for key, value in thermostat.iteritems() if key != 'id'))
+            for thermostat in status['status']
+        ), complete=True)
+
+    def __run_state_poller(self, period=10):
+        """ Polls the state of the sensors and the pulse counters for the HomeState, runs in a
+        background thread with a low priority on the master bus. """
+        set_thread_priority(PRIORITY_BACKGROUND)
+        while True:
+            try:
+                sensors = zip(self.get_sensor_temperature_status(),
+                              self.get_sensor_humidity_status(),
+                              self.get_sensor_brightness_status())
+                self.__home_state.update_all('sensor', dict(
+                    (sensor_id, {'temperature': temperature, 'humidity': humidity, 'brightness': brightness})
+                    for sensor_id, (temperature, humidity, brightness) in enumerate(sensors)
+                ), complete=True)
+                self.__home_state.update_all('pulse_counter', dict(
+                    (counter_id, {'value': value}) for counter_id, value in enumerate(self.get_pulse_counter_status())
+                ), complete=True)
+            except InMaintenanceModeException:
+                pass
+            except CommunicationTimedOutException:
+                LOGGER.error('Got CommunicationTimedOutException while polling the sensors and pulse counters.')
+            except Exception:
+                LOGGER.exception('Got error while polling the sensors and pulse counters.')
+            pytime.sleep(period)
+
+    def get_state(self, since=None, epoch=None):
+        """ Get the state of the outputs, inputs, shutters, sensors, thermostats and pulse
+        counters, see :func`HomeState.get_changes`.
+
+        :param since: The version of the last known state, None for a snapshot of all entities.
+        :type since: int
+        :param epoch: The epoch of the last known state.
+        :type epoch: int
+        :returns: dict with 'epoch', 'version', 'full' and 'state'.
+        """
+        return self.__home_state.get_changes(since, epoch)
+
+    def __verify_eeprom_cache(self, banks=None):
+        """ Mark eeprom banks as unverified and let the verifier read them from the master. The
+        cached banks are served until they are verified, only the banks that changed get a new
+        generation. """
+        self.__eeprom_controller.mark_unverified(banks)
+        self.__eeprom_verify.set()
+
+    def __run_eeprom_verifier(self, retry=60):
+        """ Verifies the cached eeprom banks against the master, runs in a background thread
+        with a low priority on the master bus. The banks are served from the cache in the
+        meantime. """
+        set_thread_priority(PRIORITY_BACKGROUND)
+        while True:
+            self.__eeprom_verify.wait()
+            self.__eeprom_verify.clear()
+            try:
+                changed = self.__eeprom_controller.verify_cache()
+                if len(changed) > 0:
+                    LOGGER.info('Eeprom banks changed on the master: {0}'.format(changed))
+            except InMaintenanceModeException:
+                pass  # The verifier is started again when maintenance mode is stopped
+            except Exception:
+                LOGGER.exception('Got error while verifying the eeprom cache.')
+                pytime.sleep(retry)
+                self.__eeprom_verify.set()
+
     def on_outputs(self, ol_output):
-        """ Update the OutputStatus when an OL is received. """
+        """ Update the OutputStatus when an OL is received, the transitions of the outputs that
+        changed are published on the event bus. """
         on_outputs = ol_output['outputs']
 
         if self.__output_status is not None:
-            self.__output_status.partial_update(on_outputs)
-
-        if self.__plugin_controller is not None:
-            self.__plugin_controller.process_output_status(on_outputs)
+            self.__publish_output_changes(self.__output_status.partial_update(on_outputs))
 
     def get_output_status(self):
         """ Get a list containing the status of the Outputs.
@@ -571,16 +863,30 @@ class GatewayApi(object):
         :returns: A list is a dicts containing the following keys: id, status, ctimer
         and dimmer.
         """
-        if self.__output_status is None:
-            self.__output_status = OutputStatus(self.__read_outputs())
+        return self.get_output_status_with_age()[0]
 
-        if self.__output_status.should_refresh():
-            self.__output_status.full_update(self.__read_outputs())
+    def get_output_status_with_age(self):
+        """ Get the status of the Outputs and the number of seconds since that status was
+        confirmed by the master.
 
-        outputs = self.__output_status.get_outputs()
+        :returns: tuple with a list of dicts containing the following keys: id, status, ctimer \
+        and dimmer; and the age of the status.
+        """
+        # The status is served from memory, only wait for the initial read of the outputs or for
+        # a refresh if the status was not confirmed by the master for too long. A stale status is
+        # returned right away and refreshed by the output engine.
+        if not self.__output_status_seeded.is_set():
+            self.__seed_output_status()
+        age = self.__output_status.get_age()
+        if age > self.__max_status_age:
+            self.__refresh_output_status(self.__max_status_age)
+        elif age > self.__stale_status_age:
+            self.__output_refresh.set()
+
+        outputs, age = self.__output_status.get_outputs_with_age()
         return [{'id': output['id'], 'status': output['status'],
                  'ctimer': output['ctimer'], 'dimmer': output['dimmer']}
-                for output in outputs]
+                for output in outputs], age
 
     def set_output(self, output_id, is_on, dimmer=None, timer=None):
         """ Set the status, dimmer and timer of an output.
@@ -648,24 +954,32 @@ class GatewayApi(object):
         if output_id < 0 or output_id > 240:
             raise ValueError('id not in [0, 240]: %d' % output_id)
 
-        if dimmer < 0 or dimmer > 100:
-            raise ValueError('Dimmer value not in [0, 100]: %d' % dimmer)
+        self.__master_communicator.do_command(
+            master_api.basic_action(),
+            {'action_type': GatewayApi.__get_dimmer_action(dimmer), 'action_number': output_id}
+        )
+
+        return dict()
+
+    @staticmethod
+    def __get_dimmer_action(dimmer):
+        """ Get the basic action that sets the dimmer of an output, the dimmer is rounded down
+        to a multiple of 10.
+
+        :raises: ValueError if the dimmer is not in [0, 100].
+        """
+        if not isinstance(dimmer, (int, long, float)) or isinstance(dimmer, bool) or \
+                dimmer < 0 or dimmer > 100:
+            raise ValueError('Dimmer value not in [0, 100]: {0}'.format(dimmer))
 
         dimmer = int(dimmer) / 10 * 10
 
         if dimmer == 0:
-            dimmer_action = master_api.BA_DIMMER_MIN
+            return master_api.BA_DIMMER_MIN
         elif dimmer == 100:
-            dimmer_action = master_api.BA_DIMMER_MAX
+            return master_api.BA_DIMMER_MAX
         else:
-            dimmer_action = master_api.__dict__['BA_LIGHT_ON_DIMMER_' + str(dimmer)]
-
-        self.__master_communicator.do_command(
-            master_api.basic_action(),
-            {'action_type': dimmer_action, 'action_number': output_id}
-        )
-
-        return dict()
+            return master_api.__dict__['BA_LIGHT_ON_DIMMER_' + str(dimmer)]
 
     def set_output_timer(self, output_id, timer):
         """ Set the timer of an output.
@@ -679,18 +993,121 @@ class GatewayApi(object):
         if output_id < 0 or output_id > 240:
             raise ValueError('id not in [0, 240]: %d' % output_id)
 
-        if timer not in [150, 450, 900, 1500, 2220, 3120]:
-            raise ValueError('Timer value not in [150, 450, 900, 1500, 2220, 3120]: %d' % timer)
-
-        timer_action = master_api.__dict__['BA_LIGHT_ON_TIMER_' + str(timer) + '_OVERRULE']
-
         self.__master_communicator.do_command(
             master_api.basic_action(),
-            {'action_type': timer_action, 'action_number': output_id}
+            {'action_type': GatewayApi.__get_timer_action(timer), 'action_number': output_id}
         )
 
         return dict()
 
+    @staticmethod
+    def __get_timer_action(timer):
+        """ Get the basic action that sets the timer of an output.
+
+        :raises: ValueError if the timer is not in [150, 450, 900, 1500, 2220, 3120].
+        """
+        if not isinstance(timer, (int, long)) or isinstance(timer, bool) or \
+                timer not in [150, 450, 900, 1500, 2220, 3120]:
+            raise ValueError('Timer value not in [150, 450, 900, 1500, 2220, 3120]: {0}'.format(timer))
+
+        return master_api.__dict__['BA_LIGHT_ON_TIMER_' + str(timer) + '_OVERRULE']
+
+    def set_outputs(self, outputs):
+        """ Set the status, dimmer and timer of multiple outputs (eg. a scene). The outputs are
+        validated against the cached outputs and output configurations, the actions that would not
+        change the cached state of an output are dropped and the remaining basic actions are sent
+        to the master in one pipelined batch. A failing output does not stop the other outputs.
+
+        :param outputs: list of dicts with the 'id' of the output, 'is_on' and optionally \
+        'dimmer' and 'timer' (see set_output).
+        :type outputs: list of dict
+        :returns: dict with 'outputs': a list with a dict per output, in the order of outputs: \
+        the 'id' of the output and the 'status': 'OK', 'UNCHANGED' (no actions were required) or \
+        'ERROR' (with the 'error' message).
+        :raises: ValueError if the outputs are not a list of dicts with an integer 'id', no \
+        actions are sent in that case.
+        """
+        check_outputs(outputs)
+        if not self.__output_status_seeded.is_set():
+            self.__seed_output_status()
+
+        current = dict((output.get('id'), self.__output_status.get_output(output.get('id')))
+                       for output in outputs)
+        module_types = dict(
+            (config.id, config.module_type) for config in self.__eeprom_controller.read_batch(
+                OutputConfiguration, [output_id for output_id in current if current[output_id] is not None],
+                ['module_type']
+            )
+        )
+
+        results = []
+        fields_list = []
+        actions = []  # The indexes of the results of the actions in fields_list
+        for output in outputs:
+            output_id = output.get('id')
+            result = {'id': output_id, 'status': 'OK'}
+            results.append(result)
+            try:
+                output_actions = self.__get_output_actions(output, current[output_id],
+                                                           module_types.get(output_id))
+            except ValueError as exception:
+                result['status'] = 'ERROR'
+                result['error'] = str(exception)
+                continue
+            if len(output_actions) == 0:
+                result['status'] = 'UNCHANGED'
+            for action_type in output_actions:
+                fields_list.append({'action_type': action_type, 'action_number': output_id})
+                actions.append(len(results) - 1)
+
+        if len(fields_list) > 0:
+            answers = self.__master_communicator.do_command_batch(master_api.basic_action(),
+                                                                  fields_list)
+            for index, answer in zip(actions, answers):
+                if answer is None or answer['resp'] != 'OK':
+                    results[index]['status'] = 'ERROR'
+                    results[index]['error'] = 'Basic action failed' if answer is not None else \
+                        'Communication timed out'
+
+        return {'outputs': results}
+
+    @staticmethod
+    def __get_output_actions(output, current, module_type):
+        """ Get the basic actions that bring an output in the requested state.
+
+        :param output: dict with the 'id', 'is_on', 'dimmer' and 'timer' of the output.
+        :param current: the cached Output, None if the output is not known.
+        :param module_type: the module type of the output configuration.
+        :returns: list of action types, in the order they should be executed.
+        :raises: ValueError if the requested state is not valid for the output.
+        """
+        if current is None:
+            raise ValueError('Unknown output: {0}'.format(output.get('id')))
+        if 'is_on' not in output:
+            raise ValueError('is_on is not set for output {0}'.format(output['id']))
+
+        dimmer = output.get('dimmer')
+        timer = output.get('timer')
+        if not output['is_on']:
+            if dimmer is not None or timer is not None:
+                raise ValueError('Cannot set timer and dimmer when setting output to off')
+            return [master_api.BA_LIGHT_OFF] if current['status'] != 0 else []
+
+        actions = []
+        if dimmer is not None:
+            if module_type not in ['d', 'D']:
+                raise ValueError('Output {0} is not a dimmer'.format(output['id']))
+            dimmer_action = GatewayApi.__get_dimmer_action(dimmer)
+            # The cached dimmer is not rounded, compare the actions that set both dimmers
+            if current['status'] == 0 or \
+                    GatewayApi.__get_dimmer_action(current['dimmer']) != dimmer_action:
+                actions.append(dimmer_action)
+        if current['status'] == 0:
+            actions.append(master_api.BA_LIGHT_ON)
+        if timer is not None:
+            actions.append(GatewayApi.__get_timer_action(timer))  # Restarts the timer
+        return actions
+
     def set_all_lights_off(self):
         """ Turn all lights off.
 
@@ -848,8 +1265,8 @@ class GatewayApi(object):
         """ Update the InputStatus with data from an IL message. """
         data_set = (api_data['input'], api_data['output'])
         self.__input_status.add_data(data_set)
-        if self.__plugin_controller is not None:
-            self.__plugin_controller.process_input_status(data_set)
+        self.__home_state.update('input', api_data['input'], {'output': api_data['output'],
+                                                              'last_pressed': pytime.time()})
 
     def get_last_inputs(self):
         """ Get the 5 last pressed inputs during the last 5 minutes.
@@ -884,16 +1301,10 @@ class GatewayApi(object):
 
         return thermostats
 
-    def get_thermostat_status(self):
-        """ Get the status of the thermostats. Note that the automatic and setpoint field returned
-        in the main dict are deprecated and reflect the state of the first thermostat.
-
-        :returns: dict with global status information about the thermostats: 'thermostats_on',
-        'automatic' (deprecated) and 'setpoint' (deprecated) and a list ('status') with status
-        information for all thermostats, each element in the list is a dict with the following keys:
-        'id', 'act', 'csetp', 'output0', 'output1', 'outside', 'mode', 'name', 'sensor_nr',
-        'automatic', 'setpoint'.
-        """
+    def __read_thermostat_status(self):
+        """ Read the status of the thermostats from the master, see get_thermostat_status. The
+        status of the thermostat outputs is not read: the thermostats contain the numbers of the
+        outputs ('output0_nr' and 'output1_nr') instead. """
         if self.__thermostat_status is None:
             self.__thermostat_status = ThermostatStatus(self.__get_all_thermostats(), 1800)
         elif self.__thermostat_status.should_refresh():
@@ -913,7 +1324,6 @@ class GatewayApi(object):
         (automatic, setpoint) = get_automatic_setpoint(thermostat_mode['mode0'])
 
         thermostats = []
-        outputs = self.get_output_status()
 
         cached_thermostats = self.__thermostat_status.get_thermostats()['cooling' if cooling else 'heating']
 
@@ -928,17 +1338,8 @@ class GatewayApi(object):
                               'mode': thermostat_mode['mode%d' % thermostat_id]}
                 (thermostat['automatic'], thermostat['setpoint']) = get_automatic_setpoint(thermostat['mode'])
 
-                output0_nr = cached_thermostats[thermostat_id]['output0_nr']
-                if output0_nr < len(outputs) and outputs[output0_nr]['status'] == 1:
-                    thermostat['output0'] = outputs[output0_nr]['dimmer']
-                else:
-                    thermostat['output0'] = 0
-
-                output1_nr = cached_thermostats[thermostat_id]['output1_nr']
-                if output1_nr < len(outputs) and outputs[output1_nr]['status'] == 1:
-                    thermostat['output1'] = outputs[output1_nr]['dimmer']
-                else:
-                    thermostat['output1'] = 0
+                thermostat['output0_nr'] = cached_thermostats[thermostat_id]['output0_nr']
+                thermostat['output1_nr'] = cached_thermostats[thermostat_id]['output1_nr']
 
                 thermostat['name'] = cached_thermostats[thermostat_id]['name']
                 thermostat['sensor_nr'] = cached_thermostats[thermostat_id]['sensor_nr']
@@ -953,6 +1354,57 @@ class GatewayApi(object):
                 'cooling': cooling,
                 'status': thermostats}
 
+    def __run_thermostat_engine(self, period):
+        """ Refreshes the thermostat status every period seconds, or right away after a write to
+        the thermostats. Runs in a background thread with a low priority on the master bus. """
+        set_thread_priority(PRIORITY_BACKGROUND)
+        while True:
+            try:
+                self.__thermostat_state.refresh()
+                self.__update_thermostat_state()
+            except InMaintenanceModeException:
+                pass
+            except CommunicationTimedOutException:
+                LOGGER.error('Got CommunicationTimedOutException while reading the thermostats.')
+            except Exception:
+                LOGGER.exception('Got error while reading the thermostats.')
+            self.__thermostat_refresh.wait(period)
+            self.__thermostat_refresh.clear()
+
+    def get_thermostat_status(self):
+        """ Get the status of the thermostats. Note that the automatic and setpoint field returned
+        in the main dict are deprecated and reflect the state of the first thermostat. The status
+        is served from memory, it is refreshed in the background. A status that is older than the
+        maximum status age is refreshed before it is returned.
+
+        :returns: dict with global status information about the thermostats: 'thermostats_on',
+        'automatic' (deprecated) and 'setpoint' (deprecated), 'timestamp' (the time the status
+        was read from the master), 'age' (the number of seconds since then) and a list ('status') with status information for all
+        thermostats, each element in the list is a dict with the following keys: 'id', 'act',
+        'csetp', 'output0', 'output1', 'outside', 'mode', 'name', 'sensor_nr', 'automatic',
+        'setpoint'.
+        """
+        status = self.__thermostat_state.get_status()
+        age = pytime.time() - self.__thermostat_state.get_last_update()
+        if status is None or age > self.__max_status_age:
+            self.__thermostat_state.refresh()
+            status = self.__thermostat_state.get_status()
+        elif age > self.__stale_status_age:
+            self.__thermostat_refresh.set()  # Served stale, refreshed by the thermostat engine
+        status['timestamp'] = self.__thermostat_state.get_last_update()
+        status['age'] = pytime.time() - status['timestamp']
+
+        outputs = self.get_output_status()
+        for thermostat in status['status']:
+            for output in ['output0', 'output1']:
+                output_nr = thermostat.pop(output + '_nr')
+                if output_nr < len(outputs) and outputs[output_nr]['status'] == 1:
+                    thermostat[output] = outputs[output_nr]['dimmer']
+                else:
+                    thermostat[output] = 0
+
+        return status
+
     @staticmethod
     def __check_thermostat(thermostat):
         """ :raises ValueError if thermostat not in range [0, 32]. """
@@ -974,6 +1426,8 @@ class GatewayApi(object):
                                               {'thermostat': thermostat,
                                                'config': 0,
                                                'temp': master_api.Svt.temp(temperature)})
+        self.__thermostat_state.update_thermostat(thermostat, {'csetp': temperature})
+        self.__thermostat_refresh.set()
 
         return {'status': 'OK'}
 
@@ -1042,6 +1496,7 @@ class GatewayApi(object):
             check_basic_action(self.__master_communicator.do_basic_action(
                 getattr(master_api, 'BA_ALL_SETPOINT_{0}'.format(setpoint)), 0
             ))
+        self.__thermostat_refresh.set()
 
         return {'status': 'OK'}
 
@@ -1080,6 +1535,7 @@ class GatewayApi(object):
                 {'id': thermostat_id, 'automatic': automatic, 'setpoint': setpoint}
             )
         )
+        self.__thermostat_refresh.set()
 
         return {'status': 'OK'}
 
@@ -1108,6 +1564,7 @@ class GatewayApi(object):
         check_basic_action(self.__master_communicator.do_basic_action(
             master_api.BA_THERMOSTAT_AIRCO_STATUS, modifier + thermostat_id
         ))
+        self.__thermostat_refresh.set()
 
         return {'status': 'OK'}
 
@@ -1251,7 +1708,8 @@ class GatewayApi(object):
 
         try:
             with open('{0}/master.eep'.format(tmp_sqlite_dir), 'w') as eeprom_file:
-                eeprom_file.write(self.get_master_backup())
+                for data in self.get_master_backup():
+                    eeprom_file.write(data)
 
             for filename, source in {'config.db': constants.get_config_database_file(),
                                      'scheduled.db': constants.get_scheduling_database_file(),
@@ -1397,45 +1855,67 @@ class GatewayApi(object):
             threading.Timer(1, lambda: os._exit(0)).start()
 
     def get_master_backup(self):
-        """ Get a backup of the eeprom of the master.
+        """ Get a backup of the eeprom of the master. The cached banks that were verified against
+        the master are served immediately, the other banks are read from the master while
+        streaming. The first bank is read before this returns, so an error (eg. maintenance mode
+        or a timeout) is raised before anything is streamed. An error while streaming is raised
+        by the generator, the backup is never cut short without an error.
 
-        :returns: String of bytes (size = 64kb).
+        :returns: generator of strings of bytes, one per bank (total size = 64kb).
+        :raises: InMaintenanceModeException or CommunicationTimedOutException if the first bank \
+        could not be read.
         """
-        output = ""
-        for bank in range(0, 256):
-            output += self.__master_communicator.do_command(
-                master_api.eeprom_list(),
-                {'bank': bank}
-            )['data']
-        return output
+        banks = self.__eeprom_controller.iter_banks(range(NUM_BANKS))
+        with command_priority(PRIORITY_BACKGROUND):
+            (_, first) = next(banks)
+        return GatewayApi.__stream_banks(first, banks)
 
-    def master_restore(self, data):
-        """ Restore a backup of the eeprom of the master.
+    @staticmethod
+    def __stream_banks(first, banks):
+        """ Yield the data of the first bank and of the remaining banks of a backup. """
+        yield first
+        while True:
+            with command_priority(PRIORITY_BACKGROUND):
+                (_, data) = next(banks, (None, None))
+            if data is None:
+                return
+            yield data
+
+    def master_restore(self, data, progress=None):
+        """ Restore a backup of the eeprom of the master. The backup is compared to the eeprom
+        and only the changed bytes are written, a number of banks at a time. The cached banks that
+        were not verified against the master are read from the master before they are compared.
 
         :param data: The eeprom backup to restore.
         :type data: string of bytes (size = 64 kb).
+        :param progress: function that is called with the number of banks restored and the total \
+        number of banks.
         :returns: dict with 'output' key (contains an array with the addresses that were written).
         """
         ret = []
-        (num_banks, bank_size, write_size) = (256, 256, 10)
-
-        for bank in range(0, num_banks):
-            read = self.__master_communicator.do_command(master_api.eeprom_list(),
-                                                         {'bank': bank})['data']
-            for addr in range(0, bank_size, write_size):
-                orig = read[addr:addr + write_size]
-                new = data[bank * bank_size + addr: bank * bank_size + addr + len(orig)]
-                if new != orig:
-                    ret.append('B' + str(bank) + 'A' + str(addr))
-
-                    self.__master_communicator.do_command(
-                        master_api.write_eeprom(),
-                        {'bank': bank, 'address': addr, 'data': new}
-                    )
+        written_banks = set()
+        (num_banks, chunk_size) = (min(NUM_BANKS, (len(data) + BANK_SIZE - 1) / BANK_SIZE), 16)
+
+        for start in range(0, num_banks, chunk_size):
+            banks = range(start, min(start + chunk_size, num_banks))
+            eeprom_data = []
+            for bank in banks:
+                bank_data = data[bank * BANK_SIZE:(bank + 1) * BANK_SIZE]
+                eeprom_data.append(EepromData(EepromAddress(bank, 0, len(bank_data)), bank_data))
+
+            for (bank, addr, _) in self.__eeprom_controller.write_addresses(eeprom_data):
+                ret.append('B' + str(bank) + 'A' + str(addr))
+                written_banks.add(bank)
+
+            LOGGER.info('Restored eeprom banks {0}/{1}'.format(banks[-1] + 1, num_banks))
+            if progress is not None:
+                progress(banks[-1] + 1, num_banks)
 
         self.__master_communicator.do_command(master_api.activate_eeprom(), {'eep': 0})
         ret.append('Activated eeprom')
 
+        self.__verify_eeprom_cache(written_banks)
+
         return {'output': ret}
 
     def master_reset(self):
@@ -1462,6 +1942,20 @@ class GatewayApi(object):
         """
         return self.__master_communicator.get_seconds_since_last_success()
 
+    def master_queue_statistics(self):
+        """ Get the queue depth and wait times per priority class of the master commands. """
+        return self.__master_communicator.get_queue_statistics()
+
+    def eeprom_cache_status(self):
+        """ Get the progress of the eeprom cache warmer, see
+        :func`EepromController.get_warmer_status`. """
+        return self.__eeprom_controller.get_warmer_status()
+
+    def master_communication_statistics(self):
+        """ Get the counts, timeouts, crc failures and latencies per master action, the serial bus
+        utilization and the command lock wait times. """
+        return self.__master_communicator.get_communication_statistics()
+
     def power_last_success(self):
         """ Get the number of seconds since the last successful communication with the power
         modules.
@@ -2244,6 +2738,53 @@ class GatewayApi(object):
 
     # End of auto generated functions
 
+    def set_configurations(self, config):
+        """
+        Set the configurations of multiple types at once, the configurations are validated before
+        anything is written and the eeprom is activated only once.
+
+        :param config: dict mapping the configuration type (see CONFIGURATION_MODELS, eg. 'output' \
+        or 'group_action') on a list of configuration dicts, or on one configuration dict for the \
+        configurations without an id (eg. 'global_thermostat').
+        :type config: dict
+        :raises: ValueError if a configuration type is not known.
+        """
+        config = dict((config_type, [configs] if isinstance(configs, dict) else configs)
+                      for config_type, configs in config.iteritems())
+        # The timers are collected first: deserialize removes the id from the configurations
+        timers = dict((o['id'], o.get('timer')) for o in config.get('output', []))
+        transaction = self.__eeprom_controller.transaction()
+        for config_type, configs in config.iteritems():
+            eeprom_model = CONFIGURATION_MODELS.get(config_type)
+            if eeprom_model is None:
+                raise ValueError('Unknown configuration type: {0}'.format(config_type))
+            transaction.write_batch([eeprom_model.deserialize(o) for o in configs])
+        transaction.commit()
+
+        for output_nr, timer in timers.iteritems():
+            if timer is not None:
+                self.__master_communicator.do_command(
+                    master_api.write_timer(),
+                    {'id': output_nr, 'timer': timer}
+                )
+        if 'shutter' in config:
+            self.__init_shutter_status()
+
+    def get_eeprom_generation(self):
+        """ Get the generation of the eeprom, it is incremented every time the eeprom (or an
+        eeprom extension) changes. """
+        return self.__eeprom_controller.get_generation()
+
+    def has_eeprom_changed(self, since, eeprom_models):
+        """ Check whether the data of EepromModels changed since a generation of the eeprom.
+
+        :param since: the generation (see get_eeprom_generation), None to always return True.
+        :type since: int
+        :param eeprom_models: the EepromModels to check.
+        :type eeprom_models: list of class
+        """
+        return self.__eeprom_controller.has_changed(eeprom_models, since)
+
     def get_reset_eeprom_dirty_flag(self):
         dirty = self.__eeprom_controller.dirty
         self.__eeprom_controller.dirty = False
@@ -21,6 +21,9 @@ import logging
 from threading import Thread, Event
 from collections import deque
 from serial_utils import CommunicationTimedOutException
+from master.command_scheduler import set_thread_priority, PRIORITY_BACKGROUND
+from master.eeprom_models import InputConfiguration, OutputConfiguration, SensorConfiguration, \
+    PulseCounterConfiguration
 
 LOGGER = logging.getLogger("openmotics")
 
@@ -169,7 +172,13 @@ class MetricsCollector(object):
         args = [name]
         if interval is not None:
             args.append(interval)
-        thread = Thread(target=workload, args=args)
+
+        def run():
+            """ Collect the metrics with a low priority on the master bus. """
+            set_thread_priority(PRIORITY_BACKGROUND)
+            workload(*args)
+
+        thread = Thread(target=run)
         thread.setName('Metric collector ({0})'.format(name))
         thread.daemon = True
         thread.start()
@@ -189,28 +198,21 @@ class MetricsCollector(object):
             sleep = max(0.1, interval - elapsed)
             time.sleep(sleep)
 
-    def on_output(self, data):
+    def on_output(self, transitions):
+        """ Process the transitions of the outputs that changed, see OutputStatus. """
         try:
-            on_outputs = {entry[0]: entry[1] for entry in data['outputs']}
             outputs = self._environment['outputs']
             changed_output_ids = []
-            for output_id in outputs:
-                status = outputs[output_id].get('status')
-                dimmer = outputs[output_id].get('dimmer')
-                if status is None or dimmer is None:
+            for transition in transitions:
+                output_id = transition['id']
+                if output_id not in outputs:
                     continue
-                changed = False
-                if output_id in on_outputs:
-                    if status != 1:
-                        changed = True
-                        outputs[output_id]['status'] = 1
-                    if dimmer != on_outputs[output_id]:
-                        changed = True
-                        outputs[output_id]['dimmer'] = on_outputs[output_id]
-                elif status != 0:
-                    changed = True
-                    outputs[output_id]['status'] = 0
-                if changed is True:
+                output = outputs[output_id]
+                if output.get('status') is None or output.get('dimmer') is None:
+                    continue
+                output['status'] = transition['new']['status']
+                output['dimmer'] = transition['new']['dimmer']
+                if output_id not in changed_output_ids:
                     changed_output_ids.append(output_id)
             self._process_outputs(changed_output_ids, 'output')
         except Exception as ex:
@@ -325,6 +327,31 @@ class MetricsCollector(object):
                                               timestamp=now)
                 except Exception as ex:
                     LOGGER.error('Could not collect metric metrics: {0}'.format(ex))
+            try:
+                statistics = self._gateway_api.master_communication_statistics()
+                bus = statistics['bus']
+                lock = statistics['lock']
+                self._enqueue_metrics(metric_type=metric_type,
+                                      tags={'name': 'master',
+                                            'section': 'bus'},
+                                      values={'bytes_read_per_sec': bus['bytes_read_per_sec'],
+                                              'bytes_written_per_sec': bus['bytes_written_per_sec'],
+                                              'duty_cycle': bus['duty_cycle'],
+                                              'lock_wait_avg': lock['avg'],
+                                              'lock_wait_max': lock['max']},
+                                      timestamp=now)
+                for action, action_statistics in statistics['actions'].iteritems():
+                    self._enqueue_metrics(metric_type=metric_type,
+                                          tags={'name': 'master',
+                                                'section': action},
+                                          values={'commands': action_statistics['count'],
+                                                  'timeouts': action_statistics['timeouts'],
+                                                  'crc_failures': action_statistics['crc_failures'],
+                                                  'latency_avg': action_statistics['avg'],
+                                                  'latency_max': action_statistics['max']},
+                                          timestamp=now)
+            except Exception as ex:
+                LOGGER.error('Could not collect master communication metrics: {0}'.format(ex))
             if self._stopped:
                 return
             self._pause(start, metric_type)
@@ -614,76 +641,94 @@ class MetricsCollector(object):
             self._pause(start, metric_type)
 
     def _load_environment_configurations(self, name, interval):
+        since = None
         while not self._stopped:
             start = time.time()
+            # Only the configurations that changed since the last load are loaded again
+            generation = self._gateway_api.get_eeprom_generation()
+            loaded = True
             # Inputs
             try:
-                result = self._gateway_api.get_input_configurations()
-                ids = []
-                for config in result:
-                    input_id = config['id']
-                    ids.append(input_id)
-                    self._environment['inputs'][input_id] = config
-                for input_id in self._environment['inputs'].keys():
-                    if input_id not in ids:
-                        del self._environment['inputs'][input_id]
+                if self._gateway_api.has_eeprom_changed(since, [InputConfiguration]):
+                    result = self._gateway_api.get_input_configurations()
+                    ids = []
+                    for config in result:
+                        input_id = config['id']
+                        ids.append(input_id)
+                        self._environment['inputs'][input_id] = config
+                    for input_id in self._environment['inputs'].keys():
+                        if input_id not in ids:
+                            del self._environment['inputs'][input_id]
             except CommunicationTimedOutException:
+                loaded = False
                 MetricsCollector._log('Error while loading input configurations: CommunicationTimedOutException')
             except Exception as ex:
+                loaded = False
                 MetricsCollector._log('Error while loading input configurations: {0}'.format(ex))
             # Outputs
             try:
-                result = self._gateway_api.get_output_configurations()
-                ids = []
-                for config in result:
-                    if config['module_type'] not in ['o', 'O', 'd', 'D']:
-                        continue
-                    output_id = config['id']
-                    ids.append(output_id)
-                    self._environment['outputs'][output_id] = {'name': config['name'],
-                                                               'module_type': {'o': 'output',
-                                                                               'O': 'output',
-                                                                               'd': 'dimmer',
-                                                                               'D': 'dimmer'}[config['module_type']],
-                                                               'floor': config['floor'],
-                                                               'type': 'relay' if config['type'] == 0 else 'light'}
-                for output_id in self._environment['outputs'].keys():
-                    if output_id not in ids:
-                        del self._environment['outputs'][output_id]
+                if self._gateway_api.has_eeprom_changed(since, [OutputConfiguration]):
+                    result = self._gateway_api.get_output_configurations()
+                    ids = []
+                    for config in result:
+                        if config['module_type'] not in ['o', 'O', 'd', 'D']:
+                            continue
+                        output_id = config['id']
+                        ids.append(output_id)
+                        self._environment['outputs'][output_id] = {'name': config['name'],
+                                                                   'module_type': {'o': 'output',
+                                                                                   'O': 'output',
+                                                                                   'd': 'dimmer',
+                                                                                   'D': 'dimmer'}[config['module_type']],
+                                                                   'floor': config['floor'],
+                                                                   'type': 'relay' if config['type'] == 0 else 'light'}
+                    for output_id in self._environment['outputs'].keys():
+                        if output_id not in ids:
+                            del self._environment['outputs'][output_id]
             except CommunicationTimedOutException:
+                loaded = False
                 LOGGER.error('Error while loading output configurations: CommunicationTimedOutException')
             except Exception as ex:
+                loaded = False
                 MetricsCollector._log('Error while loading output configurations: {0}'.format(ex))
             # Sensors
             try:
-                result = self._gateway_api.get_sensor_configurations()
-                ids = []
-                for config in result:
-                    input_id = config['id']
-                    ids.append(input_id)
-                    self._environment['sensors'][input_id] = config
-                for input_id in self._environment['sensors'].keys():
-                    if input_id not in ids:
-                        del self._environment['sensors'][input_id]
+                if self._gateway_api.has_eeprom_changed(since, [SensorConfiguration]):
+                    result = self._gateway_api.get_sensor_configurations()
+                    ids = []
+                    for config in result:
+                        input_id = config['id']
+                        ids.append(input_id)
+                        self._environment['sensors'][input_id] = config
+                    for input_id in self._environment['sensors'].keys():
+                        if input_id not in ids:
+                            del self._environment['sensors'][input_id]
             except CommunicationTimedOutException:
+                loaded = False
                 LOGGER.error('Error while loading sensor configurations: CommunicationTimedOutException')
             except Exception as ex:
+                loaded = False
                 MetricsCollector._log('Error while loading sensor configurations: {0}'.format(ex))
             # Pulse counters
             try:
-                result = self._gateway_api.get_pulse_counter_configurations()
-                ids = []
-                for config in result:
-                    input_id = config['id']
-                    ids.append(input_id)
-                    self._environment['pulse_counters'][input_id] = config
-                for input_id in self._environment['pulse_counters'].keys():
-                    if input_id not in ids:
-                        del self._environment['pulse_counters'][input_id]
+                if self._gateway_api.has_eeprom_changed(since, [PulseCounterConfiguration]):
+                    result = self._gateway_api.get_pulse_counter_configurations()
+                    ids = []
+                    for config in result:
+                        input_id = config['id']
+                        ids.append(input_id)
+                        self._environment['pulse_counters'][input_id] = config
+                    for input_id in self._environment['pulse_counters'].keys():
+                        if input_id not in ids:
+                            del self._environment['pulse_counters'][input_id]
             except CommunicationTimedOutException:
+                loaded = False
                 LOGGER.error('Error while loading pulse counter configurations: CommunicationTimedOutException')
             except Exception as ex:
+                loaded = False
                 MetricsCollector._log('Error while loading pulse counter configurations: {0}'.format(ex))
+            if loaded:
+                since = generation
             if self._stopped:
                 return
             self._pause(start, name, interval)
@@ -741,6 +786,46 @@ class MetricsCollector(object):
                          {'name': 'cloud_time_ago_try',
                           'description': 'Time passed since the last try sending metrics to the Cloud',
                           'type': 'gauge',
+                          'unit': 'seconds'},
+                         {'name': 'bytes_read_per_sec',
+                          'description': 'Bytes read from the master serial bus',
+                          'type': 'gauge',
+                          'unit': 'B/s'},
+                         {'name': 'bytes_written_per_sec',
+                          'description': 'Bytes written to the master serial bus',
+                          'type': 'gauge',
+                          'unit': 'B/s'},
+                         {'name': 'duty_cycle',
+                          'description': 'Fraction of the time a master command was waiting for an answer',
+                          'type': 'gauge',
+                          'unit': ''},
+                         {'name': 'lock_wait_avg',
+                          'description': 'Average time waited for the master command lock',
+                          'type': 'gauge',
+                          'unit': 'seconds'},
+                         {'name': 'lock_wait_max',
+                          'description': 'Maximum time waited for the master command lock',
+                          'type': 'gauge',
+                          'unit': 'seconds'},
+                         {'name': 'commands',
+                          'description': 'Master commands answered',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'timeouts',
+                          'description': 'Master commands that timed out',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'crc_failures',
+                          'description': 'Master answers with a bad crc',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'latency_avg',
+                          'description': 'Average master command latency',
+                          'type': 'gauge',
+                          'unit': 'seconds'},
+                         {'name': 'latency_max',
+                          'description': 'Maximum master command latency',
+                          'type': 'gauge',
                           'unit': 'seconds'}]},
             # inputs / events
             {'type': 'event',
@@ -25,6 +25,7 @@ from croniter import croniter
 from random import randint
 from threading import Thread
 from gateway.webservice import params_parser
+from master.command_scheduler import set_thread_priority, PRIORITY_SCHEDULED
 try:
     import json
 except ImportError:
@@ -228,6 +229,7 @@ class SchedulingController(object):
         :param schedule: Schedule to execute
         :type schedule: gateway.scheduling.Schedule
         """
+        set_thread_priority(PRIORITY_SCHEDULED)
         try:
             LOGGER.info("Executing schedule '{0}' ({1}) with arguments {2}".format(schedule.name, schedule.schedule_type, schedule.arguments))
 
@@ -32,6 +32,7 @@ from cherrypy.lib.static import serve_file
 from ws4py.websocket import WebSocket
 from ws4py.server.cherrypyserver import WebSocketPlugin, WebSocketTool
 from master.master_communicator import InMaintenanceModeException
+from master.eeprom_image import NUM_BANKS, BANK_SIZE
 from platform_utils import System
 
 try:
@@ -527,9 +528,31 @@ class WebInterface(object):
         """
         Get the status of the outputs.
 
-        :returns: 'status': list of dictionaries with the following keys: id, status, dimmer and ctimer.
+        :returns: 'status': list of dictionaries with the following keys: id, status, dimmer and ctimer, \
+            'age': the number of seconds since the status was confirmed by the master.
         """
-        return {'status': self._gateway_api.get_output_status()}
+        status, age = self._gateway_api.get_output_status_with_age()
+        return {'status': status, 'age': age}
+
+    @openmotics_api(auth=True, check=types(since=int, epoch=int))
+    def get_state(self, since=None, epoch=None):
+        """
+        Get the state of the outputs, inputs, shutters, sensors, thermostats and pulse counters.
+        Without since, all entities are returned. With since (the version of a previous call),
+        only the entities that changed since that version are returned.
+
+        :param since: The version returned by a previous call.
+        :type since: int
+        :param epoch: The epoch returned by a previous call, all entities are returned if the \
+            epoch changed (eg. after a restart).
+        :type epoch: int
+        :returns: 'epoch', 'version' (pass it as since in the next call), 'full' (whether all \
+            entities are returned, eg. after a restart or when entities were removed) and 'state': dict with the entity type ('output', 'input', \
+            'shutter', 'sensor', 'thermostat', 'thermostat_group' and 'pulse_counter') as key and \
+            a list of the (changed) entities, each a dict with the 'id' and the state, as value.
+        :rtype: dict
+        """
+        return self._gateway_api.get_state(since, epoch)
 
     @openmotics_api(auth=True, check=types(id=int, is_on=bool, dimmer=int, timer=int))
     def set_output(self, id, is_on, dimmer=None, timer=None):
@@ -547,6 +570,20 @@ class WebInterface(object):
         """
         return self._gateway_api.set_output(id, is_on, dimmer, timer)
 
+    @openmotics_api(auth=True, check=types(outputs='json'))
+    def set_outputs(self, outputs):
+        """
+        Set the status, dimmer and timer of multiple outputs. The actions that would not change
+        the state of an output are skipped, the other actions are sent to the master in one batch.
+
+        :param outputs: List of dicts with the 'id' of the output, 'is_on' and optionally \
+        'dimmer' and 'timer'.
+        :type outputs: list
+        :returns: 'outputs': list with the 'id' and 'status' ('OK', 'UNCHANGED' or 'ERROR' with \
+        an 'error' message) of every output.
+        """
+        return self._gateway_api.set_outputs(outputs)
+
     @openmotics_api(auth=True)
     def set_all_lights_off(self):
         """
@@ -676,9 +713,10 @@ class WebInterface(object):
         Get the status of the thermostats.
 
         :returns: global status information about the thermostats: 'thermostats_on', \
-            'automatic' and 'setpoint' and 'status': a list with status information for all \
-            thermostats, each element in the list is a dict with the following keys: \
-            'id', 'act', 'csetp', 'output0', 'output1', 'outside', 'mode'.
+            'automatic' and 'setpoint', 'timestamp' (the time the status was read from the master), \
+            'age' (the number of seconds since then) and 'status': a list with status information for all thermostats, each element in the \
+            list is a dict with the following keys: 'id', 'act', 'csetp', 'output0', 'output1', \
+            'outside', 'mode'.
         :rtype: dict
         """
         return self._gateway_api.get_thermostat_status()
@@ -880,11 +918,16 @@ class WebInterface(object):
         Get a backup of the eeprom of the master.
 
         :returns: This function does not return a dict, unlike all other API functions: it \
-            returns a string of bytes (size = 64kb).
+            streams a string of bytes (size = 64kb). An error before the streaming starts (eg. \
+            maintenance mode) is returned as an error response. An error while streaming aborts \
+            the connection: the body is shorter than the Content-Length.
         :rtype: bytearray
         """
+        backup = self._gateway_api.get_master_backup()
         cherrypy.response.headers['Content-Type'] = 'application/octet-stream'
-        return self._gateway_api.get_master_backup()
+        cherrypy.response.headers['Content-Length'] = str(NUM_BANKS * BANK_SIZE)
+        return backup
+    get_master_backup._cp_config['response.stream'] = True
 
     @openmotics_api(auth=True)
     def master_restore(self, data):
@@ -924,6 +967,45 @@ class WebInterface(object):
                 'master_last_success': master_last,
                 'power_last_success': power_last}
 
+    @openmotics_api(auth=True)
+    def get_master_queue_statistics(self):
+        """
+        Get the statistics of the queues in front of the master, per priority class (interactive, \
+        scheduled, plugin and background).
+
+        :returns: 'statistics': dict with the priority class as key and a dict with \
+            'queue_depth', 'commands', 'avg_wait_time' and 'max_wait_time' (in sec) as value.
+        :rtype: dict
+        """
+        return {'statistics': self._gateway_api.master_queue_statistics()}
+
+    @openmotics_api(auth=True)
+    def get_master_communication_statistics(self):
+        """
+        Get the instrumentation of the communication with the master.
+
+        :returns: 'statistics': dict with 'actions' (per master action: 'count', 'avg', 'max', \
+            'histogram', 'timeouts' and 'crc_failures'), 'bus' ('bytes_read', 'bytes_written', \
+            'bytes_read_per_sec', 'bytes_written_per_sec' and 'duty_cycle') and 'lock' (the wait \
+            times for the command lock: 'count', 'avg', 'max' and 'histogram'). Times are in sec, \
+            the histogram is a list of [upper bound in ms, count].
+        :rtype: dict
+        """
+        return {'statistics': self._gateway_api.master_communication_statistics()}
+
+    @openmotics_api(auth=True)
+    def get_eeprom_cache_status(self):
+        """
+        Get the progress of the warmer that reads the configurations in the background when the
+        master is idle.
+
+        :returns: 'status': dict with 'running' (bool), 'models' (the configurations, in the \
+            order they are warmed), 'banks' (the number of eeprom banks to warm) and 'cached' \
+            (the number of those banks that are cached).
+        :rtype: dict
+        """
+        return {'status': self._gateway_api.eeprom_cache_status()}
+
     @openmotics_api(auth=True)
     def master_clear_error_list(self):
         """
@@ -1791,6 +1873,23 @@ class WebInterface(object):
         self._gateway_api.set_room_configurations(config)
         return {}
 
+    @openmotics_api(auth=True, check=types(config='json'))
+    def set_configurations(self, config):
+        """
+        Set the configurations of multiple types at once, with a single activation of the eeprom.
+        Nothing is written if one of the configurations is invalid.
+
+        :param config: dict mapping the configuration type ('output', 'shutter', 'shutter_group', \
+            'input', 'thermostat', 'sensor', 'pump_group', 'cooling', 'cooling_pump_group', \
+            'global_rtd10', 'rtd10_heating', 'rtd10_cooling', 'group_action', 'scheduled_action', \
+            'pulse_counter', 'startup_action', 'dimmer', 'global_thermostat', 'can_led' or 'room') \
+            on a list of configurations of that type (see set_<type>_configurations), or on a \
+            single configuration for the types without an id.
+        :type config: dict
+        """
+        self._gateway_api.set_configurations(config)
+        return {}
+
     @openmotics_api(auth=True)
     def get_reset_dirty_flag(self):
         """
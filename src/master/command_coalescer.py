@@ -0,0 +1,170 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The command coalescer makes concurrent callers of the same read-only master command share one
+round trip on the serial bus (single-flight), and optionally caches the result for a short time.
+"""
+
+import copy
+import time
+from threading import Lock, Event
+from command_scheduler import get_thread_priority
+
+
+class CommandCoalescer(object):
+    """ Coalesces identical read-only master commands. Only the commands that were registered
+    using enable() are coalesced, all other commands are executed as is and invalidate the cached
+    results of the read commands that depend on them. """
+
+    def __init__(self):
+        """ Default constructor. """
+        self.__lock = Lock()
+        self.__settings = {}  # Maps the action of a read command on its ttl
+        self.__dependents = {}  # Maps the action of a write command on the read actions it changes
+        self.__generations = {}  # Maps the action of a read command on its cache generation
+        self.__flights = {}  # Maps the key and priority of a command on the Flight that is executing it
+        self.__cache = {}  # Maps the key of a command on a tuple (expiry time, result)
+
+    def enable(self, cmd, ttl=0, invalidated_by=None):
+        """ Enable coalescing for a read-only command.
+
+        :param cmd: The read-only command.
+        :type cmd: :class`MasterCommandSpec`
+        :param ttl: The number of seconds the result is cached, 0 for no caching.
+        :type ttl: float
+        :param invalidated_by: The commands that change the result of the read-only command.
+        :type invalidated_by: list of :class`MasterCommandSpec`
+        """
+        with self.__lock:
+            self.__settings[cmd.action] = ttl
+            self.__generations.setdefault(cmd.action, 0)
+            for write_cmd in (invalidated_by or []):
+                self.__dependents.setdefault(write_cmd.action, set()).add(cmd.action)
+
+    def invalidate(self, actions=None):
+        """ Invalidate the cached results.
+
+        :param actions: The actions of the read commands to invalidate, None for all.
+        :type actions: list of strings or None
+        """
+        with self.__lock:
+            if actions is None:
+                actions = self.__settings.keys()
+            self.__invalidate(actions)
+
+    def invalidate_dependents(self, cmd):
+        """ Invalidate the cached results of the read commands that are changed by a command.
+
+        :param cmd: The command that was executed.
+        :type cmd: :class`MasterCommandSpec`
+        """
+        dependents = self.__dependents.get(cmd.action)
+        if dependents is not None:
+            self.invalidate(dependents)
+
+    def __invalidate(self, actions):
+        """ Invalidate the cached results of some actions, the lock should be held. """
+        for action in actions:
+            self.__generations[action] += 1
+        for key in self.__cache.keys():
+            if key[0] in actions:
+                del self.__cache[key]
+        # New callers should not join the running flights, these might return old data
+        for key in self.__flights.keys():
+            if key[0] in actions:
+                del self.__flights[key]
+
+    def execute(self, cmd, fields, do_command, priority=None):
+        """ Execute a command, coalescing it with identical commands if it was enabled. A caller
+        only joins the flights of the same or a higher priority class: a flight of a lower
+        priority class might wait behind the commands of the caller's class.
+
+        :param cmd: The command to execute.
+        :type cmd: :class`MasterCommandSpec`
+        :param fields: The input fields of the command.
+        :type fields: dict
+        :param do_command: Function without arguments that sends the command to the master.
+        :param priority: The priority class of the command (see command_scheduler), None to use \
+        the priority class of the calling thread.
+        :type priority: integer or None
+        :returns: dict containing the output fields of the command, every caller gets its own \
+        copy of the shared result.
+        """
+        if cmd.action not in self.__settings:
+            try:
+                return do_command()
+            finally:
+                self.invalidate_dependents(cmd)
+
+        try:
+            key = (cmd.action, tuple(sorted(fields.items())))
+            hash(key)
+        except TypeError:
+            return do_command()  # Fields that can't be hashed can't be coalesced
+
+        with self.__lock:
+            cached = self.__cache.get(key)
+            if cached is not None and cached[0] > time.time():
+                return copy.deepcopy(cached[1])
+
+            if priority is None:
+                priority = get_thread_priority()
+            flight = None
+            for flight_priority in xrange(priority + 1):
+                flight = self.__flights.get(key + (flight_priority,))
+                if flight is not None:
+                    break
+            leader = flight is None
+            if leader:
+                flight = Flight(self.__generations[cmd.action])
+                self.__flights[key + (priority,)] = flight
+
+        if not leader:
+            return flight.get()
+
+        try:
+            flight.result = do_command()
+        except Exception as exception:
+            flight.exception = exception
+            raise
+        finally:
+            with self.__lock:
+                if self.__flights.get(key + (priority,)) is flight:
+                    del self.__flights[key + (priority,)]
+                ttl = self.__settings[cmd.action]
+                if flight.result is not None and ttl > 0 and \
+                        flight.generation == self.__generations[cmd.action]:
+                    self.__cache[key] = (time.time() + ttl, flight.result)
+            flight.done.set()
+
+        return copy.deepcopy(flight.result)
+
+
+class Flight(object):
+    """ A command that is being executed, other callers can wait for its result. """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = Event()
+        self.result = None
+        self.exception = None
+
+    def get(self):
+        """ Wait for the result of the command, raises the exception of the command if it
+        failed. """
+        self.done.wait()
+        if self.exception is not None:
+            raise self.exception
+        return copy.deepcopy(self.result)
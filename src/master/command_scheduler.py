@@ -0,0 +1,153 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The command scheduler decides which caller can send the next command to the master.
+Commands are admitted per priority class, commands within a class are admitted in arrival
+order. A long job (eg. reading all eeprom banks) only holds the bus for one command at a time,
+so it is preempted between two commands when a command with a higher priority is waiting.
+"""
+
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, local
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SCHEDULED = 1
+PRIORITY_PLUGIN = 2
+PRIORITY_BACKGROUND = 3
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive',
+                  PRIORITY_SCHEDULED: 'scheduled',
+                  PRIORITY_PLUGIN: 'plugin',
+                  PRIORITY_BACKGROUND: 'background'}
+
+_THREAD_STATE = local()
+
+
+def get_thread_priority():
+    """ Get the priority class of the commands sent by the current thread. """
+    return getattr(_THREAD_STATE, 'priority', PRIORITY_INTERACTIVE)
+
+
+def set_thread_priority(priority):
+    """ Set the priority class of the commands sent by the current thread.
+
+    :param priority: One of the PRIORITY_* constants.
+    """
+    if priority not in PRIORITY_NAMES:
+        raise ValueError('Unknown priority: {0}'.format(priority))
+    _THREAD_STATE.priority = priority
+
+
+@contextmanager
+def command_priority(priority):
+    """ Context manager that sends the commands in the block with the given priority class. """
+    previous = get_thread_priority()
+    set_thread_priority(priority)
+    try:
+        yield
+    finally:
+        set_thread_priority(previous)
+
+
+class CommandScheduler(object):
+    """ Hands out a fixed number of slots (the number of commands that can be in flight) to the
+    waiting callers, highest priority class first and in arrival order within a class. """
+
+    def __init__(self, slots=1):
+        """ Default constructor.
+
+        :param slots: The number of callers that can hold a slot at the same time.
+        :type slots: integer.
+        """
+        self.__slots = slots
+        self.__used_slots = 0
+        self.__condition = Condition()
+        self.__queues = dict([(priority, deque()) for priority in PRIORITY_NAMES])
+        self.__statistics = dict([(priority, {'commands': 0, 'wait_time': 0.0, 'max_wait_time': 0.0})
+                                  for priority in PRIORITY_NAMES])
+        self.__last_admitted = dict([(priority, 0) for priority in PRIORITY_NAMES])
+
+    def acquire(self, priority=None):
+        """ Block until the caller is allowed to send a command.
+
+        :param priority: One of the PRIORITY_* constants, None for the priority of the thread.
+        """
+        if priority is None:
+            priority = get_thread_priority()
+
+        ticket = object()
+        start = time.time()
+        with self.__condition:
+            queue = self.__queues[priority]
+            queue.append(ticket)
+            while self.__used_slots >= self.__slots or self.__get_next_ticket() is not ticket:
+                self.__condition.wait()
+            queue.popleft()
+            self.__used_slots += 1
+            # The next ticket in line might be able to take another free slot
+            self.__condition.notify_all()
+
+            now = time.time()
+            self.__last_admitted[priority] = now
+            wait_time = now - start
+            statistics = self.__statistics[priority]
+            statistics['commands'] += 1
+            statistics['wait_time'] += wait_time
+            statistics['max_wait_time'] = max(statistics['max_wait_time'], wait_time)
+
+    def release(self):
+        """ Release the slot that was acquired by the caller. """
+        with self.__condition:
+            self.__used_slots -= 1
+            self.__condition.notify_all()
+
+    def __get_next_ticket(self):
+        """ Get the ticket that will get the next free slot, None if nobody is waiting. """
+        for priority in sorted(self.__queues):
+            if len(self.__queues[priority]) > 0:
+                return self.__queues[priority][0]
+        return None
+
+    def get_idle_time(self, priority):
+        """ Get the number of seconds since the last command with a higher priority than the given
+        priority class was admitted, 0 if such a command is waiting.
+
+        :param priority: One of the PRIORITY_* constants.
+        """
+        with self.__condition:
+            higher = [p for p in PRIORITY_NAMES if p < priority]
+            if any(len(self.__queues[p]) > 0 for p in higher):
+                return 0
+            last_admitted = max([self.__last_admitted[p] for p in higher] + [0])
+            return time.time() - last_admitted if last_admitted > 0 else float('inf')
+
+    def get_statistics(self):
+        """ Get the queue depth and wait times per priority class.
+
+        :returns: dict with the priority class name as key and a dict with 'queue_depth', \
+        'commands', 'avg_wait_time' and 'max_wait_time' (in sec) as value.
+        """
+        statistics = {}
+        with self.__condition:
+            for priority, name in PRIORITY_NAMES.iteritems():
+                class_statistics = self.__statistics[priority]
+                commands = class_statistics['commands']
+                statistics[name] = {'queue_depth': len(self.__queues[priority]),
+                                    'commands': commands,
+                                    'avg_wait_time': class_statistics['wait_time'] / commands if commands > 0 else 0.0,
+                                    'max_wait_time': class_statistics['max_wait_time']}
+        return statistics
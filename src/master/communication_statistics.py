@@ -0,0 +1,209 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Always-on instrumentation of the communication with the master: counts, timeouts, crc failures
+and latency histograms per master action, the utilization of the serial bus (bytes/sec and the
+busy duty cycle) and the time spent waiting for the command lock.
+"""
+
+import time
+from collections import deque
+from threading import Lock
+
+# Upper bounds (in ms) of the latency histogram buckets, the last bucket is unbounded.
+LATENCY_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+class Histogram(object):
+    """ Bucketed histogram of durations, keeps the count, total and maximum. Not thread-safe. """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.__buckets = buckets
+        self.__counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        """ Add a duration (in sec). """
+        duration_ms = duration * 1000
+        index = 0
+        for bound in self.__buckets:
+            if duration_ms <= bound:
+                break
+            index += 1
+        self.__counts[index] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    def get_statistics(self):
+        """ Get the statistics of the histogram.
+
+        :returns: dict with 'count', 'avg' and 'max' (in sec) and 'histogram': a list of \
+        [upper bound in ms, count], the upper bound of the last bucket is None.
+        """
+        bounds = list(self.__buckets) + [None]
+        return {'count': self.count,
+                'avg': self.total / self.count if self.count > 0 else 0.0,
+                'max': self.max,
+                'histogram': [[bounds[i], self.__counts[i]] for i in range(len(bounds))]}
+
+
+class CommunicationStatistics(object):
+    """ Thread-safe collection of the communication statistics. The bus rates are calculated over
+    a sliding window: a sample of the counters is taken at most once per second. """
+
+    def __init__(self, window=60):
+        """ Default constructor.
+
+        :param window: number of seconds over which the bus rates and duty cycle are calculated.
+        :type window: integer
+        """
+        self.__lock = Lock()
+        self.__start = time.time()
+        self.__actions = {}  # Maps the master action on a dict with the statistics
+        self.__lock_wait = Histogram()
+
+        self.__bytes_read = 0
+        self.__bytes_written = 0
+        self.__in_flight = 0
+        self.__busy_since = None
+        self.__busy_time = 0.0
+        self.__samples = deque(maxlen=window + 1)
+        self.__samples.append((self.__start, 0, 0, 0.0))
+
+    def __get_action(self, action):
+        """ Get the statistics of an action, the lock should be held. """
+        statistics = self.__actions.get(action)
+        if statistics is None:
+            statistics = {'timeouts': 0, 'crc_failures': 0, 'latency': Histogram()}
+            self.__actions[action] = statistics
+        return statistics
+
+    def __get_busy_time(self, now):
+        """ Get the total busy time until now, the lock should be held. """
+        if self.__busy_since is None:
+            return self.__busy_time
+        return self.__busy_time + (now - self.__busy_since)
+
+    def __sample(self, now):
+        """ Take a sample of the counters if the last one is older than 1 second, the lock should
+        be held. """
+        if now - self.__samples[-1][0] >= 1:
+            self.__samples.append((now, self.__bytes_read, self.__bytes_written,
+                                   self.__get_busy_time(now)))
+
+    def command_sent(self):
+        """ Register that a command was written and is waiting for an answer. """
+        with self.__lock:
+            if self.__in_flight == 0:
+                self.__busy_since = time.time()
+            self.__in_flight += 1
+
+    def command_done(self, action, latency):
+        """ Register the answer of a command.
+
+        :param action: the action of the command.
+        :param latency: the time between writing the command and receiving the answer (in sec).
+        """
+        with self.__lock:
+            self.__get_action(action)['latency'].add(latency)
+            self.__command_finished()
+
+    def command_timed_out(self, action):
+        """ Register a command that got no answer in time. """
+        with self.__lock:
+            self.__get_action(action)['timeouts'] += 1
+            self.__command_finished()
+
+    def __command_finished(self):
+        """ Update the busy time when a command is no longer in flight, the lock should be held. """
+        self.__in_flight = max(0, self.__in_flight - 1)
+        if self.__in_flight == 0 and self.__busy_since is not None:
+            now = time.time()
+            self.__busy_time += now - self.__busy_since
+            self.__busy_since = None
+            self.__sample(now)
+
+    def crc_failed(self, action):
+        """ Register an answer with a bad crc. """
+        with self.__lock:
+            self.__get_action(action)['crc_failures'] += 1
+
+    def lock_waited(self, wait_time):
+        """ Register the time (in sec) a caller waited for the command lock. """
+        with self.__lock:
+            self.__lock_wait.add(wait_time)
+
+    def bytes_read(self, num_bytes):
+        """ Register bytes that were read from the serial port. """
+        with self.__lock:
+            self.__bytes_read += num_bytes
+            self.__sample(time.time())
+
+    def bytes_written(self, num_bytes):
+        """ Register bytes that were written to the serial port. """
+        with self.__lock:
+            self.__bytes_written += num_bytes
+            self.__sample(time.time())
+
+    def get_average_latency(self, action, min_count=10):
+        """ Get the average latency (in sec) of an action, None if less than min_count answers
+        were received for the action. """
+        with self.__lock:
+            statistics = self.__actions.get(action)
+            if statistics is None or statistics['latency'].count < min_count:
+                return None
+            return statistics['latency'].total / statistics['latency'].count
+
+    def get_statistics(self):
+        """ Get the communication statistics.
+
+        :returns: dict with
+            'actions': dict with the master action as key and a dict with 'count', 'avg', 'max', \
+            'histogram' (see :func`Histogram.get_statistics`), 'timeouts' and 'crc_failures' as \
+            value,
+            'bus': dict with 'bytes_read', 'bytes_written' (totals), 'bytes_read_per_sec', \
+            'bytes_written_per_sec' and 'duty_cycle' (fraction of the time a command was waiting \
+            for an answer) over the sliding window,
+            'lock': the wait times for the command lock (see :func`Histogram.get_statistics`).
+        """
+        with self.__lock:
+            now = time.time()
+            self.__sample(now)
+            (start, bytes_read, bytes_written, busy_time) = self.__samples[0]
+            period = now - start
+
+            actions = {}
+            for action, statistics in self.__actions.iteritems():
+                action_statistics = statistics['latency'].get_statistics()
+                action_statistics['timeouts'] = statistics['timeouts']
+                action_statistics['crc_failures'] = statistics['crc_failures']
+                actions[action] = action_statistics
+
+            if period > 0:
+                bus = {'bytes_read_per_sec': (self.__bytes_read - bytes_read) / period,
+                       'bytes_written_per_sec': (self.__bytes_written - bytes_written) / period,
+                       'duty_cycle': min(1.0, (self.__get_busy_time(now) - busy_time) / period)}
+            else:
+                bus = {'bytes_read_per_sec': 0.0, 'bytes_written_per_sec': 0.0, 'duty_cycle': 0.0}
+            bus['bytes_read'] = self.__bytes_read
+            bus['bytes_written'] = self.__bytes_written
+
+            return {'actions': actions,
+                    'bus': bus,
+                    'lock': self.__lock_wait.get_statistics()}
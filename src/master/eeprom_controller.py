@@ -18,9 +18,15 @@ Contains controller from reading and writing to the Master EEPROM.
 
 import inspect
 import types
+import time
 import logging
-from threading import Lock
-from master_api import eeprom_list, write_eeprom, activate_eeprom
+from threading import Lock, Thread, Event
+from master_api import eeprom_list, read_eeprom, write_eeprom, activate_eeprom
+from eeprom_image import EepromImage, NUM_BANKS, BANK_SIZE
+from eeprom_planner import plan_reads, plan_writes
+from command_scheduler import set_thread_priority, PRIORITY_BACKGROUND
+from master_communicator import InMaintenanceModeException
+from serial_utils import CommunicationTimedOutException
 
 LOGGER = logging.getLogger("openmotics")
 
@@ -38,11 +44,71 @@ class EepromController(object):
         """
         self._eeprom_file = eeprom_file
         self._eeprom_extension = eeprom_extension
+        self._lock = Lock()
+        self._eext_changes = {}  # Maps the name of an EepromModel on the generation of its last eext change
+        self._reads = {}  # Maps the name of an EepromModel on the number of times it was read
+        self._warm = Event()
+        self._warmer_status = {'running': False, 'models': [], 'banks': 0, 'cached': 0}
         self.dirty = True
 
-    def invalidate_cache(self):
-        """ Invalidate the cache, this should happen when maintenance mode was used. """
-        self._eeprom_file.invalidate_cache()
+    def invalidate_cache(self, banks=None):
+        """
+        Invalidate the cache, this should happen when maintenance mode was used.
+
+        :param banks: the banks to invalidate, None for all banks.
+        :type banks: list of int
+        """
+        self._eeprom_file.invalidate_cache(banks)
+        self._warm.set()
+
+    def mark_unverified(self, banks=None):
+        """
+        Mark banks as unverified, this should happen when the banks might have been changed
+        externally. The cached banks are served until verify_cache() read them again.
+
+        :param banks: the banks to mark as unverified, None for all banks.
+        :type banks: list of int
+        """
+        self._eeprom_file.mark_unverified(banks)
+
+    def get_generation(self):
+        """
+        Get the generation of the eeprom, the generation is incremented every time a bank or an
+        eeprom extension changes.
+
+        :rtype: int
+        """
+        return self._eeprom_file.get_generation()
+
+    def has_changed(self, eeprom_models, since):
+        """
+        Check whether the data of EepromModels changed since a generation of the eeprom.
+
+        :param eeprom_models: the EepromModels to check.
+        :type eeprom_models: list of class
+        :param since: the generation (see get_generation()), None if the models were never read.
+        :type since: int
+        :rtype: bool
+        """
+        if since is None:
+            return True
+        with self._lock:
+            if any(self._eext_changes.get(eeprom_model.get_name(), 0) > since for eeprom_model in eeprom_models):
+                return True
+        changed_banks = self._eeprom_file.get_changes(since)[1]
+        return any(len(changed_banks & eeprom_model.get_all_eeprom_banks()) > 0 for eeprom_model in eeprom_models)
+
+    def verify_cache(self):
+        """
+        Verify the cached banks against the master, the controller becomes dirty if a bank
+        changed.
+
+        :returns: the list of banks that changed.
+        """
+        changed = self._eeprom_file.verify()
+        if len(changed) > 0:
+            self.dirty = True
+        return changed
 
     def read(self, eeprom_model, id=None, fields=None):
         """
@@ -65,13 +131,64 @@ class EepromController(object):
         :type fields: list of basestring
         :rtype: list of master.eeprom_controller.EepromModel
         """
+        with self._lock:
+            self._reads[eeprom_model.get_name()] = self._reads.get(eeprom_model.get_name(), 0) + 1
+        # Read all banks that are needed in one batch, decode all ids from the bank data
+        banks = set()
+        for id in ids:
+            banks.update(eeprom_model.get_eeprom_banks(id, fields))
+        bank_data = self._eeprom_file.read_banks(banks)
+        eext_data = self._eeprom_extension.read_model(eeprom_model.get_name())
         return_data = []
         for id in ids:
             entry = eeprom_model(id)
-            entry.load_from_system(self._eeprom_file, self._eeprom_extension, fields)
+            entry.load_from_banks(bank_data, eext_data, fields)
             return_data.append(entry)
         return return_data
 
+    def read_addresses(self, addresses):
+        """
+        Read raw data from the EepromFile.
+
+        :type addresses: list of master.eeprom_controller.EepromAddress
+        :rtype: dict[master.eeprom_controller.EepromAddress, master.eeprom_controller.EepromData]
+        """
+        return self._eeprom_file.read(addresses)
+
+    def write_addresses(self, eeprom_data):
+        """
+        Write raw data to the EepromFile, only the bytes that changed are written. The eeprom is
+        not activated.
+
+        :type eeprom_data: list of master.eeprom_controller.EepromData
+        :returns: list of tuples (bank, offset, data) that were written.
+        """
+        writes = self._eeprom_file.write(eeprom_data)
+        if len(writes) > 0:
+            self.dirty = True
+        return writes
+
+    def iter_banks(self, banks):
+        """
+        Iterate over a number of banks in order, the banks that are not cached are prefetched
+        from the master.
+
+        :type banks: list of int
+        :returns: generator of tuples (bank, data).
+        """
+        return self._eeprom_file.iter_banks(banks)
+
+    def load_banks(self, banks, progress=None):
+        """
+        Read a number of banks from the master, the banks in the cache are updated.
+
+        :type banks: list of int
+        :param progress: function that is called with the number of banks read and the total \
+        number of banks.
+        :returns: a dict mapping the bank to the data.
+        """
+        return self._eeprom_file.load_banks(banks, progress)
+
     def read_all(self, eeprom_model, fields=None):
         """
         Create a list of instance of an EepromModel by reading all ids of that model from the
@@ -97,41 +214,330 @@ class EepromController(object):
 
         :type eeprom_models: list of master.eeprom_models.EepromModel
         """
-        # Write to the eeprom
-        eeprom_data = []
+        transaction = self.transaction()
+        transaction.write_batch(eeprom_models)
+        transaction.commit()
+
+    def transaction(self):
+        """
+        Create a transaction that collects the writes of EepromModels and writes them at once.
+
+        :rtype: master.eeprom_controller.EepromTransaction
+        """
+        return EepromTransaction(self)
+
+    def _commit(self, model_names, eeprom_data, eext_data):
+        """
+        Write the data of a transaction: the eeprom data is written with a single activation, the
+        extensions are only written once the eeprom write succeeded.
+
+        :param model_names: the names of the EepromModels that are written.
+        :type model_names: set of basestring
+        :type eeprom_data: list of master.eeprom_controller.EepromData
+        :type eext_data: list of tuple[basestring, int, basestring, basestring]
+        """
+        with self._eeprom_extension.write_transaction(eext_data):
+            if len(eeprom_data) > 0:
+                if self._eeprom_file.write(eeprom_data):
+                    self._eeprom_file.activate()
+                    self.dirty = True
+        if len(eext_data) > 0:
+            with self._lock:
+                generation = self._eeprom_file.bump_generation()
+                for model_name in model_names:
+                    self._eext_changes[model_name] = generation
+            self.dirty = True
+
+    def start_warmer(self, eeprom_models, idle_time=5, batch_size=4, retry=60):
+        """
+        Start a background thread that warms the cache: the banks of the EepromModels that are
+        not cached are read from the master when the master bus is idle. The models that are
+        read most often are warmed first. The cache is warmed again after an invalidation.
+
+        :param eeprom_models: the EepromModels to warm.
+        :type eeprom_models: list of class
+        :param idle_time: the number of seconds without commands with a higher priority before \
+        banks are read.
+        :param batch_size: the maximum number of banks that is read in one batch.
+        :param retry: the number of seconds to wait after an error.
+        """
+        def run():
+            """ Warms the cache every time it is invalidated. """
+            set_thread_priority(PRIORITY_BACKGROUND)
+            while True:
+                self._warm.wait()
+                self._warm.clear()
+                try:
+                    self.warm_cache(eeprom_models, idle_time, batch_size)
+                except Exception as exception:
+                    if not isinstance(exception, InMaintenanceModeException):
+                        LOGGER.exception('Got error while warming the eeprom cache.')
+                    time.sleep(retry)
+                    self._warm.set()
+
+        self._warm.set()
+        thread = Thread(target=run, name='EepromController cache warmer thread')
+        thread.daemon = True
+        thread.start()
+
+    def warm_cache(self, eeprom_models, idle_time=5, batch_size=4):
+        """
+        Read the banks of EepromModels that are not cached from the master. Before every batch,
+        the master bus has to be idle for idle_time seconds: the warmer yields to the other
+        commands.
+
+        :param eeprom_models: the EepromModels to warm.
+        :type eeprom_models: list of class
+        :param idle_time: the number of seconds without commands with a higher priority before \
+        banks are read.
+        :param batch_size: the maximum number of banks that is read in one batch.
+        """
+        with self._lock:
+            eeprom_models = sorted(eeprom_models, key=lambda model: -self._reads.get(model.get_name(), 0))
+        banks = []
         for eeprom_model in eeprom_models:
-            eeprom_data += eeprom_model.get_eeprom_data()
-        if len(eeprom_data) > 0:
-            if self._eeprom_file.write(eeprom_data):
-                self._eeprom_file.activate()
-                self.dirty = True
-        # Write the extensions
+            ids = range(eeprom_model.get_max_id(self._eeprom_file) + 1) if eeprom_model.has_id() else [None]
+            model_banks = set()
+            for id in ids:
+                model_banks.update(eeprom_model.get_eeprom_banks(id))
+            banks += sorted(model_banks - set(banks))
+        uncached = self._eeprom_file.get_uncached(banks)
+        with self._lock:
+            self._warmer_status = {'running': True,
+                                   'models': [eeprom_model.get_name() for eeprom_model in eeprom_models],
+                                   'banks': len(banks),
+                                   'cached': len(banks) - len(uncached)}
+
+        try:
+            while len(uncached) > 0:
+                idle = self._eeprom_file.get_idle_time()
+                if idle < idle_time:
+                    time.sleep(idle_time - idle)
+                    continue
+                batch = uncached[:batch_size]
+                self._eeprom_file.read_banks(batch)
+                uncached = uncached[batch_size:]
+                with self._lock:
+                    self._warmer_status['cached'] += len(batch)
+        finally:
+            with self._lock:
+                self._warmer_status['running'] = False
+
+    def get_warmer_status(self):
+        """
+        Get the progress of the cache warmer.
+
+        :returns: dict with 'running' (bool), 'models' (the names of the models, in the order \
+        they are warmed), 'banks' (the number of banks to warm) and 'cached' (the number of those \
+        banks that are cached).
+        """
+        with self._lock:
+            return dict(self._warmer_status)
+
+
+class EepromTransaction(object):
+    """ Collects the writes of EepromModels (possibly of different models) and commits them with
+    one coalesced eeprom write and a single activation. The models are validated when they are
+    added, nothing is written until commit() is called. """
+
+    def __init__(self, eeprom_controller):
+        """
+        :type eeprom_controller: master.eeprom_controller.EepromController
+        """
+        self._eeprom_controller = eeprom_controller
+        self._model_names = set()
+        self._eeprom_data = []
+        self._eext_data = []
+        self._committed = False
+
+    def write(self, eeprom_model):
+        """
+        Add an EepromModel to the transaction, later writes override earlier writes.
+
+        :type eeprom_model: master.eeprom_models.EepromModel
+        :raises: TypeError if the model is not valid.
+        """
+        self.write_batch([eeprom_model])
+
+    def write_batch(self, eeprom_models):
+        """
+        Add a list of EepromModel instances to the transaction, the models are only added if all
+        of them are valid.
+
+        :type eeprom_models: list of master.eeprom_models.EepromModel
+        :raises: TypeError if a model is not valid.
+        """
+        if self._committed:
+            raise RuntimeError('The transaction was already committed')
+        model_names = set()
+        eeprom_data = []
         eext_data = []
         for eeprom_model in eeprom_models:
+            if not isinstance(eeprom_model, EepromModel):
+                raise TypeError('{0} is not an EepromModel'.format(eeprom_model))
+            eeprom_model.check_id(eeprom_model.id)
+            model_names.add(eeprom_model.get_name())
+            eeprom_data += eeprom_model.get_eeprom_data()
             eext_data += eeprom_model.get_eext_data()
-        if len(eext_data) > 0:
-            self._eeprom_extension.write_data(eext_data)
-            self.dirty = True
+        self._model_names.update(model_names)
+        self._eeprom_data += eeprom_data
+        self._eext_data += eext_data
+
+    def commit(self):
+        """
+        Write the models, see :func`EepromController._commit`. A transaction can only be
+        committed once.
+        """
+        if self._committed:
+            raise RuntimeError('The transaction was already committed')
+        self._committed = True
+        self._eeprom_controller._commit(self._model_names, self._eeprom_data, self._eext_data)  # pylint: disable=W0212
 
 
 class EepromFile(object):
     """ Reads from and writes to the Master EEPROM. """
 
-    BATCH_SIZE = 10
-
-    def __init__(self, master_communicator):
+    def __init__(self, master_communicator, image_file=None):
         """
-        Create an EepromFile.
+        Create an EepromFile. The banks are cached in an EepromImage, if the image is persisted
+        the banks in the image are served after a restart and verified against the master by
+        verify().
 
         :param master_communicator: communicates with the master.
         :type master_communicator: master.master_communicator.MasterCommunicator
+        :param image_file: the file that contains the eeprom image, None to keep it in memory.
+        :type image_file: str
         """
         self._master_communicator = master_communicator
-        self._bank_cache = {}
+        self._image = EepromImage(image_file)
+        self._lock = Lock()
+        self._verified = set()  # The banks that were read from or written to the master
+        self._suspect = set()  # The banks that have to be read from the master before use
+        self._ranges = {}  # Maps a bank on a dict (offset -> byte) with the bytes read by ranged reads
+        self._generation = 0  # Incremented every time the data of a bank changes
+        self._changes = {}  # Maps a bank on the generation in which it last changed
+
+    def invalidate_cache(self, banks=None):
+        """
+        Invalidate the cache, this should happen when the banks are known to be changed or
+        corrupted. The banks are read from the master on the next read or verify, the
+        generation of a bank only changes if its data changed.
+
+        :param banks: the banks to invalidate, None for all banks.
+        :type banks: list of int
+        """
+        with self._lock:
+            banks = set(range(NUM_BANKS) if banks is None else banks)
+            self._suspect |= banks
+            self._verified -= banks
+            for bank in banks:
+                self._ranges.pop(bank, None)
+
+    def mark_unverified(self, banks=None):
+        """
+        Mark banks as unverified, this should happen when the banks might have been changed
+        externally (eg. in maintenance mode). The cached banks are still served to readers,
+        until they are read from the master by verify(). Writes and backups read the unverified
+        banks from the master first.
+
+        :param banks: the banks to mark as unverified, None for all banks.
+        :type banks: list of int
+        """
+        with self._lock:
+            banks = set(range(NUM_BANKS) if banks is None else banks)
+            self._verified -= banks
+            for bank in banks:
+                self._ranges.pop(bank, None)
+
+    def get_generation(self, bank=None):
+        """ Get the generation of a bank, the generation changes every time the data of the
+        bank changes. Without a bank, the generation of the whole cache is returned: it is
+        incremented every time the data of a bank changes, see get_changes(). """
+        with self._lock:
+            if bank is None:
+                return self._generation
+            return self._image.get_generation(bank)
+
+    def get_uncached(self, banks):
+        """ Get the banks that are not cached (or have to be read again before use).
+
+        :param banks: a list of banks (integers).
+        :returns: the list of banks that are not cached, in the order of banks.
+        """
+        with self._lock:
+            return [bank for bank in banks if bank in self._suspect or not self._image.is_valid(bank)]
+
+    def get_idle_time(self):
+        """ Get the number of seconds that the master bus was idle for background commands,
+        see :func`MasterCommunicator.get_idle_time`. """
+        return self._master_communicator.get_idle_time(PRIORITY_BACKGROUND)
+
+    def get_changes(self, since):
+        """
+        Get the banks that changed since a generation of the cache.
+
+        :param since: the generation of the cache (see get_generation()), None for all banks.
+        :type since: int
+        :returns: tuple (the current generation of the cache, set of banks that changed).
+        """
+        with self._lock:
+            if since is None:
+                return (self._generation, set(range(NUM_BANKS)))
+            return (self._generation, set(bank for bank, generation in self._changes.iteritems()
+                                          if generation > since))
+
+    def bump_generation(self):
+        """ Increment the generation of the cache without a change of the banks, this is used
+        for changes that are stored outside of the eeprom (eg. the eeprom extensions).
+
+        :returns: the new generation of the cache.
+        """
+        with self._lock:
+            self._generation += 1
+            return self._generation
+
+    def _changed(self, bank):
+        """ Register a change of the data of a bank, the lock should be held. """
+        self._generation += 1
+        self._changes[bank] = self._generation
+
+    def _get_cached(self, bank, verified=False):
+        """ Get the cached data of a bank, None if the bank has to be read from the master. The
+        lock should be held.
+
+        :param verified: only return the data if the bank was verified against the master.
+        """
+        if bank in self._suspect or (verified and bank not in self._verified):
+            return None
+        return self._image.get(bank)
+
+    def _store(self, bank, data):
+        """ Store the data of a bank that was read from or written to the master, the lock
+        should be held.
 
-    def invalidate_cache(self):
-        """ Invalidate the cache, this should happen when maintenance mode was used. """
-        self._bank_cache = {}
+        :returns: whether the data of the bank changed.
+        """
+        changed = self._image.set(bank, data)
+        if changed:
+            self._changed(bank)
+        self._suspect.discard(bank)
+        self._verified.add(bank)
+        self._ranges.pop(bank, None)
+        return changed
+
+    def verify(self):
+        """
+        Read the cached banks that were not verified yet from the master and update the image.
+
+        :returns: the list of banks that changed.
+        """
+        with self._lock:
+            banks = [bank for bank in xrange(NUM_BANKS)
+                     if bank not in self._verified and (self._image.is_valid(bank) or bank in self._suspect)]
+        changed = self._load_banks(banks)[1]
+        with self._lock:
+            self._image.flush()
+        return changed
 
     def activate(self):
         """
@@ -143,14 +549,70 @@ class EepromFile(object):
 
     def read(self, addresses):
         """
-        Read data from the Eeprom.
+        Read data from the Eeprom. The bytes that are not cached are read from the master using
+        the cheapest mix of bank lists and ranged reads (see :func`plan_reads`).
 
         :param addresses: the addresses to read.
         :type addresses: list of master.eeprom_controller.EepromAddress
         :rtype: dict[master.eeprom_controller.EepromAddress, master.eeprom_controller.EepromData]
         """
-        bank_data = self._read_banks({a.bank for a in addresses})
-        return {a: EepromData(a, bank_data[a.bank][a.offset:a.offset + a.length]) for a in addresses}
+        offsets = {}
+        for address in addresses:
+            offsets.setdefault(address.bank, set()).update(EepromFile._get_offsets(address))
+        (bank_data, range_data) = self._read_bytes(offsets)
+
+        return_data = {}
+        for address in addresses:
+            if address.bank in bank_data:
+                data = bank_data[address.bank][address.offset:address.offset + address.length]
+            else:
+                data = ''.join(range_data[address.bank][offset] for offset in EepromFile._get_offsets(address))
+            return_data[address] = EepromData(address, data)
+        return return_data
+
+    @staticmethod
+    def _get_offsets(address):
+        """ Get the offsets in the bank that are covered by an address. """
+        return xrange(address.offset, min(address.offset + address.length, BANK_SIZE))
+
+    def _read_bytes(self, offsets, verified=False):
+        """
+        Read a number of bytes from the Eeprom, the bytes that are not cached are read from the
+        master.
+
+        :param offsets: dict mapping the bank on the offsets to read.
+        :param verified: only use the cached banks that were verified against the master, the \
+        other banks are read from the master (eg. to compare the data to write with).
+        :returns: tuple (dict mapping the bank on the data, for the banks that are read \
+        completely, dict mapping the bank on a dict (offset -> byte) with at least the requested \
+        bytes, for the other banks).
+        """
+        bank_data = {}
+        range_data = {}
+        missing = {}
+        with self._lock:
+            for bank, bank_offsets in offsets.iteritems():
+                data = self._get_cached(bank, verified)
+                if data is not None:
+                    bank_data[bank] = data
+                else:
+                    range_data[bank] = dict(self._ranges.get(bank, {}))
+                    bank_missing = set(offset for offset in bank_offsets if offset not in range_data[bank])
+                    if len(bank_missing) > 0:
+                        missing[bank] = bank_missing
+
+        if len(missing) > 0:
+            (banks, reads) = plan_reads(missing,
+                                        self._master_communicator.get_average_latency(eeprom_list()),
+                                        self._master_communicator.get_average_latency(read_eeprom()))
+            if len(banks) > 0:
+                bank_data.update(self._load_banks(banks)[0])
+                for bank in banks:
+                    del range_data[bank]
+            if len(reads) > 0:
+                for bank, data in self._load_ranges(reads).iteritems():
+                    range_data[bank].update(data)
+        return (bank_data, range_data)
 
     def _read_banks(self, banks):
         """
@@ -159,80 +621,236 @@ class EepromFile(object):
         :param banks: a list of banks (integers).
         :returns: a dict mapping the bank to the data.
         """
-        try:
-            return_data = {}
+        return_data = {}
+        missing = []
+        with self._lock:
             for bank in banks:
-                if bank in self._bank_cache:
-                    data = self._bank_cache[bank]
+                data = self._get_cached(bank)
+                if data is None:
+                    missing.append(bank)
                 else:
-                    output = self._master_communicator.do_command(eeprom_list(), {'bank': bank})
-                    data = output['data']
-                    self._bank_cache[bank] = data
-                return_data[bank] = data
-            return return_data
-        except Exception:
-            # Failure reading, cache might be invalid
-            self.invalidate_cache()
-            raise
+                    return_data[bank] = data
+        if len(missing) > 0:
+            return_data.update(self._load_banks(missing)[0])
+        return return_data
+
+    def read_banks(self, banks):
+        """
+        Read a number of banks from the Eeprom, the banks that are not cached are read from the
+        master in one batch.
+
+        :param banks: a list of banks (integers).
+        :returns: a dict mapping the bank to the data.
+        """
+        return self._read_banks(set(banks))
+
+    def iter_banks(self, banks, prefetch=16):
+        """
+        Iterate over a number of banks in order (eg. for a backup). The cached banks that were
+        verified against the master are served immediately, the other banks are read from the
+        master in pipelined batches of the next prefetch banks that have to be read.
+
+        :param banks: a list of banks (integers).
+        :param prefetch: the maximum number of banks that is read in one batch.
+        :returns: generator of tuples (bank, data).
+        """
+        banks = list(banks)
+        fetched = {}
+        for index, bank in enumerate(banks):
+            data = fetched.pop(bank, None)
+            if data is None:
+                with self._lock:
+                    data = self._get_cached(bank, verified=True)
+                    if data is None:
+                        upcoming = [b for b in banks[index:]
+                                    if b not in fetched and self._get_cached(b, verified=True) is None][:prefetch]
+                if data is None:
+                    fetched.update(self._load_banks(upcoming)[0])
+                    data = fetched.pop(bank)
+            yield (bank, data)
+
+    def load_banks(self, banks, progress=None):
+        """
+        Read a number of banks from the master (bypassing the cache) and store them in the cache.
+
+        :param banks: a list of banks (integers).
+        :param progress: function that is called with the number of banks read and the total \
+        number of banks after every bank that was read.
+        :returns: a dict mapping the bank to the data.
+        """
+        return self._load_banks(banks, progress)[0]
+
+    def _load_banks(self, banks, progress=None, retries=2):
+        """
+        Read a number of banks from the master in a pipelined batch and store them in the image as
+        the answers arrive. The banks that failed are retried in a new batch, retries times.
+
+        :raises: :class`CommunicationTimedOutException` if a bank could not be read.
+        :returns: tuple (dict mapping the bank to the data, list of banks that changed).
+        """
+        banks = list(banks)
+        with self._lock:
+            generations = dict((bank, self._image.get_generation(bank)) for bank in banks)
+        return_data = {}
+        changed = []
+
+        def store(bank, data):
+            """ Store the data of a bank that was read. """
+            return_data[bank] = data
+            with self._lock:
+                if self._image.get_generation(bank) == generations[bank]:
+                    # Only store the data if the bank was not written while reading
+                    if self._store(bank, data):
+                        changed.append(bank)
+            if progress is not None:
+                progress(len(return_data), len(banks))
+
+        pending = banks
+        for _ in xrange(retries + 1):
+            batch = pending
+            self._master_communicator.do_command_batch(
+                eeprom_list(), [{'bank': bank} for bank in batch],
+                callback=lambda index, output: store(batch[index], output['data']))
+            pending = [bank for bank in batch if bank not in return_data]
+            if len(pending) == 0:
+                return (return_data, changed)
+            LOGGER.warning('EEPROM - Could not read banks {0}'.format(pending))
+        raise CommunicationTimedOutException()
+
+    def _load_ranges(self, reads, retries=2):
+        """
+        Read a number of ranges from the master in a pipelined batch and merge them into the cache
+        at their offsets. A bank is stored in the image once all its bytes were read. The ranges
+        that failed or got a short reply are retried in a new batch, retries times.
+
+        :param reads: list of tuples (bank, offset, length).
+        :raises: :class`CommunicationTimedOutException` if a range could not be read.
+        :returns: dict mapping the bank on a dict (offset -> byte) with the bytes that were read.
+        """
+        with self._lock:
+            generations = dict((bank, self._image.get_generation(bank)) for (bank, _, _) in reads)
+        return_data = {}
+        done = set()
+
+        def store(read, data):
+            """ Store the data of a range that was read. """
+            (bank, offset, length) = read
+            if len(data) < length:
+                return  # A short reply is a failed read
+            values = dict((offset + i, data[i]) for i in xrange(length))
+            return_data.setdefault(bank, {}).update(values)
+            done.add(read)
+            with self._lock:
+                if self._image.get_generation(bank) == generations[bank]:
+                    # Only store the data if the bank was not written while reading
+                    cached = self._ranges.setdefault(bank, {})
+                    cached.update(values)
+                    if len(cached) == BANK_SIZE:
+                        self._store(bank, ''.join(cached[i] for i in xrange(BANK_SIZE)))
+
+        pending = list(reads)
+        for _ in xrange(retries + 1):
+            batch = pending
+            self._master_communicator.do_command_batch(
+                read_eeprom(), [{'bank': bank, 'addr': offset, 'num': length} for (bank, offset, length) in batch],
+                callback=lambda index, output: store(batch[index], output['data']))
+            pending = [read for read in batch if read not in done]
+            if len(pending) == 0:
+                return return_data
+            LOGGER.warning('EEPROM - Could not read ranges {0}'.format(pending))
+        raise CommunicationTimedOutException()
 
     def write(self, data):
         """
-        Write data to the Eeprom.
+        Write data to the Eeprom. All writes are merged per bank and only the bytes that changed
+        are written, using the minimal number of pipelined commands (see :func`plan_writes`).
+        The data is compared with the banks that were verified against the master, the other
+        banks are read from the master first.
 
         :param data: the data to write.
         :type data: list of master.eeprom_controller.EepromData
+        :returns: list of tuples (bank, offset, data) that were written to the master.
         """
-        wrote_data = False
-
-        # Read the data in the banks that we are trying to write
-        bank_data = self._read_banks({d.address.bank for d in data})
-        new_bank_data = bank_data.copy()
-
+        # Merge the data per bank, later data overrides earlier data
+        changes = {}
         for data_item in data:
-            address = data_item.address
-            data = new_bank_data[address.bank]
-            new_bank_data[address.bank] = data[0:address.offset] + data_item.bytes + data[address.offset + address.length:]
+            bank_changes = changes.setdefault(data_item.address.bank, {})
+            for offset, byte in zip(EepromFile._get_offsets(data_item.address), data_item.bytes):
+                bank_changes[offset] = byte
+
+        # Only the current value of the bytes that are written is needed
+        (bank_data, range_data) = self._read_bytes(dict((bank, set(bank_changes.keys()))
+                                                        for bank, bank_changes in changes.iteritems()),
+                                                   verified=True)
+
+        writes = []
+        changed_banks = set()
+        new_bank_data = {}
+        new_range_data = {}
+        for bank in sorted(changes.keys()):
+            current = dict(enumerate(bank_data[bank])) if bank in bank_data else range_data[bank]
+            changed = dict((offset, byte) for offset, byte in changes[bank].iteritems() if current.get(offset) != byte)
+            writes += [(bank, offset, to_write) for (offset, to_write) in plan_writes(changed, current)]
+            if len(changed) > 0:
+                changed_banks.add(bank)
+
+            merged = dict(current)
+            merged.update(changes[bank])
+            if bank in bank_data:
+                new_bank_data[bank] = ''.join(merged[offset] for offset in sorted(merged.keys()))
+            else:
+                new_range_data[bank] = merged
 
-        # Check what changed and write changes in batch
         try:
-            for bank in bank_data.keys():
-                old = bank_data[bank]
-                new = new_bank_data[bank]
-
-                i = 0
-                while i < len(bank_data[bank]):
-                    if old[i] != new[i]:
-                        length = 1
-                        j = 1
-                        while j < EepromFile.BATCH_SIZE and i + j < len(old):
-                            if old[i + j] != new[i + j]:
-                                length = j + 1
-                            j += 1
-
-                        self._write(bank, i, new[i:i + length])
-                        wrote_data = True
-                        i += EepromFile.BATCH_SIZE
+            if len(writes) > 0:
+                self._write(writes)
+            with self._lock:
+                for bank, new in new_bank_data.iteritems():
+                    if bank in self._verified:
+                        self._store(bank, new)
                     else:
-                        i += 1
-
-                self._bank_cache[bank] = new
-            return wrote_data
+                        # The bank was not stored by the read or it changed since, read it again
+                        self._suspect.add(bank)
+                        self._ranges.pop(bank, None)
+                        if bank in changed_banks:
+                            self._changed(bank)
+                for bank, merged in new_range_data.iteritems():
+                    # Bump the generation of the bank: bytes that are being read are not stored
+                    self._image.invalidate(bank)
+                    self._ranges[bank] = merged
+                    if bank in changed_banks:
+                        self._changed(bank)
+                self._image.flush()
+            return writes
         except Exception:
-            # Failure reading, cache might be invalid
-            self.invalidate_cache()
+            # Failure writing, the banks that were written might be invalid
+            self.invalidate_cache(changes.keys())
             raise
 
-    def _write(self, bank, offset, to_write):
-        """ Write a byte array to a specific location defined by the bank and the offset. """
-        LOGGER.info("EEPROM - Write: B{0} A{1} D[{2}]".format(bank, offset, ' '.join(['%3d' % ord(c) for c in to_write])))
-        self._master_communicator.do_command(
-            write_eeprom(), {'bank': bank, 'address': offset, 'data': to_write}
+    def _write(self, writes):
+        """
+        Write a number of byte arrays to the locations defined by the bank and the offset, in a
+        pipelined batch.
+
+        :param writes: list of tuples (bank, offset, data).
+        :raises: :class`CommunicationTimedOutException` if a write failed.
+        """
+        for (bank, offset, to_write) in writes:
+            LOGGER.info("EEPROM - Write: B{0} A{1} D[{2}]".format(bank, offset, ' '.join(['%3d' % ord(c) for c in to_write])))
+        done = set()
+        self._master_communicator.do_command_batch(
+            write_eeprom(), [{'bank': bank, 'address': offset, 'data': to_write} for (bank, offset, to_write) in writes],
+            callback=lambda index, output: done.add(index)
         )
+        if len(done) != len(writes):
+            raise CommunicationTimedOutException()
 
 
 class EepromAddress(object):
     """ Represents an address in the Eeprom, has a bank, an offset and a length. """
 
+    __slots__ = ('bank', 'offset', 'length', 'shared', 'name')
+
     def __init__(self, bank, offset, length, shared=False, name=None):
         self.bank = bank
         self.offset = offset
@@ -256,6 +874,8 @@ class EepromAddress(object):
 class EepromData(object):
     """ A piece of Eeprom data, has an address and the actual data. """
 
+    __slots__ = ('address', 'bytes')
+
     def __init__(self, address, data):
         """
         :type address: master.eeprom_controller.EepromAddress
@@ -283,22 +903,51 @@ class EepromModel(object):
 
     cache_fields = {}
     cache_addresses = {}
+    cache_layouts = {}
+    cache_banks = {}
     cache_lock = Lock()
 
     def __init__(self, id=None):
+        layout = self.__class__.get_layout()
         self.check_id(id)
         self.id = id
-        self._fields = {'eeprom': [], 'eext': []}
+        self._fields = layout['fields']
         self._loaded_fields = []
         address_cache = self.__class__.get_address_cache(self.id)
-        for field_name, field_type in self.__class__.get_field_dict(include_eeprom=True).iteritems():
-            setattr(self, '_{0}'.format(field_name), EepromDataContainer(field_type, address_cache[field_name]))
-            self._add_property(field_name)
-            self._fields['eeprom'].append(field_name)
-        for field_name, field_type in self.__class__.get_field_dict(include_eext=True).iteritems():
-            setattr(self, '_{0}'.format(field_name), EextDataContainer(field_type))
-            self._add_property(field_name)
-            self._fields['eext'].append(field_name)
+        for field_name, attribute_name, field_type in layout['eeprom']:
+            setattr(self, attribute_name, EepromDataContainer(field_type, address_cache[field_name]))
+        for field_name, attribute_name, field_type in layout['eext']:
+            setattr(self, attribute_name, EextDataContainer(field_type))
+
+    @classmethod
+    def get_layout(cls):
+        """
+        Get the layout of the EepromModel child, the layout is compiled once per class: the
+        properties for the fields are added to the class and the fields are listed as tuples
+        (field name, attribute name of the container, field type).
+
+        :returns: dict with 'fields' (dict with the 'eeprom' and 'eext' field names), 'eeprom' \
+        and 'eext' (lists of tuples), 'has_id' and 'max_id' (the static maximum id).
+        """
+        layout = EepromModel.cache_layouts.get(cls.__name__)
+        if layout is not None:
+            return layout
+        with EepromModel.cache_lock:
+            eeprom = [(name, '_{0}'.format(name), field_type)
+                      for name, field_type in cls.get_fields(include_eeprom=True)]
+            eext = [(name, '_{0}'.format(name), field_type)
+                    for name, field_type in cls.get_fields(include_eext=True)]
+            ids = cls.get_fields(include_id=True)
+            for field_name, _, _ in eeprom + eext:
+                cls._add_property(field_name)
+            layout = {'fields': {'eeprom': [field[0] for field in eeprom],
+                                 'eext': [field[0] for field in eext]},
+                      'eeprom': eeprom,
+                      'eext': eext,
+                      'has_id': len(ids) > 0,
+                      'max_id': ids[0][1].get_max_id() if len(ids) > 0 else None}
+            EepromModel.cache_layouts[cls.__name__] = layout
+        return layout
 
     def load_from_system(self, eeprom_file, eeprom_extension, fields=None):
         """
@@ -306,43 +955,87 @@ class EepromModel(object):
         :type eeprom_extension: master.eeprom_extension.EepromExtension
         :type fields: list of basestring
         """
+        bank_data = eeprom_file.read_banks(self.__class__.get_eeprom_banks(self.id, fields))
+        self.load_from_banks(bank_data, eeprom_extension.read_model(self.get_name()), fields)
+
+    def load_from_banks(self, bank_data, eext_data, fields=None):
+        """
+        Load the fields from the data of the eeprom banks and the eeprom extensions.
+
+        :param bank_data: dict mapping the bank to the data, containing all banks of the fields.
+        :param eext_data: the eeprom extensions of the model, see \
+        :func`master.eeprom_extension.EepromExtension.read_model`.
+        :type fields: list of basestring
+        """
+        layout = self.__class__.get_layout()
         expected_fields = [] if fields is None else fields[:]
         self._loaded_fields = []
-        addresses = []
-        for field_name in self._fields['eeprom']:
-            if fields is not None:
-                if field_name not in expected_fields:
-                    continue
-            field = getattr(self, '_{0}'.format(field_name))
-            if field.composed is True:
-                addresses += field.addresses
-            else:
-                addresses.append(field.address)
-        data = eeprom_file.read(addresses)
-        for field_name in self._fields['eeprom']:
+        for field_name, attribute_name, _ in layout['eeprom']:
             if fields is not None:
                 if field_name not in expected_fields:
                     continue
                 expected_fields.remove(field_name)
-            field = getattr(self, '_{0}'.format(field_name))
+            field = getattr(self, attribute_name)
             if field.composed is True:
-                field.load_bytes([data[address] for address in field.addresses])
+                field.load_bytes([EepromData(address, bank_data[address.bank][address.offset:address.offset + address.length])
+                                  for address in field.addresses])
             else:
-                field.load_bytes(data[field.address])
+                address = field.address
+                field.load_bytes(EepromData(address, bank_data[address.bank][address.offset:address.offset + address.length]))
             self._loaded_fields.append(field_name)
-        for field_name in self._fields['eext']:
+        for field_name, attribute_name, _ in layout['eext']:
             if fields is not None:
                 if field_name not in expected_fields:
                     continue
                 expected_fields.remove(field_name)
-            data = eeprom_extension.read_data(self.__class__.__name__, self.id, field_name)
+            data = eext_data.get((0 if self.id is None else self.id, field_name))
             if data is not None:
-                field = getattr(self, '_{0}'.format(field_name))
-                field.load_bytes(data)
+                getattr(self, attribute_name).load_bytes(data)
             self._loaded_fields.append(field_name)
         if len(expected_fields) > 0:
             raise RuntimeError('Unknown fields: {0}'.format(', '.join(fields)))
 
+    @classmethod
+    def get_all_eeprom_banks(cls):
+        """
+        Get the eeprom banks that contain the fields of all ids (up to the static maximum id)
+        and the dynamic maximum id.
+
+        :rtype: set of int
+        """
+        banks = EepromModel.cache_banks.get(cls.__name__)
+        if banks is not None:
+            return banks
+        layout = cls.get_layout()
+        banks = set()
+        for id in (range(layout['max_id'] + 1) if layout['has_id'] else [None]):
+            banks.update(cls.get_eeprom_banks(id))
+        if layout['has_id']:
+            eeprom_id = cls.get_fields(include_id=True)[0][1]
+            if eeprom_id.has_address():
+                banks.add(eeprom_id.get_address().bank)
+        EepromModel.cache_banks[cls.__name__] = banks
+        return banks
+
+    @classmethod
+    def get_eeprom_banks(cls, id, fields=None):
+        """
+        Get the eeprom banks that contain the fields of an id.
+
+        :type id: int
+        :type fields: list of basestring
+        :rtype: set of int
+        """
+        banks = set()
+        for field_name, address in cls.get_address_cache(id).iteritems():
+            if fields is not None and field_name not in fields:
+                continue
+            if isinstance(address, dict):
+                banks.update([composed_address.bank for composed_address in address.itervalues()])
+            else:
+                banks.add(address.bank)
+        return banks
+
     def get_eeprom_data(self):
         data = []
         for field_name in self._fields['eeprom']:
@@ -398,9 +1091,10 @@ class EepromModel(object):
             data[field_name] = field.serialize()
         return data
 
-    def _add_property(self, field_name):
-        setattr(self.__class__, field_name, property(lambda s: s._get_property(field_name),
-                                                     lambda s, v: s._set_property(field_name, v)))
+    @classmethod
+    def _add_property(cls, field_name):
+        setattr(cls, field_name, property(lambda s: s._get_property(field_name),
+                                          lambda s, v: s._set_property(field_name, v)))
 
     def _get_property(self, field_name):
         field = getattr(self, '_{0}'.format(field_name))
@@ -452,7 +1146,7 @@ class EepromModel(object):
     @classmethod
     def has_id(cls):
         """ Check if the EepromModel has an id. """
-        return cls.get_id_field() is not None
+        return cls.get_layout()['has_id']
 
     @classmethod
     def get_name(cls):
@@ -462,15 +1156,15 @@ class EepromModel(object):
     @classmethod
     def check_id(cls, id):
         """ Check if the id is valid for this EepromModel. """
-        has_id = cls.has_id()
+        layout = cls.get_layout()
+        has_id = layout['has_id']
 
         if id is None and has_id:
             raise TypeError('{0} has an id, but no id was given.'.format(cls.__name__))
         if id is not None:
             if not has_id:
                 raise TypeError('{0} doesn\'t have an id, but id was given.'.format(cls.__name__))
-            id_fields = cls.get_fields(include_id=True)
-            max_id = id_fields[0][1].get_max_id()
+            max_id = layout['max_id']
             if id > max_id:
                 raise TypeError('The maximum id for {0} is {1}, {2} was provided.'.format(cls.__name__, max_id, id))
 
@@ -576,6 +1270,9 @@ class EepromDataContainer(object):
     convert data to and from a string of bytes and contains the address(generator).
     """
 
+    __slots__ = ('composed', 'addresses', 'read_only', 'address', '_composed_data',
+                 '_composed_fields', '_composed_addresses', '_data', '_data_type')
+
     def __init__(self, data_type, address):
         """
         :type data_type: master.eeprom_controller.EepromDataType
@@ -586,11 +1283,14 @@ class EepromDataContainer(object):
             self.addresses = []
             self._composed_data = {}
             self._composed_fields = []
+            self._composed_addresses = {}
             self.read_only = data_type.read_only
             for data_type in data_type.data_types:
                 field_name, field_type = data_type
+                container = EepromDataContainer(field_type, address[field_name])
                 self._composed_fields.append(field_name)
-                self._composed_data[field_name] = EepromDataContainer(field_type, address[field_name])
+                self._composed_data[field_name] = container
+                self._composed_addresses.setdefault(address[field_name], []).append(container)
                 self.addresses.append(address[field_name])
         else:
             self.composed = False
@@ -607,10 +1307,8 @@ class EepromDataContainer(object):
             if not isinstance(data, list):
                 raise RuntimeError('Parameter `data` should be: list of EepromData')
             for item in data:
-                for field_name in self._composed_fields:
-                    container = self._composed_data[field_name]
-                    if container.address == item.address:
-                        container.load_bytes(item)
+                for container in self._composed_addresses.get(item.address, []):
+                    container.load_bytes(item)
         else:
             self._data = data
 
@@ -957,6 +1655,8 @@ class EepromEnum(EepromDataType):
 class EextDataContainer(object):
     """ Data container instance """
 
+    __slots__ = ('_data', '_data_type')
+
     def __init__(self, data_type):
         self._data = None
         self._data_type = data_type
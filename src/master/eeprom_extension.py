@@ -19,15 +19,18 @@ data is stored in a sqlite database on the gateways filesystem.
 
 import sqlite3
 import os.path
+from contextlib import contextmanager
 from threading import Lock
 
 
 class EepromExtension(object):
     """ Provides the interface for reading and writing EepromExtension objects to the sqlite
-    database. """
+    database. The extensions of a model are read in one query and kept in memory until the
+    extensions of that model are written. """
 
     def __init__(self, db_filename):
         self._lock = Lock()
+        self._mirror = {}  # Maps the model name on a dict mapping (model id, field) on the value
         create_tables = not os.path.exists(db_filename)
         self._connection = sqlite3.connect(db_filename,
                                            detect_types=sqlite3.PARSE_DECLTYPES,
@@ -46,22 +49,61 @@ class EepromExtension(object):
 
     def read_data(self, eeprom_model_name, model_id, field_name):
         model_id = 0 if model_id is None else model_id
+        return self.read_model(eeprom_model_name).get((model_id, field_name))
+
+    def read_model(self, eeprom_model_name):
+        """
+        Read the extensions of all ids and fields of a model.
+
+        :type eeprom_model_name: basestring
+        :returns: dict mapping a tuple (model id, field name) on the value, the model id is 0 for \
+        models without an id. The dict is shared and should not be modified.
+        """
         with self._lock:
-            for row in self._cursor.execute("SELECT value FROM extensions WHERE model=? AND model_id=? AND field=?",
-                                            (eeprom_model_name, model_id, field_name)):
-                return row[0]
-        return None
+            model_data = self._mirror.get(eeprom_model_name)
+            if model_data is None:
+                model_data = {}
+                for row in self._cursor.execute("SELECT model_id, field, value FROM extensions WHERE model=?",
+                                                (eeprom_model_name,)):
+                    model_data[(row[0], row[1])] = row[2]
+                self._mirror[eeprom_model_name] = model_data
+            return model_data
 
     def write_data(self, data):
         """
+        Write the extensions in one transaction.
+
         :type data: list of tuple[basestring, int, basestring, basestring]
         """
-        for data_entry in data:
-            model_name, model_id, field_name, value = data_entry
-            model_id = 0 if model_id is None else model_id
-            with self._lock:
-                self._cursor.execute("INSERT INTO extensions (model, model_id, field, value) VALUES (?, ?, ?, ?)",
-                                     (model_name, model_id, field_name, value))
+        with self.write_transaction(data):
+            pass
+
+    @contextmanager
+    def write_transaction(self, data):
+        """
+        Context manager that writes the extensions in one transaction once the block succeeds,
+        nothing is written if the block fails. The lock is not held while the block runs (eg.
+        during a write to the master): the extensions can be read in the meantime, the readers
+        get the previous extensions until the transaction is committed.
+
+        :type data: list of tuple[basestring, int, basestring, basestring]
+        """
+        rows = [(model_name, 0 if model_id is None else model_id, field_name, value)
+                for model_name, model_id, field_name, value in data]
+        yield
+        if len(rows) == 0:
+            return
+        with self._lock:
+            for row in rows:
+                self._mirror.pop(row[0], None)
+            self._cursor.execute("BEGIN")
+            try:
+                self._cursor.executemany("INSERT INTO extensions (model, model_id, field, value) VALUES (?, ?, ?, ?)",
+                                         rows)
+            except Exception:
+                self._cursor.execute("ROLLBACK")
+                raise
+            self._cursor.execute("COMMIT")
 
     def close(self):
         """ Commit the changes and close the database connection. """
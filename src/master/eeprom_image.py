@@ -0,0 +1,133 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Memory-mapped image of the master eeprom. The image is persisted to a file so the banks can be
+served after a restart without reading them over the serial bus.
+
+Layout of the file: a header (magic and version), the metadata of every bank (flags,
+generation and length, 3 unsigned 32-bit integers) and the data of every bank.
+"""
+
+import os
+import mmap
+import struct
+import logging
+
+LOGGER = logging.getLogger("openmotics")
+
+NUM_BANKS = 256
+BANK_SIZE = 256
+
+FLAG_VALID = 1
+
+
+class EepromImage(object):
+    """ Image of the master eeprom with a validity flag and a generation per bank. The generation
+    of a bank is incremented every time its data changes. Not thread-safe. """
+
+    MAGIC = 'OMEEPIMG'
+    VERSION = 1
+    HEADER = struct.Struct('<8sI')
+    METADATA = struct.Struct('<III')
+
+    def __init__(self, filename=None, num_banks=NUM_BANKS, bank_size=BANK_SIZE):
+        """
+        Open the image, a new (empty) image is created if the file does not exist or has an
+        unknown format.
+
+        :param filename: the file that contains the image, None for an image in memory.
+        :type filename: str
+        """
+        self.__num_banks = num_banks
+        self.__bank_size = bank_size
+        self.__data_offset = EepromImage.HEADER.size + num_banks * EepromImage.METADATA.size
+        size = self.__data_offset + num_banks * bank_size
+
+        if filename is None:
+            self.__map = mmap.mmap(-1, size)
+            self.__clear()
+        else:
+            fresh = not os.path.exists(filename) or os.path.getsize(filename) != size
+            if fresh:
+                with open(filename, 'wb') as image_file:
+                    image_file.write('\x00' * size)
+            with open(filename, 'r+b') as image_file:
+                self.__map = mmap.mmap(image_file.fileno(), size)
+            (magic, version) = EepromImage.HEADER.unpack_from(self.__map, 0)
+            if magic != EepromImage.MAGIC or version != EepromImage.VERSION:
+                if not fresh:
+                    LOGGER.warning('Eeprom image {0} has an unknown format, starting with an empty '
+                                   'image'.format(filename))
+                self.__clear()
+
+    def __clear(self):
+        """ Mark all banks as invalid and write the header. """
+        EepromImage.HEADER.pack_into(self.__map, 0, EepromImage.MAGIC, EepromImage.VERSION)
+        for bank in xrange(self.__num_banks):
+            self.__set_metadata(bank, 0, 0, 0)
+
+    def __get_metadata(self, bank):
+        """ Get a tuple (flags, generation, length) for a bank. """
+        return EepromImage.METADATA.unpack_from(
+            self.__map, EepromImage.HEADER.size + bank * EepromImage.METADATA.size)
+
+    def __set_metadata(self, bank, flags, generation, length):
+        """ Set the flags, the generation and the length of the data of a bank. """
+        EepromImage.METADATA.pack_into(
+            self.__map, EepromImage.HEADER.size + bank * EepromImage.METADATA.size,
+            flags, generation, length)
+
+    def is_valid(self, bank):
+        """ Checks whether the image contains data for a bank. """
+        return self.__get_metadata(bank)[0] & FLAG_VALID != 0
+
+    def get_generation(self, bank):
+        """ Get the generation of a bank. """
+        return self.__get_metadata(bank)[1]
+
+    def get(self, bank):
+        """ Get the data of a bank, None if the bank is not valid. """
+        (flags, _, length) = self.__get_metadata(bank)
+        if flags & FLAG_VALID == 0:
+            return None
+        start = self.__data_offset + bank * self.__bank_size
+        return self.__map[start:start + length]
+
+    def set(self, bank, data):
+        """
+        Set the data of a bank, the generation is incremented if the data changed. Bytes beyond
+        the size of a bank are ignored.
+
+        :returns: whether the data of the bank changed.
+        """
+        data = data[:self.__bank_size]
+        (flags, generation, length) = self.__get_metadata(bank)
+        start = self.__data_offset + bank * self.__bank_size
+        if flags & FLAG_VALID != 0 and self.__map[start:start + length] == data:
+            return False
+        # Clear the valid flag while writing: a crash halfway does not leave a corrupt valid bank
+        self.__set_metadata(bank, flags & ~FLAG_VALID, generation, length)
+        self.__map[start:start + len(data)] = data
+        self.__set_metadata(bank, flags | FLAG_VALID, (generation + 1) & 0xFFFFFFFF, len(data))
+        return True
+
+    def invalidate(self, bank):
+        """ Mark a bank as invalid, the generation is incremented. """
+        (flags, generation, length) = self.__get_metadata(bank)
+        self.__set_metadata(bank, flags & ~FLAG_VALID, (generation + 1) & 0xFFFFFFFF, length)
+
+    def flush(self):
+        """ Flush the image to the file. """
+        self.__map.flush()
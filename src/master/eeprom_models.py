@@ -21,6 +21,10 @@ from eeprom_controller import EepromModel, EepromAddress, EepromId, EepromString
                               EepromCSV, CompositeDataType, EepromSignedTemp, EepromIBool, \
                               EepromEnum, EextByte, EextString, EextBool
 
+# The banks that are changed by the module discovery: the number of modules (bank 0) and the
+# pages of the input modules (banks 2 - 31) and the output modules (banks 33 - 62).
+MODULE_BANKS = [0] + range(2, 32) + range(33, 63)
+
 
 def page_per_module(module_size, start_page, start_offset, field_size):
     """ 
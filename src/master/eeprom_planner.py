@@ -0,0 +1,107 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Plans the reads from and the writes to the master eeprom. For reads, a bank is either listed
+completely (EL) or the requested bytes are read using ranged reads (RE, at most 10 bytes per
+command), depending on which is cheaper. Writes (WE, at most 10 bytes per command) are
+coalesced into the minimal number of commands.
+"""
+
+from eeprom_image import BANK_SIZE
+
+RANGE_SIZE = 10
+
+# Default cost (in sec) of the commands, used until the latency of the commands is measured. A bank
+# list transfers 256 bytes more than a ranged read, which takes about 22 ms at 115200 baud.
+DEFAULT_BANK_COST = 0.030
+DEFAULT_RANGE_COST = 0.008
+
+
+def get_ranges(offsets, bank_size=BANK_SIZE, range_size=RANGE_SIZE):
+    """
+    Get the minimal list of ranged reads that covers a set of offsets in a bank, a range ends at
+    the last offset it has to cover.
+
+    :param offsets: the offsets that have to be read.
+    :type offsets: set of int
+    :returns: list of tuples (offset, length).
+    """
+    ranges = []
+    start = None
+    last = None
+    for offset in sorted(o for o in offsets if o < bank_size):
+        if start is None or offset >= start + range_size:
+            if start is not None:
+                ranges.append((start, last - start + 1))
+            start = offset
+        last = offset
+    if start is not None:
+        ranges.append((start, last - start + 1))
+    return ranges
+
+
+def plan_reads(offsets, bank_cost=None, range_cost=None, bank_size=BANK_SIZE, range_size=RANGE_SIZE):
+    """
+    Choose, for every bank, the cheapest way to read the requested offsets: one bank list or a
+    number of ranged reads.
+
+    :param offsets: dict mapping the bank on the set of offsets that have to be read.
+    :type offsets: dict[int, set of int]
+    :param bank_cost: the cost (in sec) of a bank list, None to use the default.
+    :param range_cost: the cost (in sec) of a ranged read, None to use the default.
+    :returns: tuple (list of banks to list, list of tuples (bank, offset, length) to read).
+    """
+    bank_cost = DEFAULT_BANK_COST if bank_cost is None else bank_cost
+    range_cost = DEFAULT_RANGE_COST if range_cost is None else range_cost
+    banks = []
+    reads = []
+    for bank in sorted(offsets.keys()):
+        ranges = get_ranges(offsets[bank], bank_size, range_size)
+        if len(ranges) == 0:
+            continue
+        if len(ranges) * range_cost < bank_cost:
+            reads += [(bank, offset, length) for (offset, length) in ranges]
+        else:
+            banks.append(bank)
+    return (banks, reads)
+
+
+def plan_writes(changes, current, range_size=RANGE_SIZE):
+    """
+    Get the minimal list of writes that covers the changed bytes in a bank. A write command has
+    a fixed length, so unchanged bytes between two changes are written as well if both fit in
+    one command, as long as the current value of those bytes is known.
+
+    :param changes: dict mapping the offset on the new byte, for the bytes that changed.
+    :type changes: dict[int, str]
+    :param current: dict mapping the offset on the current byte, for the bytes that are known.
+    :type current: dict[int, str]
+    :returns: list of tuples (offset, data).
+    """
+    writes = []
+    start = None
+    data = ''
+    for offset in sorted(changes.keys()):
+        gap = xrange(start + len(data), offset) if start is not None else None
+        if start is not None and offset < start + range_size and all(o in current for o in gap):
+            data += ''.join(current[o] for o in gap) + changes[offset]
+        else:
+            if start is not None:
+                writes.append((start, data))
+            start = offset
+            data = changes[offset]
+    if start is not None:
+        writes.append((start, data))
+    return writes
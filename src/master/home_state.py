@@ -0,0 +1,119 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The home state module contains a versioned in-memory model of the state of the devices
+(outputs, inputs, shutters, sensors, thermostats and pulse counters).
+"""
+
+import random
+from threading import Lock
+
+ENTITY_TYPES = ['output', 'input', 'shutter', 'sensor', 'thermostat', 'thermostat_group',
+                'pulse_counter']
+
+
+class HomeState(object):
+    """ Holds the last known state of every entity (eg. output 5). Every change of an entity gets
+    a new version, the versions are increasing across all entities. Clients can get a snapshot
+    of all entities and afterwards only the entities that changed since the version of the
+    snapshot. When entities are removed, the clients get a new snapshot. """
+
+    def __init__(self):
+        """ Create an empty HomeState. The epoch identifies the instance: the versions of
+        another instance (eg. after a restart) can not be compared, it is random so a restart
+        within the same second also gets another epoch. """
+        self.__lock = Lock()
+        self.__epoch = random.SystemRandom().randint(1, 2 ** 31 - 1)
+        self.__version = 0
+        self.__removed_version = 0  # The version of the last removal of entities
+        self.__entities = dict((entity_type, {}) for entity_type in ENTITY_TYPES)
+
+    def update(self, entity_type, entity_id, state):
+        """ Update the state of an entity, the entity only gets a new version if its state changed.
+
+        :param entity_type: One of ENTITY_TYPES.
+        :param entity_id: The id of the entity.
+        :param state: dict with the state of the entity.
+        :returns: whether the state changed.
+        """
+        with self.__lock:
+            return self.__update(entity_type, entity_id, state)
+
+    def update_all(self, entity_type, states, complete=False):
+        """ Update the state of multiple entities of a type.
+
+        :param entity_type: One of ENTITY_TYPES.
+        :param states: dict mapping the entity id on the state of the entity.
+        :param complete: Whether states contains all entities of the type, the other entities \
+        are removed (eg. after the discovery of the modules).
+        :returns: the list of ids of the entities that changed or were removed.
+        """
+        with self.__lock:
+            changed = [entity_id for entity_id, state in states.iteritems()
+                       if self.__update(entity_type, entity_id, state)]
+            if complete:
+                entities = self.__entities[entity_type]
+                removed = [entity_id for entity_id in entities if entity_id not in states]
+                if len(removed) > 0:
+                    for entity_id in removed:
+                        del entities[entity_id]
+                    self.__version += 1
+                    self.__removed_version = self.__version
+                    changed.extend(removed)
+            return changed
+
+    def __update(self, entity_type, entity_id, state):
+        """ Update the state of an entity, the lock should be held. """
+        entities = self.__entities[entity_type]
+        current = entities.get(entity_id)
+        if current is not None and current[1] == state:
+            return False
+        self.__version += 1
+        entities[entity_id] = (self.__version, dict(state))
+        return True
+
+    def get_version(self):
+        """ Get the version of the last change. """
+        with self.__lock:
+            return self.__version
+
+    def get_changes(self, since=None, epoch=None):
+        """ Get the entities that changed since a version. All entities are returned if since is
+        None, if the version is not known by this instance (another epoch or a newer version) or
+        if entities were removed since that version.
+
+        :param since: The version of the last known state, None for a snapshot.
+        :param epoch: The epoch of the version, None to skip the check.
+        :returns: dict with 'epoch', 'version' (the version of the returned state), 'full' \
+        (whether all entities are returned) and 'state': dict mapping the entity type on a list \
+        of entity states (including the 'id' of the entity).
+        """
+        with self.__lock:
+            full = since is None or (epoch is not None and epoch != self.__epoch) or \
+                since > self.__version or since < self.__removed_version
+            state = {}
+            for entity_type, entities in self.__entities.iteritems():
+                changes = []
+                for entity_id in sorted(entities):
+                    (version, entity_state) = entities[entity_id]
+                    if full or version > since:
+                        entity = dict(entity_state)
+                        entity['id'] = entity_id
+                        changes.append(entity)
+                state[entity_type] = changes
+            return {'epoch': self.__epoch,
+                    'version': self.__version,
+                    'full': full,
+                    'state': state}
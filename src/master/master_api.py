@@ -19,9 +19,27 @@ Requires Firmware 3.137.17 -- Caution on update: status api changed (used in upd
 @author: fryckbos
 """
 
+import functools
+
 from master_command import MasterCommandSpec, Field, OutputFieldType, DimmerFieldType, \
     ErrorListFieldType
 
+
+def memoized(spec_function):
+    """ Only create the MasterCommandSpec of an api function once: the specs are not modified
+    after creation, so all callers can share the same (compiled) instance. """
+    cache = []
+
+    @functools.wraps(spec_function)
+    def wrapper():
+        """ Returns the cached spec. """
+        if len(cache) == 0:
+            cache.append(spec_function())
+        return cache[0]
+
+    return wrapper
+
+
 BA_GROUP_ACTION = 2
 
 BA_TRIGGER_EVENT = 60
@@ -106,6 +124,7 @@ BA_LIGHT_ON_TIMER_2220_NO_OVERRULE = 205
 BA_LIGHT_ON_TIMER_3120_NO_OVERRULE = 206
 
 
+@memoized
 def basic_action():
     """ Basic actions. """
     return MasterCommandSpec("BA",
@@ -113,6 +132,7 @@ def basic_action():
                              [Field.str("resp", 2), Field.padding(11), Field.lit("\r\n")])
 
 
+@memoized
 def reset():
     """ Reset the gateway, used for firmware updates. """
     return MasterCommandSpec("re",
@@ -120,6 +140,7 @@ def reset():
                              [Field.str("resp", 2), Field.padding(11), Field.lit("\r\n")])
 
 
+@memoized
 def status():
     """ Get the status of the master. """
     return MasterCommandSpec("ST",
@@ -130,6 +151,7 @@ def status():
                               Field.byte('h'), Field.lit('\r\n')])
 
 
+@memoized
 def set_time():
     """ Set the time on the master. """
     return MasterCommandSpec("st",
@@ -140,6 +162,7 @@ def set_time():
                               Field.lit("\r\n")])
 
 
+@memoized
 def eeprom_list():
     """ List all bytes from a certain eeprom bank """
     return MasterCommandSpec("EL",
@@ -147,6 +170,7 @@ def eeprom_list():
                              [Field.byte("bank"), Field.str("data", 256), Field.lit("\r\n")])
 
 
+@memoized
 def read_eeprom():
     """ Read a number (1-10) of bytes from a certain eeprom bank and address. """
     return MasterCommandSpec("RE",
@@ -154,6 +178,7 @@ def read_eeprom():
                              [Field.byte('bank'), Field.byte('addr'), Field.varstr('data', 10), Field.lit('\r\n')])
 
 
+@memoized
 def write_eeprom():
     """ Write data bytes to the addr in the specified eeprom bank """
     return MasterCommandSpec("WE",
@@ -161,6 +186,7 @@ def write_eeprom():
                              [Field.byte("bank"), Field.byte("address"), Field.varstr("data", 10), Field.lit('\r\n')])
 
 
+@memoized
 def activate_eeprom():
     """ Activate eeprom after write """
     return MasterCommandSpec("AE",
@@ -168,6 +194,7 @@ def activate_eeprom():
                              [Field.byte("eep"), Field.str("resp", 2), Field.padding(10), Field.lit('\r\n')])
 
 
+@memoized
 def number_of_io_modules():
     """ Read the number of input and output modules """
     return MasterCommandSpec("rn",
@@ -176,6 +203,7 @@ def number_of_io_modules():
                               Field.lit('\r\n')])
 
 
+@memoized
 def read_output():
     """ Read the information about an output """
     return MasterCommandSpec("ro",
@@ -187,6 +215,7 @@ def read_output():
                               Field.lit('\r\n')])
 
 
+@memoized
 def read_input():
     """ Read the information about an input """
     return MasterCommandSpec("ri",
@@ -195,6 +224,7 @@ def read_input():
                               Field.str('input_name', 8), Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def shutter_status():
     """ Read the status of a shutter module. """
     return MasterCommandSpec("SO",
@@ -202,6 +232,7 @@ def shutter_status():
                              [Field.byte("module_nr"), Field.padding(3), Field.byte("status"), Field.lit('\r\n')])
 
 
+@memoized
 def temperature_list():
     """ Read the temperature thermostat sensor list for a series of 12 sensors """
     return MasterCommandSpec("TL",
@@ -212,6 +243,7 @@ def temperature_list():
                               Field.svt('tmp11'), Field.lit('\r\n')])
 
 
+@memoized
 def setpoint_list():
     """ Read the current setpoint of the thermostats in series of 12 """
     return MasterCommandSpec("SL",
@@ -222,6 +254,7 @@ def setpoint_list():
                               Field.svt('tmp11'), Field.lit('\r\n')])
 
 
+@memoized
 def thermostat_mode():
     """ Read the current thermostat mode """
     return MasterCommandSpec("TM",
@@ -229,6 +262,7 @@ def thermostat_mode():
                              [Field.byte('mode'), Field.padding(12), Field.lit('\r\n')])
 
 
+@memoized
 def read_setpoint():
     """ Read the programmed setpoint of a thermostat """
     return MasterCommandSpec("rs",
@@ -260,6 +294,7 @@ def read_setpoint():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def write_setpoint():
     """ Write a setpoints of a thermostats """
     return MasterCommandSpec("ws",
@@ -268,6 +303,7 @@ def write_setpoint():
                               Field.lit('\r\n')])
 
 
+@memoized
 def permanent_manual_thermostat_list():
     """ Read the permanent manual bytes, 1 per thermostat. """
     return MasterCommandSpec("pL",
@@ -284,6 +320,7 @@ def permanent_manual_thermostat_list():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def thermostat_list():
     """ Read the thermostat mode, the outside temperature, the temperature of each thermostat,
     as well as the setpoint.
@@ -310,6 +347,7 @@ def thermostat_list():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def thermostat_mode_list():
     """ Read the thermostat mode for each thermostat. """
     return MasterCommandSpec("ml",
@@ -325,6 +363,7 @@ def thermostat_mode_list():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def sensor_humidity_list():
     """ Reads the list humidity values of the 32 (0-31) sensors. """
     return MasterCommandSpec("hl",
@@ -340,6 +379,7 @@ def sensor_humidity_list():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def sensor_temperature_list():
     """ Reads the list temperature values of the 32 (0-31) sensors. """
     return MasterCommandSpec("cl",
@@ -355,6 +395,7 @@ def sensor_temperature_list():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def sensor_brightness_list():
     """ Reads the list brightness values of the 32 (0-31) sensors. """
     return MasterCommandSpec("bl",
@@ -370,6 +411,7 @@ def sensor_brightness_list():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def virtual_sensor_list():
     """ Read the list with virtual settings of the 32 (0-31) sensors. """
     return MasterCommandSpec("VL",
@@ -385,6 +427,7 @@ def virtual_sensor_list():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def set_virtual_sensor():
     """ Set the values (temperature, humidity, brightness) of a virtual sensor. """
     return MasterCommandSpec("VS",
@@ -394,6 +437,7 @@ def set_virtual_sensor():
                               Field.padding(9), Field.lit('\r\n')])
 
 
+@memoized
 def pulse_list():
     """ List the pulse counter values. """
     return MasterCommandSpec("PL",
@@ -407,6 +451,7 @@ def pulse_list():
                               Field.crc(), Field.lit('\r\n')])
 
 
+@memoized
 def error_list():
     """ Get the number of errors for each input and output module. """
     return MasterCommandSpec("el",
@@ -414,6 +459,7 @@ def error_list():
                              [Field("errors", ErrorListFieldType()), Field.crc(), Field.lit("\r\n")])
 
 
+@memoized
 def clear_error_list():
     """ Clear the number of errors. """
     return MasterCommandSpec("ec",
@@ -421,6 +467,7 @@ def clear_error_list():
                              [Field.str("resp", 2), Field.padding(11), Field.lit("\r\n")])
 
 
+@memoized
 def write_airco_status_bit():
     """ Write the airco status bit. """
     return MasterCommandSpec("AW",
@@ -436,6 +483,7 @@ def write_airco_status_bit():
                               Field.lit("\r\n")])
 
 
+@memoized
 def read_airco_status_bits():
     """ Read the airco status bits. """
     return MasterCommandSpec("AR",
@@ -451,6 +499,7 @@ def read_airco_status_bits():
                               Field.lit("\r\n")])
 
 
+@memoized
 def to_cli_mode():
     """ Go to CLI mode """
     return MasterCommandSpec("CM",
@@ -458,6 +507,7 @@ def to_cli_mode():
                              None)
 
 
+@memoized
 def module_discover_start():
     """ Put the master in module discovery mode. """
     return MasterCommandSpec("DA",
@@ -465,6 +515,7 @@ def module_discover_start():
                              [Field.str("resp", 2), Field.padding(11), Field.lit("\r\n")])
 
 
+@memoized
 def module_discover_stop():
     """ Put the master into the normal working state. """
     return MasterCommandSpec("DO",
@@ -472,6 +523,7 @@ def module_discover_stop():
                              [Field.str("resp", 2), Field.padding(11), Field.lit("\r\n")])
 
 
+@memoized
 def indicate():
     """ Flash the led for a given output/input/sensor. """
     return MasterCommandSpec("IN",
@@ -479,6 +531,7 @@ def indicate():
                              [Field.str("resp", 2), Field.padding(11), Field.lit("\r\n")])
 
 
+@memoized
 def write_timer():
     """ Writes a timer setting to an Output, and immediately activates the timer value (even when an Output is already on). """
     return MasterCommandSpec("WT",
@@ -489,6 +542,7 @@ def write_timer():
 
 # Below are the asynchronous messages, sent by the master to the gateway
 
+@memoized
 def output_list():
     """ The message sent by the master whenever the outputs change. """
     return MasterCommandSpec("OL",
@@ -496,6 +550,7 @@ def output_list():
                              [Field("outputs", OutputFieldType()), Field.lit("\r\n")])
 
 
+@memoized
 def input_list():
     """ The message sent by the master whenever an input is enabled. """
     return MasterCommandSpec("IL",
@@ -503,6 +558,7 @@ def input_list():
                              [Field.byte('input'), Field.byte('output'), Field.lit("\r\n")])
 
 
+@memoized
 def module_initialize():
     """ The message sent by the master whenever a module is initialized in module discovery mode. """
     return MasterCommandSpec("MI",
@@ -511,6 +567,7 @@ def module_initialize():
                               Field.byte('io_type'), Field.padding(5), Field.lit('\r\n')])
 
 
+@memoized
 def event_triggered():
     """ The message sent by the master to trigger an event. This event is triggered by basic action 60. """
     return MasterCommandSpec("EV",
@@ -520,6 +577,7 @@ def event_triggered():
 
 # Below are the function to update the firmware of the modules (input/output/dimmer/thermostat)
 
+@memoized
 def modules_goto_bootloader():
     """ Reset the module to go to the bootloader. """
     return MasterCommandSpec("FR",
@@ -529,6 +587,7 @@ def modules_goto_bootloader():
                               Field.byte('crc1'), Field.padding(5), Field.lit("\r\n")])
 
 
+@memoized
 def modules_new_firmware_version():
     """ Preprare the slave module for a new version. """
     return MasterCommandSpec("FN",
@@ -538,6 +597,7 @@ def modules_new_firmware_version():
                               Field.byte('crc1'), Field.padding(5), Field.lit("\r\n")])
 
 
+@memoized
 def modules_new_crc():
     """ Write the new crc code to the bootloaded module. """
     return MasterCommandSpec("FC",
@@ -548,6 +608,7 @@ def modules_new_crc():
                               Field.byte('crc1'), Field.padding(5), Field.lit("\r\n")])
 
 
+@memoized
 def change_communication_mode_to_long():
     """ Change the number of bytes used to communicate with the master to 75. """
     return MasterCommandSpec("cm",
@@ -555,6 +616,7 @@ def change_communication_mode_to_long():
                              [Field.lit('\x4d'), Field.lit('\x01'), Field.padding(11), Field.lit("\r\n")])
 
 
+@memoized
 def change_communication_mode_to_short():
     """ Change the number of bytes used to communicate with the master to 18. """
     return MasterCommandSpec("cm",
@@ -562,6 +624,7 @@ def change_communication_mode_to_short():
                              [Field.lit('\x12'), Field.lit('\x01'), Field.padding(11), Field.lit("\r\n")])
 
 
+@memoized
 def modules_update_firmware_block():
     """ Upload 1 block of 64 bytes to the module. """
     return MasterCommandSpec("FD",
@@ -571,6 +634,7 @@ def modules_update_firmware_block():
                               Field.byte('crc1'), Field.lit("\r\n")])
 
 
+@memoized
 def modules_get_version():
     """ Get the version of the module. """
     return MasterCommandSpec("FV",
@@ -581,6 +645,7 @@ def modules_get_version():
                               Field.lit('C'), Field.byte('crc0'), Field.byte('crc1'), Field.lit("\r\n")])
 
 
+@memoized
 def modules_integrity_check():
     """ Check the integrity of the new code. """
     return MasterCommandSpec("FE",
@@ -590,6 +655,7 @@ def modules_integrity_check():
                               Field.byte('crc1'), Field.padding(5), Field.lit("\r\n")])
 
 
+@memoized
 def modules_goto_application():
     """ Let the module go to application. """
     return MasterCommandSpec("FG",
@@ -712,4 +778,4 @@ def dimmer_to_percentage(dimmer_value):
     :param dimmer_value: integer in [0, 63].
     :returns: dimmer percentage in [0, 100].
     """
-    return DimmerFieldType().decode(chr(dimmer_value))
+    return DimmerFieldType.to_percentage(dimmer_value)
@@ -20,6 +20,7 @@ Provides a function for each API call.
 """
 
 import math
+import struct
 
 import master_api
 from serial_utils import printable
@@ -50,6 +51,13 @@ class MasterCommandSpec(object):
         self.output_fields = output_fields
         self.output_action = action if output_action is None else output_action
 
+        self.__decoders = {}
+        self.__crc_tail_length = None
+        for (index, field) in enumerate(self.output_fields or []):
+            if Field.is_crc(field):
+                self.__crc_tail_length = \
+                    sum([f.get_min_decode_bytes() for f in self.output_fields[index:]])
+
     def create_input(self, cid, fields=None):
         """ Create an input command for the master using this spec and the provided fields.
 
@@ -62,22 +70,18 @@ class MasterCommandSpec(object):
         if fields is None:
             fields = dict()
 
-        start = "STR" + self.action + chr(cid)
-        encoded_fields = ""
+        encoded_fields = []
         for field in self.input_fields:
             if Field.is_crc(field):
-                encoded_fields += self.__calc_crc(encoded_fields)
+                encoded_fields.append(self.__calc_crc("".join(encoded_fields)))
             else:
-                encoded_fields += field.encode(fields.get(field.name))
+                encoded_fields.append(field.encode(fields.get(field.name)))
 
-        return start + encoded_fields + "\r\n"
+        return "STR" + self.action + chr(cid) + "".join(encoded_fields) + "\r\n"
 
     def __calc_crc(self, encoded_string):
         """ Calculate the crc of an string. """
-        crc = 0
-        for byte in encoded_string:
-            crc += ord(byte)
-
+        crc = sum(bytearray(encoded_string))
         return 'C' + chr(crc / 256) + chr(crc % 256)
 
     def create_output(self, cid, fields):
@@ -90,39 +94,64 @@ class MasterCommandSpec(object):
         :type fields: dict
         :rtype: string
         """
-        ret = self.output_action + chr(cid)
+        ret = [self.output_action + chr(cid)]
         for field in self.output_fields:
-            ret += field.encode(fields.get(field.name))
-        return ret
+            ret.append(field.encode(fields.get(field.name)))
+        return "".join(ret)
 
-    def consume_output(self, byte_str, partial_result=None):
+    def consume_output(self, byte_str, partial_result=None, offset=0, length=None):
         """ When the prefix of a command is matched, consume_output is used to fill in the
         output fields. If a part of the fields was already matched, the parial_result should
         be provided. The output of this method indicates how many bytes were consumed, the
         result and if the consumption was done.
 
         :param byte_str Output from the master
-        :type byte_str: string of bytes
+        :type byte_str: string of bytes or bytearray
         :param partial_result: In case we already have data for this unfinished communication.
         :type partial_result: None if no partial result yet
+        :param offset: Offset in byte_str where the output starts.
+        :type offset: int
+        :param length: Number of bytes available after the offset, None for all bytes.
+        :type length: int or None
         :rtype: tuple of (bytes consumed(int), result(Result), done(bool))
         """
+        end = len(byte_str) if length is None else offset + length
+        input_str = byte_str
+        input_offset = offset
+
         if partial_result == None:
             from_pending = 0
             partial_result = Result()
         else:
             from_pending = len(partial_result.pending_bytes)
-            byte_str = partial_result.pending_bytes + byte_str
+            if from_pending > 0:
+                byte_str = partial_result.pending_bytes + str(byte_str[offset:end])
+                offset = 0
+                end = len(byte_str)
             partial_result.pending_bytes = ""
 
-        def decode_field(index, byte_str, field, num_bytes):
+        def done(bytes_consumed, complete):
+            """ Keep track of the bytes consumed and create the return value. """
+            partial_result.actual_bytes += \
+                str(input_str[input_offset:input_offset + bytes_consumed])
+            return (bytes_consumed, partial_result, complete)
+
+        decoder = self.__get_decoder(partial_result.field_index)
+        if decoder is not None and end - offset >= decoder.size:
+            # Fast path: the remaining fields have a fixed length and all bytes are available
+            partial_result.fields.update(decoder.decode(byte_str, offset))
+            partial_result.field_index = len(self.output_fields)
+            partial_result.complete = True
+            return done(decoder.size - from_pending, True)
+
+        def decode_field(index, field, num_bytes):
             """ Decode one field, returns index for the next field if successful,
-            returns a tuple with decode information if not successful."""
-            if index + num_bytes <= len(byte_str):
+            returns None if more bytes are required."""
+            if index + num_bytes <= end:
                 try:
-                    decoded = field.decode(byte_str[index:index + num_bytes])
+                    decoded = field.decode(str(byte_str[index:index + num_bytes]))
                 except NeedMoreBytesException, nmbe:
-                    return decode_field(index, byte_str, field, nmbe.bytes_required)
+                    return decode_field(index, field, nmbe.bytes_required)
                 else:
                     partial_result[field.name] = decoded
                     partial_result.field_index += 1
@@ -130,33 +159,91 @@ class MasterCommandSpec(object):
                     index += num_bytes
                     return index
             else:
-                partial_result.pending_bytes += byte_str[index:]
-                return (len(byte_str) - from_pending, partial_result, False)
+                partial_result.pending_bytes += str(byte_str[index:end])
+                return None
 
         # Found beginning, start decoding
-        index = 0
+        index = offset
         for field in self.output_fields[partial_result.field_index:]:
-            index = decode_field(index, byte_str, field, field.get_min_decode_bytes())
-            if type(index) != int:
+            index = decode_field(index, field, field.get_min_decode_bytes())
+            if index is None:
                 # We ran out of bytes
-                return index
+                return done(end - offset - from_pending, False)
 
         partial_result.complete = True
-        partial_result.actual_bytes = byte_str[:index]
-        return (index - from_pending, partial_result, True)
+        return done(index - offset - from_pending, True)
+
+    def __get_decoder(self, field_index):
+        """ Get the compiled decoder for the output fields starting at field_index.
+
+        :returns: :class`StructDecoder` or None if a field has a variable length.
+        """
+        if field_index not in self.__decoders:
+            self.__decoders[field_index] = StructDecoder.compile(self.output_fields[field_index:])
+        return self.__decoders[field_index]
+
+    def check_crc(self, result):
+        """ Check the crc in a complete result against the bytes that were received.
+
+        :param result: Result of the command, containing the crc field.
+        :type result: :class`Result`
+        :returns: boolean
+        """
+        crc = sum(bytearray(result.actual_bytes[:-self.__crc_tail_length]))
+        return result['crc'] == [67, (crc / 256), (crc % 256)]
 
     def output_has_crc(self):
         """ Check if the MasterCommandSpec output contains a crc field. """
-        for field in self.output_fields:
-            if Field.is_crc(field):
-                return True
-
-        return False
+        return self.__crc_tail_length is not None
 
     def __eq__(self, other):
         """ Only used for testing, equals by name. """
         return self.action == other.action and self.output_action == other.output_action
 
+class StructDecoder(object):
+    """ Decodes a list of fixed length fields in one struct.unpack call. """
+
+    def __init__(self, fields, codecs):
+        """ Create a StructDecoder, use StructDecoder.compile to create one from a list of fields.
+
+        :param fields: the fields to decode
+        :type fields: list of :class`Field`
+        :param codecs: the struct codec for each field, see FieldType.get_struct_codec
+        :type codecs: list of tuples (format, number of values, conversion function)
+        """
+        self.__struct = struct.Struct(">" + "".join([codec[0] for codec in codecs]))
+        self.size = self.__struct.size
+        self.__conversions = [(field.name, codec[1], codec[2])
+                              for (field, codec) in zip(fields, codecs)]
+
+    @staticmethod
+    def compile(fields):
+        """ Compile a list of fields into a StructDecoder.
+
+        :returns: :class`StructDecoder` or None if a field has a variable length.
+        """
+        codecs = []
+        for field in fields:
+            codec = field.get_struct_codec()
+            if codec is None:
+                return None
+            codecs.append(codec)
+        return StructDecoder(fields, codecs)
+
+    def decode(self, byte_str, offset=0):
+        """ Decode the fields from byte_str, starting at offset.
+
+        :returns: dict with the decoded value for each field name.
+        """
+        values = self.__struct.unpack_from(byte_str, offset)
+        decoded = {}
+        index = 0
+        for (name, num_values, convert) in self.__conversions:
+            decoded[name] = convert(values[index:index + num_values])
+            index += num_values
+        return decoded
+
+
 class Result(object):
     """ Result of a communication with the master. Can be accessed as a dict,
     contains the output fields specified in the spec."""
@@ -271,6 +358,14 @@ class Field(object):
         """
         return self.field_type.decode(byte_str)
 
+    def get_struct_codec(self):
+        """ Get the struct format, the number of values in the format and a function that
+        converts the unpacked values into the decoded value. Returns None if the field has a
+        variable length. """
+        if hasattr(self.field_type, 'get_struct_codec'):
+            return self.field_type.get_struct_codec()
+        return None
+
 class NeedMoreBytesException(Exception):
     """ Throw in case a decode requires more bytes then provided. """
     def __init__(self, bytes_required):
@@ -338,6 +433,13 @@ class FieldType(object):
             elif self.python_type == str:
                 return byte_str
 
+    def get_struct_codec(self):
+        """ Get the struct format, number of values and conversion function. """
+        if self.python_type == int:
+            return ('B' if self.length == 1 else 'H', 1, lambda values: values[0])
+        else:
+            return ('%ds' % self.length, 1, lambda values: values[0])
+
 class PaddingFieldType(object):
     """ Empty field. """
     def __init__(self, length):
@@ -359,6 +461,10 @@ class PaddingFieldType(object):
         else:
             return ""
 
+    def get_struct_codec(self):
+        """ Get the struct format, number of values and conversion function. """
+        return ('%dx' % self.length, 0, lambda values: "")
+
 class BytesFieldType(object):
     """ Type for an array of bytes. """
     def __init__(self, length):
@@ -376,6 +482,10 @@ class BytesFieldType(object):
         """ Generates an array of bytes. """
         return [ord(x) for x in byte_str]
 
+    def get_struct_codec(self):
+        """ Get the struct format, number of values and conversion function. """
+        return ('%dB' % self.length, self.length, list)
+
 class LiteralFieldType(object):
     """ Literal string field. """
     def __init__(self, literal):
@@ -397,6 +507,10 @@ class LiteralFieldType(object):
         else:
             return ""
 
+    def get_struct_codec(self):
+        """ Get the struct format, number of values and conversion function. """
+        return ('%ds' % len(self.literal), 1, lambda values: self.decode(values[0]))
+
 class SvtFieldType(object):
     """ The System Value Type is one byte. This types encodes and decodes into
     a float (degrees Celsius).
@@ -416,6 +530,10 @@ class SvtFieldType(object):
         """ Decode a svt byte string into a instance of the Svt class. """
         return master_api.Svt.from_byte(byte_str[0])
 
+    def get_struct_codec(self):
+        """ Get the struct format, number of values and conversion function. """
+        return ('B', 1, lambda values: master_api.Svt(master_api.Svt.RAW, values[0]))
+
 
 class VarStringFieldType(object):
     """ The VarString uses 1 byte for the length, the total length of the string is fixed.
@@ -444,6 +562,10 @@ class VarStringFieldType(object):
         length = ord(byte_str[0])
         return byte_str[1:1+length]
 
+    def get_struct_codec(self):
+        """ Get the struct format, number of values and conversion function. """
+        return ('B%ds' % self.total_data_length, 2, lambda values: values[1][:values[0]])
+
 
 class DimmerFieldType(object):
     """ The dimmer value is a byte in [0, 63], this is converted to an integer in [0, 100] to
@@ -462,12 +584,20 @@ class DimmerFieldType(object):
 
     def decode(self, byte_str):
         """ Decode a byte [0, 63] to an integer [0, 100]. """
-        dimmer_value = ord(byte_str[0])
+        return DimmerFieldType.to_percentage(ord(byte_str[0]))
+
+    @staticmethod
+    def to_percentage(dimmer_value):
+        """ Convert a dimmer value [0, 63] to an integer [0, 100]. """
         if dimmer_value <= 54:
             return int(dimmer_value * 10.0 / 6.0)
         else:
             return int(90 + dimmer_value - 53)
 
+    def get_struct_codec(self):
+        """ Get the struct format, number of values and conversion function. """
+        return ('B', 1, lambda values: DimmerFieldType.to_percentage(values[0]))
+
     def get_min_decode_bytes(self):
         """ The dimmer type is always 1 byte. """
         return 1
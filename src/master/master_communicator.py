@@ -24,11 +24,15 @@ LOGGER = logging.getLogger("openmotics")
 import os
 import sys
 import time
+from collections import deque
 from threading import Thread, Lock, Event
 from Queue import Queue, Empty
 
 import master_api
-from master_command import Field, printable
+from command_scheduler import CommandScheduler, PRIORITY_BACKGROUND
+from command_coalescer import CommandCoalescer
+from communication_statistics import CommunicationStatistics
+from master_command import printable
 from serial_utils import CommunicationTimedOutException
 
 
@@ -41,7 +45,7 @@ class MasterCommunicator(object):
 
     def __init__(self, serial, init_master=True, verbose=False,
                  watchdog_period=150, watchdog_callback=lambda: os._exit(1),
-                 passthrough_timeout=0.2):
+                 passthrough_timeout=0.2, max_pending_commands=1):
         """ Default constructor.
 
         :param serial: Serial port to communicate with
@@ -59,6 +63,10 @@ class MasterCommunicator(object):
         :param passthrough_timeout: The time to wait for an answer on a passthrough message \
         (in sec)
         :type passthrough_timeout: float.
+        :param max_pending_commands: The maximum number of commands that can wait for an answer \
+        from the master at the same time. 1 disables pipelining: every command waits for its \
+        answer before the next command is written.
+        :type max_pending_commands: integer.
         """
         self.__init_master = init_master
         self.__verbose = verbose
@@ -69,13 +77,23 @@ class MasterCommunicator(object):
         self.__serial_bytes_written = 0
         self.__serial_bytes_read = 0
         self.__timeouts = 0
+        self.__statistics = CommunicationStatistics()
 
         self.__cid = 1
 
+        self.__max_pending_commands = max(1, max_pending_commands)
+        self.__scheduler = CommandScheduler(self.__max_pending_commands)
+        self.__coalescer = CommandCoalescer()
+
         self.__maintenance_mode = False
         self.__maintenance_queue = Queue()
 
-        self.__consumers = []
+        self.__consumers_lock = Lock()
+        self.__consumers = {}  # Maps the 3 byte prefix on a list of consumers
+        self.__consumer_start_bytes = {}  # Maps the first byte of the prefixes on a count
+        # Immutable snapshot of the start bytes, replaced on a change: the read thread uses it
+        # without taking the lock
+        self.__start_bytes = frozenset()
 
         self.__passthrough_enabled = False
         self.__passthrough_mode = False
@@ -132,6 +150,35 @@ class MasterCommunicator(object):
         """ Get the number of bytes read from the Master. """
         return self.__serial_bytes_read
 
+    def get_max_pending_commands(self):
+        """ Get the maximum number of commands that can be in flight at the same time. """
+        return self.__max_pending_commands
+
+    def get_queue_statistics(self):
+        """ Get the queue depth and wait times per priority class, see
+        :func`CommandScheduler.get_statistics`. """
+        return self.__scheduler.get_statistics()
+
+    def get_idle_time(self, priority=PRIORITY_BACKGROUND):
+        """ Get the number of seconds that no command with a higher priority than the given
+        priority class was sent or waiting, see :func`CommandScheduler.get_idle_time`. """
+        return self.__scheduler.get_idle_time(priority)
+
+    def get_communication_statistics(self):
+        """ Get the counts, timeouts, crc failures and latencies per master action, the bus
+        utilization and the command lock wait times, see
+        :func`CommunicationStatistics.get_statistics`. """
+        return self.__statistics.get_statistics()
+
+    def get_average_latency(self, cmd):
+        """ Get the measured average latency (in sec) of a command, None if there are not enough
+        measurements yet.
+
+        :param cmd: the command.
+        :type cmd: :class`MasterCommandSpec`
+        """
+        return self.__statistics.get_average_latency(cmd.action)
+
     def get_seconds_since_last_success(self):
         """ Get the number of seconds since the last successful communication. """
         if self.__last_success == 0:
@@ -155,6 +202,7 @@ class MasterCommunicator(object):
                 LOGGER.info('Writing to Master serial:   {0}'.format(printable(data)))
             self.__serial.write(data)
             self.__serial_bytes_written += len(data)
+            self.__statistics.bytes_written(len(data))
 
     def register_consumer(self, consumer):
         """ Register a customer consumer with the communicator. An instance of :class`Consumer`
@@ -164,7 +212,32 @@ class MasterCommunicator(object):
         :param consumer: The consumer to register.
         :type consumer: Consumer or BackgroundConsumer.
         """
-        self.__consumers.append(consumer)
+        prefix = consumer.get_prefix()
+        with self.__consumers_lock:
+            self.__consumers.setdefault(prefix, []).append(consumer)
+            start_byte = prefix[0]
+            count = self.__consumer_start_bytes.get(start_byte, 0) + 1
+            self.__consumer_start_bytes[start_byte] = count
+            if count == 1:
+                self.__start_bytes = frozenset(self.__consumer_start_bytes)
+
+    def enable_coalescing(self, cmd, ttl=0, invalidated_by=None):
+        """ Let concurrent callers of an identical read-only command share one round trip to
+        the master, and optionally cache the result for a short time.
+
+        :param cmd: specification of the read-only command
+        :type cmd: :class`MasterCommand.MasterCommandSpec`
+        :param ttl: number of seconds the result is cached, 0 disables caching.
+        :type ttl: float
+        :param invalidated_by: the commands that change the result of the read-only command, \
+        these invalidate the cached result.
+        :type invalidated_by: list of :class`MasterCommand.MasterCommandSpec`
+        """
+        self.__coalescer.enable(cmd, ttl, invalidated_by)
+
+    def invalidate_command_cache(self):
+        """ Invalidate the cached results of the coalesced read-only commands. """
+        self.__coalescer.invalidate()
 
     def do_basic_action(self, action_type, action_number):
         """
@@ -184,13 +257,16 @@ class MasterCommunicator(object):
              'action_number': action_number}
         )
 
-    def do_command(self, cmd, fields=None, timeout=2):
+    def do_command(self, cmd, fields=None, timeout=2, priority=None):
         """ Send a command over the serial port and block until an answer is received.
         If the master does not respond within the timeout period, a CommunicationTimedOutException
         is raised
 
         :param cmd: specification of the command to execute
         :type cmd: :class`MasterCommand.MasterCommandSpec`
+        :param priority: priority class of the command (see command_scheduler), None to use the \
+        priority class of the calling thread.
+        :type priority: integer or None
         :raises: :class`CommunicationTimedOutException` if master did not respond in time
         :raises: :class`InMaintenanceModeException` if master is in maintenance mode
         :returns: dict containing the output fields of the command
@@ -201,40 +277,167 @@ class MasterCommunicator(object):
         if fields is None:
             fields = dict()
 
+        return self.__coalescer.execute(
+            cmd, fields, lambda: self.__do_command(cmd, fields, timeout, priority), priority)
+
+    def do_command_batch(self, cmd, fields_list, timeout=2, priority=None, callback=None):
+        """ Send a batch of commands of the same type. The commands are pipelined: up to
+        max_pending_commands commands of the batch are in flight at the same time. The batch
+        does not hold the bus: every command is scheduled separately, so commands with a higher
+        priority are sent in between. A command that fails does not stop the batch.
+
+        :param cmd: specification of the commands to execute
+        :type cmd: :class`MasterCommand.MasterCommandSpec`
+        :param fields_list: the input fields of every command
+        :type fields_list: list of dict
+        :param priority: priority class of the commands (see command_scheduler), None to use \
+        the priority class of the calling thread.
+        :type priority: integer or None
+        :param callback: function that is called with the index and the output fields of every \
+        command that was answered, in the order of fields_list.
+        :raises: :class`InMaintenanceModeException` if master is in maintenance mode
+        :returns: list with the output fields of every command, None for the commands that \
+        timed out or got an answer with a bad crc.
+        """
+        if self.__maintenance_mode:
+            raise InMaintenanceModeException()
+
+        outputs = [None] * len(fields_list)
+        in_flight = deque()
+
+        def collect():
+            """ Wait for the answer of the oldest command in flight. """
+            (index, consumer) = in_flight.popleft()
+            try:
+                outputs[index] = self.__wait_for_answer(consumer, timeout)
+            except (CommunicationTimedOutException, CrcCheckFailedException):
+                return
+            finally:
+                self.__scheduler.release()
+            if callback is not None:
+                callback(index, outputs[index])
+
+        try:
+            for index, fields in enumerate(fields_list):
+                if len(in_flight) >= self.__max_pending_commands:
+                    collect()
+                self.__scheduler.acquire(priority)
+                sent = False
+                try:
+                    lock_start = time.time()
+                    with self.__command_lock:
+                        self.__statistics.lock_waited(time.time() - lock_start)
+                        in_flight.append((index, self.__send_command(cmd, fields)))
+                        sent = True
+                        if self.__max_pending_commands == 1:
+                            collect()  # Without pipelining the answer is read under the lock
+                except Exception:
+                    if not sent:
+                        self.__scheduler.release()
+                    raise
+        finally:
+            while len(in_flight) > 0:
+                collect()
+            self.__coalescer.invalidate_dependents(cmd)
+
+        return outputs
+
+    def __do_command(self, cmd, fields, timeout, priority):
+        """ Send a command over the serial port and block until an answer is received, see
+        do_command. """
+        self.__scheduler.acquire(priority)
+        try:
+            lock_start = time.time()
+            if self.__max_pending_commands == 1:
+                with self.__command_lock:
+                    self.__statistics.lock_waited(time.time() - lock_start)
+                    consumer = self.__send_command(cmd, fields)
+                    return self.__wait_for_answer(consumer, timeout)
+            else:
+                # Pipelined mode: the command lock is only held while writing the command, the
+                # answers are matched to the waiting callers using the (output_action, cid) prefix.
+                with self.__command_lock:
+                    self.__statistics.lock_waited(time.time() - lock_start)
+                    consumer = self.__send_command(cmd, fields)
+                return self.__wait_for_answer(consumer, timeout)
+        finally:
+            self.__scheduler.release()
+
+    def __send_command(self, cmd, fields):
+        """ Register a consumer for the command and write the command to the serial port.
+
+        :param cmd: specification of the command to execute
+        :type cmd: :class`MasterCommand.MasterCommandSpec`
+        :param fields: dict containing the input fields of the command
+        :returns: the registered :class`Consumer`
+        """
         cid = self.__get_cid()
         consumer = Consumer(cmd, cid)
         inp = cmd.create_input(cid, fields)
 
-        with self.__command_lock:
-            self.__consumers.append(consumer)
-            self.__write_to_serial(inp)
-            try:
-                result = consumer.get(timeout).fields
-                if cmd.output_has_crc() and not self.__check_crc(cmd, result):
-                    raise CrcCheckFailedException()
-                else:
-                    self.__last_success = time.time()
-                    return result
-            except CommunicationTimedOutException:
-                self.__timeouts += 1
-                raise
-
-    def __check_crc(self, cmd, result):
-        """ Calculate the CRC of the data for a certain master command.
-
-        :param cmd: instance of MasterCommandSpec.
-        :param result: A dict containing the result of the master command.
-        :returns: boolean
+        self.register_consumer(consumer)
+        self.__write_to_serial(inp)
+        self.__statistics.command_sent()
+        return consumer
+
+    def __wait_for_answer(self, consumer, timeout):
+        """ Block until the consumer received the answer of the master.
+
+        :param consumer: the consumer registered for the command
+        :type consumer: :class`Consumer`
+        :param timeout: timeout in seconds
+        :raises: :class`CommunicationTimedOutException` if master did not respond in time
+        :raises: :class`CrcCheckFailedException` if the crc of the answer is not correct
+        :returns: dict containing the output fields of the command
         """
-        crc = 0
-        for field in cmd.output_fields:
-            if Field.is_crc(field):
-                break
+        action = consumer.cmd.action
+        start = time.time()
+        try:
+            result = consumer.get(timeout)
+        except CommunicationTimedOutException:
+            self.__timeouts += 1
+            self.__statistics.command_timed_out(action)
+            self.__remove_consumer(consumer)
+            raise
+
+        self.__statistics.command_done(action, time.time() - start)
+        if consumer.cmd.output_has_crc() and not consumer.cmd.check_crc(result):
+            self.__statistics.crc_failed(action)
+            raise CrcCheckFailedException()
+        else:
+            self.__last_success = time.time()
+            return result.fields
+
+    def __remove_consumer(self, consumer):
+        """ Remove a consumer, if it is still registered. """
+        prefix = consumer.get_prefix()
+        with self.__consumers_lock:
+            consumers = self.__consumers.get(prefix)
+            if consumers is None or consumer not in consumers:
+                return  # Already removed by the read thread
+
+            consumers.remove(consumer)
+            if len(consumers) == 0:
+                del self.__consumers[prefix]
+
+            start_byte = prefix[0]
+            count = self.__consumer_start_bytes[start_byte] - 1
+            if count == 0:
+                del self.__consumer_start_bytes[start_byte]
+                self.__start_bytes = frozenset(self.__consumer_start_bytes)
             else:
-                for byte in field.encode(result[field.name]):
-                    crc += ord(byte)
+                self.__consumer_start_bytes[start_byte] = count
 
-        return result['crc'] == [67, (crc / 256), (crc % 256)]
+    def __is_start_byte(self, byte):
+        """ Checks whether a registered prefix starts with the given byte. The snapshot is read
+        without the lock: it is never modified, only replaced. """
+        return byte in self.__start_bytes
+
+    def __find_consumer(self, prefix):
+        """ Get the first registered consumer for a 3 byte prefix, None if there is none. """
+        with self.__consumers_lock:
+            consumers = self.__consumers.get(prefix)
+            return consumers[0] if consumers else None
 
     def __passthrough_wait(self):
         """ Waits until the passthrough is done or a timeout is reached. """
@@ -287,6 +490,7 @@ class MasterCommunicator(object):
             raise InMaintenanceModeException()
 
         self.__maintenance_mode = True
+        self.__coalescer.invalidate()
 
         self.send_maintenance_data(master_api.to_cli_mode().create_input(0))
 
@@ -322,22 +526,12 @@ class MasterCommunicator(object):
         self.send_maintenance_data("exit\r\n")
 
         self.__maintenance_mode = False
+        self.__coalescer.invalidate()
 
     def in_maintenance_mode(self):
         """ Returns whether the MasterCommunicator is in maintenance mode. """
         return self.__maintenance_mode
 
-    def __get_start_bytes(self):
-        """ Create a dict that maps the start byte to a list of consumers. """
-        start_bytes = {}
-        for consumer in self.__consumers:
-            start_byte = consumer.get_prefix()[0]
-            if start_byte in start_bytes:
-                start_bytes[start_byte].append(consumer)
-            else:
-                start_bytes[start_byte] = [consumer]
-        return start_bytes
-
     def __watchdog(self):
         """ Run in the background watchdog thread: checks the number of timeouts per minute. If the
         number of timeouts is larger than 1, the watchdog callback is called. """
@@ -355,7 +549,7 @@ class MasterCommunicator(object):
         def consumer_done(consumer):
             """ Callback for when consumer is done. ReadState does not access parent directly. """
             if isinstance(consumer, Consumer):
-                self.__consumers.remove(consumer)
+                self.__remove_consumer(consumer)
             elif isinstance(consumer, BackgroundConsumer) and consumer.send_to_passthrough:
                 self.__push_passthrough_data(consumer.last_cmd_data)
 
@@ -379,15 +573,15 @@ class MasterCommunicator(object):
                 self.current_consumer = consumer
                 self.partial_result = None
 
-            def consume(self, data):
-                """ Consume the bytes in data using the current_consumer, and return the bytes
-                that were not used. """
+            def consume(self, buf):
+                """ Consume the bytes in the buffer using the current_consumer, the consumed
+                bytes are discarded from the buffer. """
                 try:
-                    (bytes_consumed, result, done) = \
-                        read_state.current_consumer.consume(data, read_state.partial_result)
+                    (bytes_consumed, result, done) = read_state.current_consumer.consume(
+                        buf.data, read_state.partial_result, buf.offset, len(buf))
                 except ValueError, value_error:
                     sys.stderr.write("Got ValueError: " + str(value_error))
-                    return ""
+                    buf.discard(len(buf))
                 else:
                     if done:
                         consumer_done(self.current_consumer)
@@ -396,48 +590,49 @@ class MasterCommunicator(object):
                         self.current_consumer = None
                         self.partial_result = None
 
-                        return data[bytes_consumed:]
+                        buf.discard(bytes_consumed)
                     else:
                         self.partial_result = result
-                        return ""
+                        buf.discard(len(buf))
 
         read_state = ReadState()
-        data = ""
+        buf = ReadBuffer()
 
         while not self.__stop:
-            data += self.__serial.read(1)
+            data = self.__serial.read(1)
             num_bytes = self.__serial.inWaiting()
             if num_bytes > 0:
                 data += self.__serial.read(num_bytes)
             if data != None and len(data) > 0:
                 self.__serial_bytes_read += (1 + num_bytes)
+                self.__statistics.bytes_read(1 + num_bytes)
 
                 if self.__verbose:
                     LOGGER.info('Reading from Master serial: {0}'.format(printable(data)))
 
+                buf.append(data)
+
                 if read_state.should_resume():
-                    data = read_state.consume(data)
+                    read_state.consume(buf)
 
                 # No else here: data might not be empty when current_consumer is done
                 if read_state.should_find_consumer():
-                    start_bytes = self.__get_start_bytes()
-                    leftovers = ""  # for unconsumed bytes; these will go to the passthrough.
+                    leftovers = []  # for unconsumed bytes; these will go to the passthrough.
+                    gap_start = 0
+                    index = 0
 
-                    while len(data) > 0:
-                        if data[0] in start_bytes:
+                    while index < len(buf):
+                        if self.__is_start_byte(buf.get_char(index)):
                             # Prefixes are 3 bytes, make sure we have enough data to match
-                            if len(data) >= 3:
-                                match = False
-                                for consumer in start_bytes[data[0]]:
-                                    if data[:3] == consumer.get_prefix():
-                                        # Found matching consumer
-                                        read_state.set_consumer(consumer)
-                                        data = read_state.consume(data[3:]) # Strip off prefix
-                                        # Consumers might have changed, update start_bytes
-                                        start_bytes = self.__get_start_bytes()
-                                        match = True
-                                        break
-                                if match:
+                            if len(buf) - index >= 3:
+                                consumer = self.__find_consumer(buf.get(index, index + 3))
+                                if consumer is not None:
+                                    if index > gap_start:
+                                        leftovers.append(buf.get(gap_start, index))
+                                    buf.discard(index + 3)  # Strip off gap and prefix
+                                    read_state.set_consumer(consumer)
+                                    read_state.consume(buf)
+                                    gap_start = index = 0
                                     continue
                             else:
                                 # All commands end with '\r\n', there are no prefixes that start
@@ -445,16 +640,65 @@ class MasterCommunicator(object):
                                 # waiting for the next serial.read()
                                 break
 
-                        leftovers += data[0]
-                        data = data[1:]
+                        index += 1
+
+                    if index > gap_start:
+                        leftovers.append(buf.get(gap_start, index))
+                    buf.discard(index)
 
                     if len(leftovers) > 0:
+                        leftovers = "".join(leftovers)
                         if not self.__maintenance_mode:
                             self.__push_passthrough_data(leftovers)
                         else:
                             self.__maintenance_queue.put(leftovers)
 
 
+class ReadBuffer(object):
+    """ Preallocated byte buffer used by the read thread. Bytes are appended at the end and
+    discarded at the front by moving an offset, the remaining bytes are only moved to the front
+    of the buffer when there is no room left at the end. """
+
+    def __init__(self, size=1024):
+        """ Create a buffer with an initial capacity of size bytes. """
+        self.data = bytearray(size)
+        self.offset = 0
+        self.__end = 0
+
+    def __len__(self):
+        """ Get the number of bytes in the buffer. """
+        return self.__end - self.offset
+
+    def append(self, data):
+        """ Append a string of bytes at the end of the buffer. """
+        length = len(self)
+        if self.__end + len(data) > len(self.data):
+            if length + len(data) > len(self.data):
+                new_data = bytearray(max(2 * len(self.data), length + len(data)))
+                new_data[0:length] = self.data[self.offset:self.__end]
+                self.data = new_data
+            else:
+                self.data[0:length] = self.data[self.offset:self.__end]
+            (self.offset, self.__end) = (0, length)
+
+        self.data[self.__end:self.__end + len(data)] = data
+        self.__end += len(data)
+
+    def discard(self, num_bytes):
+        """ Discard num_bytes bytes from the front of the buffer. """
+        self.offset += num_bytes
+        if self.offset >= self.__end:
+            (self.offset, self.__end) = (0, 0)
+
+    def get_char(self, index):
+        """ Get the byte at an index (relative to the front) as a character. """
+        return chr(self.data[self.offset + index])
+
+    def get(self, start, end):
+        """ Get the bytes between two indices (relative to the front) as a string. """
+        return str(self.data[self.offset + start:self.offset + end])
+
+
 class InMaintenanceModeException(Exception):
     """ An exception that is raised when the master is in maintenance mode. """
     def __init__(self):
@@ -478,9 +722,9 @@ class Consumer(object):
         """ Get the prefix of the answer from the master. """
         return self.cmd.output_action + str(chr(self.cid))
 
-    def consume(self, data, partial_result):
+    def consume(self, data, partial_result, offset=0, length=None):
         """ Consume data. """
-        return self.cmd.consume_output(data, partial_result)
+        return self.cmd.consume_output(data, partial_result, offset, length)
 
     def get(self, timeout):
         """ Wait until the master replies or the timeout expires.
@@ -522,9 +766,10 @@ class BackgroundConsumer(object):
         """ Get the prefix of the answer from the master. """
         return self.cmd.output_action + str(chr(self.cid))
 
-    def consume(self, data, partial_result):
+    def consume(self, data, partial_result, offset=0, length=None):
         """ Consume data. """
-        (bytes_consumed, last_result, done) = self.cmd.consume_output(data, partial_result)
+        (bytes_consumed, last_result, done) = \
+            self.cmd.consume_output(data, partial_result, offset, length)
         self.last_cmd_data = (self.get_prefix() + last_result.actual_bytes) if done else None
         return (bytes_consumed, last_result, done)
 
@@ -20,16 +20,42 @@ the master.
 """
 
 import time
+from threading import Lock
 
 class OutputStatus(object):
-    """ Contains a cached version of the current output of the controller. """
+    """ Contains a cached version of the current output of the controller. The outputs are indexed
+    on their id, the updates return the transitions of the outputs that changed: a list of dicts
+    with the 'id' of the output, the 'old' and 'new' status and dimmer and the 'timestamp' of the
+    transition. """
 
     def __init__(self, outputs, refresh_period=600):
         """ Create a status object using a list of outputs (can be None),
         and a refresh period: the refresh has to be invoked explicitly. """
-        self.__outputs = outputs
         self.__refresh_period = refresh_period
         self.__last_refresh = time.time()
+        self.__last_update = time.time()
+        self.__confirmed = {}  # The outputs confirmed by update_outputs since the last update
+        self.__lock = Lock()
+        self.__partial_updates = 0
+        self.__reconcile_index = 0
+        self.__set_outputs(outputs if outputs is not None else [])
+
+    def __set_outputs(self, outputs):
+        """ Replace the list of Outputs and rebuild the indexes, the lock should be held. """
+        self.__outputs = outputs
+        self.__positions = dict((output['id'], position) for position, output in enumerate(outputs))
+        self.__on = dict((output['id'], output['dimmer']) for output in outputs
+                         if output['status'] == 1)
+
+    @staticmethod
+    def __transition(output, status, dimmer, timestamp):
+        """ Get the transition of an Output to a status and dimmer, None if nothing changes. """
+        if output['status'] == status and output['dimmer'] == dimmer:
+            return None
+        return {'id': output['id'],
+                'old': {'status': output['status'], 'dimmer': output['dimmer']},
+                'new': {'status': status, 'dimmer': dimmer},
+                'timestamp': timestamp}
 
     def force_refresh(self):
         """ Force a refresh on the OuptutStatus. """
@@ -41,23 +67,134 @@ class OutputStatus(object):
 
     def partial_update(self, on_outputs):
         """ Update the status of the outputs using a list of tuples containing the
-        light id an the dimmer value of the lights that are on. """
-        on_dict = {}
-        for on_output in on_outputs:
-            on_dict[on_output[0]] = on_output[1]
-
-        for output in self.__outputs:
-            if output['id'] in on_dict:
-                output['status'] = 1
-                output['dimmer'] = on_dict[output['id']]
-            else:
-                output['status'] = 0
+        light id an the dimmer value of the lights that are on. Only the outputs that were on
+        and the outputs that are on are visited.
+
+        :returns: the list of transitions, sorted on the output id.
+        """
+        now = time.time()
+        with self.__lock:
+            self.__partial_updates += 1
+            self.__last_update = now
+            self.__confirmed = {}
+            on_dict = dict((output_id, dimmer) for (output_id, dimmer) in on_outputs
+                           if output_id in self.__positions)
+
+            transitions = []
+            for output_id in self.__on:
+                if output_id not in on_dict:
+                    output = self.__outputs[self.__positions[output_id]]
+                    transitions.append(OutputStatus.__transition(output, 0, output['dimmer'], now))
+            for output_id, dimmer in on_dict.iteritems():
+                output = self.__outputs[self.__positions[output_id]]
+                transitions.append(OutputStatus.__transition(output, 1, dimmer, now))
+
+            transitions = sorted([transition for transition in transitions if transition is not None],
+                                 key=lambda transition: transition['id'])
+            for transition in transitions:
+                output = self.__outputs[self.__positions[transition['id']]]
+                output['status'] = transition['new']['status']
+                output['dimmer'] = transition['new']['dimmer']
+            self.__on = on_dict
+            return transitions
+
+    def get_partial_updates(self):
+        """ Get the number of partial updates received so far. Pass this number to
+        update_outputs to avoid overwriting a newer status with an older read. """
+        return self.__partial_updates
 
     def full_update(self, outputs):
-        """ Update the status of the outputs using a list of Outputs. """
-        self.__outputs = outputs
-        self.__last_refresh = time.time()
+        """ Update the status of the outputs using a list of Outputs.
+
+        :returns: the list of transitions of the outputs that were known.
+        """
+        now = time.time()
+        with self.__lock:
+            transitions = []
+            for output in outputs:
+                position = self.__positions.get(output['id'])
+                if position is not None:
+                    transitions.append(OutputStatus.__transition(self.__outputs[position],
+                                                                 output['status'], output['dimmer'], now))
+            self.__set_outputs(outputs)
+            self.__last_refresh = time.time()
+            self.__last_update = now
+            self.__confirmed = {}
+            return [transition for transition in transitions if transition is not None]
+
+    def update_outputs(self, outputs, partial_updates=None):
+        """ Update some of the outputs using a list of Outputs.
+
+        :param outputs: The Outputs that were read from the master.
+        :param partial_updates: The result of get_partial_updates before the Outputs were read. \
+        If a partial update was received since then, the status and dimmer of the Outputs are \
+        not updated.
+        :returns: the list of transitions.
+        """
+        now = time.time()
+        with self.__lock:
+            keep_status = partial_updates is not None and partial_updates != self.__partial_updates
+            transitions = []
+            for output in outputs:
+                output_id = output['id']
+                position = self.__positions.get(output_id)
+                if position is None:
+                    continue
+                current = self.__outputs[position]
+                self.__confirmed[output_id] = now
+                if keep_status:
+                    output['status'] = current['status']
+                    output['dimmer'] = current['dimmer']
+                else:
+                    transitions.append(OutputStatus.__transition(current, output['status'],
+                                                                 output['dimmer'], now))
+                self.__outputs[position] = output
+                if output['status'] == 1:
+                    self.__on[output_id] = output['dimmer']
+                else:
+                    self.__on.pop(output_id, None)
+            return [transition for transition in transitions if transition is not None]
+
+    def get_reconcile_ids(self, batch_size):
+        """ Get the ids of the next batch of outputs that should be reconciled with the master.
+        Each call returns the next batch, after the last output the first batch is returned.
+
+        :param batch_size: The maximum number of ids to return.
+        :returns: list of output ids.
+        """
+        with self.__lock:
+            if self.__reconcile_index >= len(self.__outputs):
+                self.__reconcile_index = 0
+            ids = [output['id'] for output in
+                   self.__outputs[self.__reconcile_index:self.__reconcile_index + batch_size]]
+            self.__reconcile_index += batch_size
+            return ids
+
+    def get_age(self):
+        """ Get the number of seconds since the status of the least recently confirmed output was
+        confirmed by the master: by an OL message, a full update or an update of the output. """
+        with self.__lock:
+            return self.__get_age()
+
+    def __get_age(self):
+        """ Get the age of the status, the lock should be held. """
+        if len(self.__outputs) == 0 or len(self.__confirmed) < len(self.__outputs):
+            oldest = self.__last_update
+        else:
+            oldest = min(self.__confirmed.values())
+        return time.time() - oldest
+
+    def get_output(self, output_id):
+        """ Return the Output with the given id, None if the output is not known. """
+        with self.__lock:
+            position = self.__positions.get(output_id)
+            return self.__outputs[position] if position is not None else None
 
     def get_outputs(self):
         """ Return the list of Outputs. """
         return self.__outputs
+
+    def get_outputs_with_age(self):
+        """ Return a copy of the list of Outputs and the age of that list (see get_age). """
+        with self.__lock:
+            return [dict(output) for output in self.__outputs], self.__get_age()
@@ -17,6 +17,7 @@
 """
 
 import time
+from threading import Condition
 
 class ThermostatStatus(object):
     """ Contains a cached version of the current thermostat status. """
@@ -46,3 +47,74 @@ class ThermostatStatus(object):
     def get_thermostats(self):
         """ Return the list of thermostats. """
         return self.__thermostats
+
+
+class ThermostatStateStore(object):
+    """ Keeps the last read status of the thermostats in memory. The status is read by calling
+    refresh(), concurrent refreshes share one read: a caller that arrives while a refresh is
+    running waits for the next refresh, which is shared by all callers that are waiting. """
+
+    def __init__(self, read_status):
+        """ Create a store using a function that reads the status of the thermostats (a dict
+        with 'thermostats_on', 'automatic', 'setpoint', 'cooling' and 'status', a list of dicts
+        with the status per thermostat). """
+        self.__read_status = read_status
+        self.__status = None
+        self.__last_update = 0
+        self.__condition = Condition()
+        self.__refreshing = False
+        self.__started = 0
+        self.__finished = 0
+
+    def refresh(self):
+        """ Read the status of the thermostats. Returns when a refresh that started after the call
+        finished. """
+        with self.__condition:
+            target = self.__started + 1
+            while True:
+                if self.__finished >= target:
+                    return
+                if not self.__refreshing:
+                    self.__refreshing = True
+                    self.__started += 1
+                    refresh = self.__started
+                    break
+                self.__condition.wait()
+
+        status = None
+        try:
+            status = self.__read_status()
+        finally:
+            with self.__condition:
+                if status is not None:
+                    self.__status = status
+                    self.__last_update = time.time()
+                    self.__finished = refresh
+                self.__refreshing = False  # After a failure, one of the waiting callers refreshes
+                self.__condition.notify_all()
+
+    def update_thermostat(self, thermostat_id, values):
+        """ Update the status of one thermostat (eg. after writing a setpoint), the update is
+        overwritten by the next refresh.
+
+        :param thermostat_id: The id of the thermostat.
+        :param values: dict with the keys of the thermostat status to update.
+        """
+        with self.__condition:
+            if self.__status is not None:
+                for thermostat in self.__status['status']:
+                    if thermostat['id'] == thermostat_id:
+                        thermostat.update(values)
+
+    def get_status(self):
+        """ Get a copy of the last read status of the thermostats, None if it was not read yet. """
+        with self.__condition:
+            if self.__status is None:
+                return None
+            status = dict(self.__status)
+            status['status'] = [dict(thermostat) for thermostat in self.__status['status']]
+            return status
+
+    def get_last_update(self):
+        """ Get the timestamp of the last refresh, 0 if the status was not read yet. """
+        return self.__last_update
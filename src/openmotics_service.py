@@ -36,6 +36,7 @@ from serial_utils import RS485
 
 from gateway.webservice import WebInterface, WebService
 from gateway.gateway_api import GatewayApi
+from gateway.event_bus import TOPIC_OUTPUT_CHANGES, TOPIC_INPUTS, POLICY_MERGE
 from gateway.users import UserController
 from gateway.metrics import MetricsController
 from gateway.metrics_collector import MetricsCollector
@@ -46,9 +47,8 @@ from gateway.scheduling import SchedulingController
 from bus.led_service import LedService
 
 from master.maintenance import MaintenanceService
-from master.master_communicator import MasterCommunicator, BackgroundConsumer
+from master.master_communicator import MasterCommunicator
 from master.passthrough import PassthroughService
-from master import master_api
 
 from power.power_communicator import PowerCommunicator
 from power.power_controller import PowerController
@@ -97,6 +97,21 @@ def main():
     passthrough_serial_port = config.get('OpenMotics', 'passthrough_serial')
     power_serial_port = config.get('OpenMotics', 'power_serial')
     gateway_uuid = config.get('OpenMotics', 'uuid')
+    max_pending_commands = 1
+    if config.has_option('OpenMotics', 'master_max_pending_commands'):
+        max_pending_commands = config.getint('OpenMotics', 'master_max_pending_commands')
+    output_refresh_period = 3600
+    if config.has_option('OpenMotics', 'output_refresh_period'):
+        output_refresh_period = config.getint('OpenMotics', 'output_refresh_period')
+    thermostat_refresh_period = 10
+    if config.has_option('OpenMotics', 'thermostat_refresh_period'):
+        thermostat_refresh_period = config.getint('OpenMotics', 'thermostat_refresh_period')
+    stale_status_age = 300
+    if config.has_option('OpenMotics', 'stale_status_age'):
+        stale_status_age = config.getint('OpenMotics', 'stale_status_age')
+    max_status_age = 600
+    if config.has_option('OpenMotics', 'max_status_age'):
+        max_status_age = config.getint('OpenMotics', 'max_status_age')
 
     config_lock = threading.Lock()
     user_controller = UserController(constants.get_config_database_file(), config_lock, defaults, 3600)
@@ -107,7 +122,8 @@ def main():
     controller_serial = Serial(controller_serial_port, 115200)
     power_serial = RS485(Serial(power_serial_port, 115200, timeout=None))
 
-    master_communicator = MasterCommunicator(controller_serial)
+    master_communicator = MasterCommunicator(controller_serial,
+                                             max_pending_commands=max_pending_commands)
 
     if passthrough_serial_port:
         passthrough_serial = Serial(passthrough_serial_port, 115200)
@@ -119,7 +135,11 @@ def main():
     power_controller = PowerController(constants.get_power_database_file())
     power_communicator = PowerCommunicator(power_serial, power_controller)
 
-    gateway_api = GatewayApi(master_communicator, power_communicator, power_controller)
+    gateway_api = GatewayApi(master_communicator, power_communicator, power_controller,
+                             output_refresh_period=output_refresh_period,
+                             thermostat_refresh_period=thermostat_refresh_period,
+                             stale_status_age=stale_status_age,
+                             max_status_age=max_status_age)
 
     scheduling_controller = SchedulingController(constants.get_scheduling_database_file(), config_lock, gateway_api)
 
@@ -151,20 +171,10 @@ def main():
 
     web_service = WebService(web_interface, config_controller)
 
-    def _on_output(*args, **kwargs):
-        metrics_collector.on_output(*args, **kwargs)
-        gateway_api.on_outputs(*args, **kwargs)
-
-    def _on_input(*args, **kwargs):
-        metrics_collector.on_input(*args, **kwargs)
-        gateway_api.on_inputs(*args, **kwargs)
-
-    master_communicator.register_consumer(
-        BackgroundConsumer(master_api.output_list(), 0, _on_output, True)
-    )
-    master_communicator.register_consumer(
-        BackgroundConsumer(master_api.input_list(), 0, _on_input)
-    )
+    event_bus = gateway_api.get_event_bus()
+    event_bus.subscribe(TOPIC_OUTPUT_CHANGES, metrics_collector.on_output, policy=POLICY_MERGE,
+                        merge=lambda pending, transitions: pending + transitions)
+    event_bus.subscribe(TOPIC_INPUTS, metrics_collector.on_input)
 
     power_communicator.start()
     plugin_controller.start_plugins()
@@ -27,6 +27,7 @@ import traceback
 from collections import deque
 from datetime import datetime
 from plugins.decorators import *  # Import for backwards compatibility
+from master.command_scheduler import command_priority, PRIORITY_PLUGIN
 from gateway.webservice import params_parser
 
 try:
@@ -81,7 +82,9 @@ class WebInterfaceWrapper(object):
                 kwargs[spec.args[i + 1]] = args[i]
             if func.check is not None:
                 params_parser(kwargs, func.check)
-            return func(**kwargs)
+            # 3. Master commands of plugins are queued behind the interactive commands
+            with command_priority(PRIORITY_PLUGIN):
+                return func(**kwargs)
         return wrapper
 
 
@@ -149,6 +149,7 @@ class Gateway(object):
     def __init__(self, host="127.0.0.1"):
         self.__host = host
         self.__last_pulse_counters = None
+        self.__state = None
 
     def do_call(self, uri):
         """ Do a call to the webservice, returns a dict parsed from the json returned by the
@@ -160,17 +161,41 @@ class Gateway(object):
             LOGGER.log('Exception during Gateway call: {0}'.format(ex))
             return None
 
+    def __sync_state(self):
+        """ Update the local copy of the state of the gateway, only the entities that changed
+        since the last sync are downloaded.
+
+        :returns: a dict with the entity type as key and a dict (id -> entity) as value. None on \
+        error.
+        """
+        uri = "get_state?token=None"
+        if self.__state is not None:
+            uri += "&since={0}&epoch={1}".format(self.__state['version'], self.__state['epoch'])
+        data = self.do_call(uri)
+        if data is None or data['success'] is False:
+            return None
+        else:
+            if self.__state is None or data['full'] is True:
+                self.__state = {'entities': {}}
+            for entity_type, entities in data['state'].iteritems():
+                type_entities = self.__state['entities'].setdefault(entity_type, {})
+                for entity in entities:
+                    type_entities[entity['id']] = entity
+            self.__state['epoch'] = data['epoch']
+            self.__state['version'] = data['version']
+            return self.__state['entities']
+
     def get_enabled_outputs(self):
         """ Get the enabled outputs.
 
         :returns: a list of tuples containing the output number and dimmer value. None on error.
         """
-        data = self.do_call("get_output_status?token=None")
-        if data is None or data['success'] is False:
+        entities = self.__sync_state()
+        if entities is None:
             return None
         else:
             ret = []
-            for output in data['status']:
+            for output in sorted(entities.get('output', {}).values(), key=lambda o: o["id"]):
                 if output["status"] == 1:
                     ret.append((output["id"], output["dimmer"]))
             return ret
@@ -182,15 +207,16 @@ class Gateway(object):
         with the following fields: 'id', 'act', 'csetp', 'output0', 'output1' and 'mode'.
         None on error.
         """
-        data = self.do_call("get_thermostat_status?token=None")
-        if data is None or data['success'] is False:
+        entities = self.__sync_state()
+        if entities is None or 0 not in entities.get('thermostat_group', {}):
             return None
         else:
-            ret = {'thermostats_on': data['thermostats_on'],
-                   'automatic': data['automatic'],
-                   'cooling': data['cooling']}
+            group = entities['thermostat_group'][0]
+            ret = {'thermostats_on': group['thermostats_on'],
+                   'automatic': group['automatic'],
+                   'cooling': group['cooling']}
             thermostats = []
-            for thermostat in data['status']:
+            for thermostat in sorted(entities.get('thermostat', {}).values(), key=lambda t: t["id"]):
                 to_add = {}
                 for field in ['id', 'act', 'csetp', 'mode', 'output0', 'output1', 'outside', 'airco']:
                     to_add[field] = thermostat[field]
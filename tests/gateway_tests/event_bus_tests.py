@@ -0,0 +1,154 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the event_bus module.
+"""
+
+import unittest
+import threading
+import time
+
+from gateway.event_bus import EventBus, TOPIC_OUTPUTS, TOPIC_INPUTS, POLICY_DROP_OLDEST, \
+    POLICY_DROP_NEWEST, POLICY_MERGE
+
+
+class EventBusTest(unittest.TestCase):
+    """ Tests for EventBus. """
+
+    def setUp(self):
+        self.bus = EventBus(workers=2)
+        self.bus.start()
+
+    def tearDown(self):
+        self.bus.stop()
+
+    @staticmethod
+    def _wait(condition, timeout=2):
+        """ Wait until a condition is met. """
+        end = time.time() + timeout
+        while not condition() and time.time() < end:
+            time.sleep(0.01)
+
+    def test_publish(self):
+        """ Test if the messages are delivered in order to the subscribers of the topic. """
+        outputs = []
+        inputs = []
+        self.bus.subscribe(TOPIC_OUTPUTS, outputs.append)
+        self.bus.subscribe(TOPIC_INPUTS, inputs.append)
+
+        for i in range(10):
+            self.bus.publish(TOPIC_OUTPUTS, i)
+        self.bus.publish(TOPIC_INPUTS, 'input')
+
+        self._wait(lambda: len(outputs) == 10 and len(inputs) == 1)
+        self.assertEquals(range(10), outputs)
+        self.assertEquals(['input'], inputs)
+
+        self.assertRaises(ValueError, lambda: self.bus.publish('unknown', 1))
+        self.assertRaises(ValueError, lambda: self.bus.subscribe('unknown', outputs.append))
+        self.assertRaises(ValueError, lambda: self.bus.subscribe(TOPIC_OUTPUTS, outputs.append,
+                                                                 policy='unknown'))
+
+    def test_slow_subscriber(self):
+        """ Test if a slow subscriber does not delay the publisher or the other subscribers. """
+        blocked = threading.Event()
+        fast = []
+        slow = []
+
+        def slow_callback(data):
+            """ Blocks until the test releases it. """
+            blocked.wait()
+            slow.append(data)
+
+        self.bus.subscribe(TOPIC_OUTPUTS, slow_callback, max_queue=3, policy=POLICY_DROP_OLDEST,
+                           name='slow')
+        self.bus.subscribe(TOPIC_OUTPUTS, fast.append, name='fast')
+
+        self.bus.publish(TOPIC_OUTPUTS, 0)
+        self._wait(lambda: self.bus.get_statistics()['slow']['queue_depth'] == 0)
+        start = time.time()
+        for i in range(1, 10):
+            self.bus.publish(TOPIC_OUTPUTS, i)
+        self.assertTrue(time.time() - start < 0.5)
+
+        self._wait(lambda: len(fast) == 10)
+        self.assertEquals(range(10), fast)
+
+        blocked.set()
+        self._wait(lambda: len(slow) == 4)
+        self.assertEquals([0, 7, 8, 9], slow)
+
+        statistics = self.bus.get_statistics()
+        self.assertEquals(6, statistics['slow']['dropped'])
+        self.assertEquals(4, statistics['slow']['delivered'])
+        self.assertEquals(0, statistics['fast']['dropped'])
+        self.assertEquals(10, statistics['fast']['delivered'])
+
+    def test_policies(self):
+        """ Test the drop newest and merge policies. """
+        blocked = threading.Event()
+        newest = []
+        merged = []
+
+        def blocking(target):
+            """ Create a callback that blocks until the test releases it. """
+            def callback(data):
+                """ Append the data once released. """
+                blocked.wait()
+                target.append(data)
+            return callback
+
+        self.bus.subscribe(TOPIC_OUTPUTS, blocking(newest), max_queue=2, policy=POLICY_DROP_NEWEST,
+                           name='newest')
+        self.bus.subscribe(TOPIC_OUTPUTS, blocking(merged), max_queue=1, policy=POLICY_MERGE,
+                           merge=lambda pending, data: pending + data, name='merged')
+
+        self.bus.publish(TOPIC_OUTPUTS, [0])
+        self._wait(lambda: all(statistics['queue_depth'] == 0
+                               for statistics in self.bus.get_statistics().values()))
+        for i in range(1, 5):
+            self.bus.publish(TOPIC_OUTPUTS, [i])
+
+        blocked.set()
+        self._wait(lambda: len(newest) == 3 and len(merged) == 2)
+        self.assertEquals([[0], [1], [2]], newest)
+        self.assertEquals([[0], [1, 2, 3, 4]], merged)
+        self.assertEquals(3, self.bus.get_statistics()['merged']['merged'])
+
+    def test_subscriber_error(self):
+        """ Test if an error in a subscriber does not stop the delivery. """
+        received = []
+
+        def callback(data):
+            """ Fails on odd numbers. """
+            if data % 2 == 1:
+                raise RuntimeError('Odd number')
+            received.append(data)
+
+        subscription = self.bus.subscribe(TOPIC_INPUTS, callback)
+        for i in range(6):
+            self.bus.publish(TOPIC_INPUTS, i)
+
+        self._wait(lambda: len(received) == 3)
+        self.assertEquals([0, 2, 4], received)
+
+        self.bus.unsubscribe(subscription)
+        self.bus.publish(TOPIC_INPUTS, 6)
+        time.sleep(0.1)
+        self.assertEquals([0, 2, 4], received)
+
+
+if __name__ == "__main__":
+    unittest.main()
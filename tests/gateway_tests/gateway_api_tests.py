@@ -0,0 +1,323 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the gateway_api module.
+"""
+
+import unittest
+import threading
+import time
+
+import master.master_api as master_api
+from master.eeprom_image import NUM_BANKS, BANK_SIZE
+from master.outputs import OutputStatus
+from serial_utils import CommunicationTimedOutException
+from gateway.gateway_api import GatewayApi, check_outputs
+
+
+class MasterCommunicator(object):
+    """ Dummy master communicator that records the commands. """
+
+    def __init__(self, answer=None):
+        """ :param answer: Function that gets the answer on a command and its fields. """
+        self.commands = []
+        self.batches = 0
+        self.answer = answer
+
+    def do_command(self, cmd, fields=None):
+        """ Record a command. """
+        self.commands.append((cmd, fields))
+        if self.answer is not None:
+            return self.answer(cmd, fields)
+
+    def do_command_batch(self, cmd, fields_list):
+        """ Record a batch of commands. """
+        self.batches += 1
+        self.commands.extend((cmd, fields) for fields in fields_list)
+        return [self.answer(cmd, fields) if self.answer is not None else None
+                for fields in fields_list]
+
+
+class EepromTransaction(object):
+    """ Dummy eeprom transaction that records the written EepromModels. """
+
+    def __init__(self):
+        self.written = []
+        self.committed = False
+
+    def write_batch(self, eeprom_models):
+        """ Record the EepromModels. """
+        self.written.extend(eeprom_models)
+
+    def commit(self):
+        """ Record the commit. """
+        self.committed = True
+
+
+class EepromController(object):
+    """ Dummy eeprom controller that creates one EepromTransaction. """
+
+    def __init__(self):
+        self.eeprom_transaction = EepromTransaction()
+
+    def transaction(self):
+        """ Get the EepromTransaction. """
+        return self.eeprom_transaction
+
+
+class OutputConfig(object):
+    """ Dummy output configuration with the module type. """
+
+    def __init__(self, output_id, module_type):
+        self.id = output_id
+        self.module_type = module_type
+
+
+class OutputEepromController(object):
+    """ Dummy eeprom controller that serves the module types of the output configurations. """
+
+    def __init__(self, module_types):
+        """ :param module_types: dict mapping the output id on its module type. """
+        self.module_types = module_types
+
+    def read_batch(self, eeprom_model, ids, fields=None):
+        """ Get the output configurations with the module type. """
+        return [OutputConfig(output_id, self.module_types[output_id]) for output_id in ids]
+
+
+class BackupEepromController(object):
+    """ Dummy eeprom controller that serves banks until a bank fails. """
+
+    def __init__(self, failing_bank):
+        self.failing_bank = failing_bank
+
+    def iter_banks(self, banks):
+        """ Yield the banks, raise a timeout on the failing bank. """
+        for bank in banks:
+            if bank == self.failing_bank:
+                raise CommunicationTimedOutException()
+            yield bank, chr(bank) * BANK_SIZE
+
+
+class GatewayApiTest(unittest.TestCase):
+    """ Tests for GatewayApi. """
+
+    def test_check_outputs(self):
+        """ Test if the outputs should be a list of dicts with an integer id. """
+        check_outputs([])
+        check_outputs([{'id': 1, 'is_on': True}, {'id': 2L, 'is_on': False}])
+
+        self.assertRaises(ValueError, lambda: check_outputs({'id': 1}))
+        self.assertRaises(ValueError, lambda: check_outputs([1]))
+        self.assertRaises(ValueError, lambda: check_outputs([{'id': 1}, [2]]))
+        self.assertRaises(ValueError, lambda: check_outputs([{'id': '1'}]))
+        self.assertRaises(ValueError, lambda: check_outputs([{'id': True}]))
+        self.assertRaises(ValueError, lambda: check_outputs([{'is_on': True}]))
+
+    def test_set_outputs_invalid(self):
+        """ Test if set_outputs rejects invalid outputs before any action is sent. """
+        communicator = MasterCommunicator()
+        gateway_api = GatewayApi.__new__(GatewayApi)  # Skip the initialization of the master
+        gateway_api._GatewayApi__master_communicator = communicator
+
+        for outputs in [[{'id': 1, 'is_on': True}, 'output'],
+                        [{'id': 1, 'is_on': True}, {'id': '2', 'is_on': True}]]:
+            self.assertRaises(ValueError, lambda: gateway_api.set_outputs(outputs))
+        self.assertEquals([], communicator.commands)
+
+    def test_set_configurations_timer(self):
+        """ Test if set_configurations writes the timers of the outputs after the eeprom. """
+        communicator = MasterCommunicator()
+        controller = EepromController()
+        gateway_api = GatewayApi.__new__(GatewayApi)
+        gateway_api._GatewayApi__master_communicator = communicator
+        gateway_api._GatewayApi__eeprom_controller = controller
+
+        gateway_api.set_configurations({'output': [{'id': 3, 'name': 'light', 'timer': 100},
+                                                   {'id': 4, 'name': 'fan'}]})
+
+        self.assertTrue(controller.eeprom_transaction.committed)
+        self.assertEquals([3, 4], [config.id for config in controller.eeprom_transaction.written])
+        self.assertEquals([(master_api.write_timer(), {'id': 3, 'timer': 100})],
+                          communicator.commands)
+
+        self.assertRaises(ValueError, lambda: gateway_api.set_configurations({'unknown': []}))
+
+    @staticmethod
+    def _create_output_api(communicator, stale_status_age=300, max_status_age=600):
+        """ Create a GatewayApi that only serves the output status. """
+        gateway_api = GatewayApi.__new__(GatewayApi)
+        gateway_api._GatewayApi__master_communicator = communicator
+        gateway_api._GatewayApi__output_status = None
+        gateway_api._GatewayApi__output_status_seeded = threading.Event()
+        gateway_api._GatewayApi__output_refresh_period = 3600
+        gateway_api._GatewayApi__output_refresh_lock = threading.Lock()
+        gateway_api._GatewayApi__output_refresh = threading.Event()
+        gateway_api._GatewayApi__stale_status_age = stale_status_age
+        gateway_api._GatewayApi__max_status_age = max_status_age
+        return gateway_api
+
+    def test_get_output_status_seed(self):
+        """ Test if the callers that arrive before the outputs were read share one read. """
+        def answer(cmd, fields):
+            """ Answer with 1 output module and slow output reads. """
+            if cmd == master_api.number_of_io_modules():
+                return {'out': 1}
+            time.sleep(0.01)
+            return {'id': fields['id'], 'status': 0, 'dimmer': 0, 'ctimer': 0}
+
+        communicator = MasterCommunicator(answer)
+        gateway_api = GatewayApiTest._create_output_api(communicator)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(gateway_api.get_output_status()))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(9, len(communicator.commands))
+        self.assertEquals(4, len(results))
+        self.assertEquals(range(8), [output['id'] for output in results[0]])
+
+    def test_get_output_status_stale(self):
+        """ Test if a stale output status is returned right away and refreshed in the background,
+        and if a status that is too old is refreshed before it is returned. """
+        def answer(cmd, fields):
+            """ Answer with 1 output module. """
+            if cmd == master_api.number_of_io_modules():
+                return {'out': 1}
+            return {'id': fields['id'], 'status': 0, 'dimmer': 0, 'ctimer': 0}
+
+        communicator = MasterCommunicator(answer)
+        gateway_api = GatewayApiTest._create_output_api(communicator, stale_status_age=0.05,
+                                                        max_status_age=0.2)
+        gateway_api.get_output_status()
+        refresh = gateway_api._GatewayApi__output_refresh
+        self.assertEquals(9, len(communicator.commands))
+        self.assertFalse(refresh.is_set())
+
+        time.sleep(0.1)
+        outputs, age = gateway_api.get_output_status_with_age()
+        self.assertEquals(8, len(outputs))
+        self.assertTrue(0.1 <= age < 0.2)
+        self.assertEquals(9, len(communicator.commands))
+        self.assertTrue(refresh.is_set())
+
+        refresh.clear()
+        time.sleep(0.15)
+        outputs, age = gateway_api.get_output_status_with_age()
+        self.assertTrue(age < 0.05)
+        self.assertEquals(18, len(communicator.commands))
+        self.assertFalse(refresh.is_set())
+
+    def test_get_master_backup(self):
+        """ Test if the backup streams all banks, and if a failure is raised before the
+        streaming starts or by the stream itself. """
+        gateway_api = GatewayApi.__new__(GatewayApi)
+        gateway_api._GatewayApi__eeprom_controller = BackupEepromController(None)
+        backup = ''.join(gateway_api.get_master_backup())
+        self.assertEquals(NUM_BANKS * BANK_SIZE, len(backup))
+        self.assertEquals(chr(5) * BANK_SIZE, backup[5 * BANK_SIZE:6 * BANK_SIZE])
+
+        gateway_api._GatewayApi__eeprom_controller = BackupEepromController(0)
+        self.assertRaises(CommunicationTimedOutException, gateway_api.get_master_backup)
+
+        gateway_api._GatewayApi__eeprom_controller = BackupEepromController(3)
+        backup = gateway_api.get_master_backup()
+        self.assertEquals([chr(0) * BANK_SIZE, chr(1) * BANK_SIZE, chr(2) * BANK_SIZE],
+                          [next(backup) for _ in range(3)])
+        self.assertRaises(CommunicationTimedOutException, lambda: next(backup))
+
+    def test_set_outputs(self):
+        """ Test if set_outputs sends the actions that change the cached outputs in one batch,
+        and if the failures are reported per output. """
+        def output(output_id, status, dimmer):
+            """ Create an Output. """
+            return {'id': output_id, 'status': status, 'dimmer': dimmer, 'ctimer': 0}
+
+        def answer(cmd, fields):
+            """ Output 6 times out, output 7 fails. """
+            if fields['action_number'] == 6:
+                return None
+            return {'resp': 'NOK' if fields['action_number'] == 7 else 'OK'}
+
+        communicator = MasterCommunicator(answer)
+        gateway_api = GatewayApiTest._create_output_api(communicator)
+        gateway_api._GatewayApi__output_status = OutputStatus(
+            [output(0, 0, 0), output(1, 1, 55), output(2, 0, 0), output(3, 1, 0),
+             output(4, 0, 0), output(5, 1, 0), output(6, 0, 0), output(7, 1, 0)])
+        gateway_api._GatewayApi__output_status_seeded.set()
+        gateway_api._GatewayApi__eeprom_controller = OutputEepromController(
+            {0: 'O', 1: 'D', 2: 'D', 3: 'O', 4: 'O', 5: 'O', 6: 'O', 7: 'O'})
+
+        result = gateway_api.set_outputs([
+            {'id': 0, 'is_on': True},
+            {'id': 1, 'is_on': True, 'dimmer': 57},  # The same dimmer action as the cached 55
+            {'id': 2, 'is_on': True, 'dimmer': 30, 'timer': 150},
+            {'id': 3, 'is_on': False},
+            {'id': 4, 'is_on': True, 'dimmer': 50},
+            {'id': 5, 'is_on': True, 'timer': '150'},
+            {'id': 6, 'is_on': True},
+            {'id': 7, 'is_on': False},
+            {'id': 9, 'is_on': True}])
+
+        self.assertEquals(1, communicator.batches)
+        self.assertEquals([(0, master_api.BA_LIGHT_ON),
+                           (2, master_api.BA_LIGHT_ON_DIMMER_30),
+                           (2, master_api.BA_LIGHT_ON),
+                           (2, master_api.BA_LIGHT_ON_TIMER_150_OVERRULE),
+                           (3, master_api.BA_LIGHT_OFF),
+                           (6, master_api.BA_LIGHT_ON),
+                           (7, master_api.BA_LIGHT_OFF)],
+                          [(fields['action_number'], fields['action_type'])
+                           for (_, fields) in communicator.commands])
+
+        results = result['outputs']
+        self.assertEquals(range(8) + [9], [output_result['id'] for output_result in results])
+        self.assertEquals(['OK', 'UNCHANGED', 'OK', 'OK', 'ERROR', 'ERROR', 'ERROR', 'ERROR', 'ERROR'],
+                          [output_result['status'] for output_result in results])
+        self.assertEquals('Output 4 is not a dimmer', results[4]['error'])
+        self.assertTrue('Timer value' in results[5]['error'])
+        self.assertEquals('Communication timed out', results[6]['error'])
+        self.assertEquals('Basic action failed', results[7]['error'])
+        self.assertEquals('Unknown output: 9', results[8]['error'])
+
+        # Nothing is sent if no output changes
+        result = gateway_api.set_outputs([{'id': 1, 'is_on': True, 'dimmer': 50},
+                                          {'id': 5, 'is_on': True}])
+        self.assertEquals(['UNCHANGED', 'UNCHANGED'],
+                          [output_result['status'] for output_result in result['outputs']])
+        self.assertEquals(1, communicator.batches)
+
+    def test_set_outputs_values(self):
+        """ Test if invalid dimmers and timers are reported as errors of the output. """
+        communicator = MasterCommunicator()
+        gateway_api = GatewayApiTest._create_output_api(communicator)
+        gateway_api._GatewayApi__output_status = OutputStatus(
+            [{'id': 0, 'status': 0, 'dimmer': 0, 'ctimer': 0}])
+        gateway_api._GatewayApi__output_status_seeded.set()
+        gateway_api._GatewayApi__eeprom_controller = OutputEepromController({0: 'D'})
+
+        outputs = [{'id': 0, 'is_on': True, 'timer': timer} for timer in ['150', 150.0, True, 100]] + \
+            [{'id': 0, 'is_on': True, 'dimmer': dimmer} for dimmer in ['50', True, 101, -1]]
+        result = gateway_api.set_outputs(outputs)
+        self.assertEquals(['ERROR'] * 8, [output_result['status'] for output_result in result['outputs']])
+        self.assertEquals([], communicator.commands)
+
+
+if __name__ == "__main__":
+    unittest.main()
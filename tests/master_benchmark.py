@@ -0,0 +1,294 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Throughput and latency benchmark for the MasterCommunicator and the GatewayApi, running against
+the MasterSimulator. Each scenario runs a realistic mix of callers and reports, per caller type,
+the number of commands (or GatewayApi calls) per second, the p50/p95/p99 latency and the timeout
+rate.
+
+Usage (from the tests directory): python2 -m master_benchmark --help
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import constants
+import master.master_api as master_api
+from master.master_communicator import MasterCommunicator
+from master.command_scheduler import set_thread_priority, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from serial_utils import CommunicationTimedOutException
+
+from master_simulator import MasterSimulator
+
+POLLED_COMMANDS = [master_api.sensor_temperature_list(), master_api.sensor_humidity_list(),
+                   master_api.sensor_brightness_list(), master_api.thermostat_list(),
+                   master_api.thermostat_mode_list(), master_api.pulse_list(),
+                   master_api.error_list()]
+
+
+class Recorder(object):
+    """ Records the latencies and timeouts per caller type. """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__latencies = {}
+        self.__timeouts = {}
+
+    def record(self, name, latency):
+        """ Record the latency of a successful command. """
+        with self.__lock:
+            self.__latencies.setdefault(name, []).append(latency)
+
+    def timeout(self, name):
+        """ Record a timed out command. """
+        with self.__lock:
+            self.__timeouts[name] = self.__timeouts.get(name, 0) + 1
+
+    def get_report(self, duration):
+        """ Get the commands/sec, latency percentiles (in ms) and timeout rate per caller type. """
+        report = {}
+        with self.__lock:
+            for name in set(self.__latencies.keys() + self.__timeouts.keys()):
+                latencies = sorted(self.__latencies.get(name, []))
+                timeouts = self.__timeouts.get(name, 0)
+                total = len(latencies) + timeouts
+                report[name] = {'commands': total,
+                                'commands_per_sec': total / duration,
+                                'p50': percentile(latencies, 50) * 1000,
+                                'p95': percentile(latencies, 95) * 1000,
+                                'p99': percentile(latencies, 99) * 1000,
+                                'timeout_rate': float(timeouts) / total if total > 0 else 0.0}
+        return report
+
+
+def percentile(values, percent):
+    """ Get a percentile of a sorted list of values, 0 for an empty list. """
+    if len(values) == 0:
+        return 0.0
+    return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+
+def run_caller(communicator, stop, recorder, name, commands, priority, pause, timeout):
+    """ Sends the commands in a loop until stop is set.
+
+    :param commands: list of tuples (MasterCommandSpec, fields).
+    :param pause: number of seconds to wait between two commands.
+    """
+    set_thread_priority(priority)
+    index = 0
+    while not stop.is_set():
+        (cmd, fields) = commands[index % len(commands)]
+        index += 1
+        start = time.time()
+        try:
+            communicator.do_command(cmd, fields, timeout=timeout)
+            recorder.record(name, time.time() - start)
+        except CommunicationTimedOutException:
+            recorder.timeout(name)
+        if pause > 0:
+            time.sleep(pause)
+
+
+def run_api_caller(gateway_api, stop, recorder, name, calls, priority, pause):
+    """ Calls the GatewayApi in a loop until stop is set.
+
+    :param calls: list of functions that get the GatewayApi.
+    :param pause: number of seconds to wait between two calls.
+    """
+    set_thread_priority(priority)
+    index = 0
+    while not stop.is_set():
+        call = calls[index % len(calls)]
+        index += 1
+        start = time.time()
+        try:
+            call(gateway_api)
+            recorder.record(name, time.time() - start)
+        except CommunicationTimedOutException:
+            recorder.timeout(name)
+        if pause > 0:
+            time.sleep(pause)
+
+
+def metrics_callers(num_outputs):
+    """ The metric collectors: each thread polls some read-only commands. """
+    return [('metrics', [(cmd, {})], PRIORITY_BACKGROUND, 0.05) for cmd in POLLED_COMMANDS]
+
+
+def api_callers(num_outputs):
+    """ Web clients that switch outputs and read the thermostats. """
+    commands = []
+    for output_id in range(num_outputs):
+        commands.append((master_api.basic_action(), {'action_type': master_api.BA_LIGHT_TOGGLE,
+                                                     'action_number': output_id}))
+    return [('api', commands, PRIORITY_INTERACTIVE, 0.1) for _ in range(4)] + \
+        [('api', [(master_api.thermostat_list(), {})], PRIORITY_INTERACTIVE, 0.2)]
+
+
+def bulk_callers(num_outputs):
+    """ A bulk job that reads the eeprom and all outputs. """
+    commands = [(master_api.eeprom_list(), {'bank': bank}) for bank in range(256)] + \
+        [(master_api.read_output(), {'id': output_id}) for output_id in range(num_outputs)]
+    return [('bulk', commands, PRIORITY_BACKGROUND, 0)]
+
+
+def gateway_callers(num_outputs):
+    """ Web clients, metric collectors and a scene controller that use the GatewayApi. """
+    scenes = []
+    for _ in range(8):
+        outputs = random.sample(range(num_outputs), min(8, num_outputs))
+        scenes.append(lambda gateway_api, outputs=outputs: gateway_api.set_outputs(
+            [{'id': output_id, 'is_on': random.random() < 0.5} for output_id in outputs]))
+    status = [lambda gateway_api: gateway_api.get_output_status(),
+              lambda gateway_api: gateway_api.get_thermostat_status()]
+    configurations = [lambda gateway_api: gateway_api.get_output_configurations(),
+                      lambda gateway_api: gateway_api.get_input_configurations(),
+                      lambda gateway_api: gateway_api.get_thermostat_configurations()]
+    metrics = [lambda gateway_api: gateway_api.get_sensor_temperature_status(),
+               lambda gateway_api: gateway_api.get_pulse_counter_status()]
+    return [('gw_status', status, PRIORITY_INTERACTIVE, 0.1) for _ in range(4)] + \
+        [('gw_scene', scenes, PRIORITY_INTERACTIVE, 0.2),
+         ('gw_config', configurations, PRIORITY_INTERACTIVE, 0.5),
+         ('gw_metrics', metrics, PRIORITY_BACKGROUND, 0.05)]
+
+
+GATEWAY_CALLERS = [gateway_callers]  # The callers that use the GatewayApi
+
+SCENARIOS = [('metrics', [metrics_callers], 0),
+             ('api', [api_callers], 0),
+             ('metrics+api', [metrics_callers, api_callers], 0),
+             ('bulk+api', [bulk_callers, api_callers], 0),
+             ('events+api', [api_callers], 200),
+             ('mixed', [metrics_callers, api_callers, bulk_callers], 100),
+             ('gateway', [gateway_callers], 0),
+             ('gateway+bulk', [gateway_callers, bulk_callers], 100)]
+
+
+def create_gateway_api(communicator, directory):
+    """ Create a GatewayApi that keeps its eeprom image and extensions in a directory, and wait
+    until it read the outputs. The threads of the GatewayApi keep running after the scenario. """
+    from gateway.gateway_api import GatewayApi
+    constants.get_eeprom_image_file = lambda: os.path.join(directory, 'eeprom.img')
+    constants.get_eeprom_extension_database_file = lambda: os.path.join(directory, 'eeprom_ext.db')
+    gateway_api = GatewayApi(communicator, None, None)
+    gateway_api.get_output_status()
+    return gateway_api
+
+
+def run_scenario(name, caller_factories, event_rate, options):
+    """ Run one scenario against a new simulator.
+
+    :returns: dict with the report per caller type and the number of unsolicited messages.
+    """
+    simulator = MasterSimulator(latency=options.latency, jitter=options.jitter,
+                                drop_rate=options.drop_rate, seed=options.seed)
+    simulator.start()
+    communicator = MasterCommunicator(simulator.serial, init_master=False,
+                                      watchdog_callback=lambda: None,
+                                      max_pending_commands=options.window)
+    if options.ttl is not None:
+        for cmd in POLLED_COMMANDS:
+            communicator.enable_coalescing(cmd, options.ttl, [master_api.basic_action()])
+    communicator.start()
+
+    directory = tempfile.mkdtemp()
+    gateway_api = None
+    if any(factory in GATEWAY_CALLERS for factory in caller_factories):
+        gateway_api = create_gateway_api(communicator, directory)
+
+    if event_rate > 0:
+        simulator.flood(event_rate, options.duration)
+
+    stop = threading.Event()
+    recorder = Recorder()
+    threads = []
+    num_outputs = simulator.num_output_modules * 8
+    for factory in caller_factories:
+        for (caller_name, commands, priority, pause) in factory(num_outputs):
+            if factory in GATEWAY_CALLERS:
+                thread = threading.Thread(target=run_api_caller,
+                                          args=(gateway_api, stop, recorder, caller_name, commands,
+                                                priority, pause))
+            else:
+                thread = threading.Thread(target=run_caller,
+                                          args=(communicator, stop, recorder, caller_name, commands,
+                                                priority, pause, options.timeout))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+    time.sleep(options.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    simulator.stop()
+    shutil.rmtree(directory)
+
+    return {'scenario': name,
+            'callers': recorder.get_report(options.duration),
+            'unsolicited_messages': simulator.unsolicited_sent}
+
+
+def print_report(result):
+    """ Print the report of a scenario as a table. """
+    print '{0} ({1} unsolicited messages)'.format(result['scenario'],
+                                                  result['unsolicited_messages'])
+    print '  {0:<10} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+        'caller', 'commands', 'cmds/sec', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'timeouts')
+    for (caller, report) in sorted(result['callers'].items()):
+        print '  {0:<10} {1:>8} {2:>10.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f} {6:>8.1f}%'.format(
+            caller, report['commands'], report['commands_per_sec'], report['p50'],
+            report['p95'], report['p99'], report['timeout_rate'] * 100)
+
+
+def main():
+    """ Parse the arguments and run the benchmark. """
+    parser = argparse.ArgumentParser(description='MasterCommunicator benchmark')
+    parser.add_argument('--scenario', default=None,
+                        help='Only run this scenario: ' + ', '.join([s[0] for s in SCENARIOS]))
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per scenario')
+    parser.add_argument('--latency', type=float, default=0.005, help='Master latency (sec)')
+    parser.add_argument('--jitter', type=float, default=0.002, help='Master jitter (sec)')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Fraction of dropped replies')
+    parser.add_argument('--timeout', type=float, default=2, help='Command timeout (sec)')
+    parser.add_argument('--window', type=int, default=1, help='Maximum pending commands')
+    parser.add_argument('--ttl', type=float, default=None,
+                        help='Coalesce the polled commands with this cache ttl (sec)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the simulator and the callers')
+    parser.add_argument('--json', action='store_true', help='Print the results as json')
+    options = parser.parse_args()
+    random.seed(options.seed)
+
+    results = []
+    for (name, caller_factories, event_rate) in SCENARIOS:
+        if options.scenario is None or options.scenario == name:
+            result = run_scenario(name, caller_factories, event_rate, options)
+            results.append(result)
+            if not options.json:
+                print_report(result)
+
+    if options.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Contains a simulated master that speaks the master protocol over a socket backed serial port.
+Unlike the SerialMock, the simulator does not expect a fixed sequence: it answers every command
+from master_api, with a configurable latency, jitter and drop rate, and can send unsolicited
+OL, IL, EV and SO messages.
+"""
+
+import fcntl
+import random
+import socket
+import struct
+import termios
+import threading
+import time
+import unittest
+from Queue import Queue
+
+import master.master_api as master_api
+from master.master_command import MasterCommandSpec, StructDecoder, Field, FieldType, \
+    BytesFieldType, VarStringFieldType, SvtFieldType, DimmerFieldType, ErrorListFieldType
+
+
+class SocketSerial(object):
+    """ Serial port (as used by the MasterCommunicator) on top of a socket. """
+
+    def __init__(self, sock):
+        self.__socket = sock
+        self.timeout = None
+
+    def write(self, data):
+        """ Write data to the serial port. """
+        self.__socket.sendall(data)
+
+    def read(self, size):
+        """ Read size bytes from the serial port, blocks until the bytes are available or the
+        timeout expires. """
+        self.__socket.settimeout(self.timeout)
+        data = ""
+        try:
+            while len(data) < size:
+                received = self.__socket.recv(size - len(data))
+                if len(received) == 0:
+                    break  # Socket closed
+                data += received
+        except socket.timeout:
+            pass
+        return data
+
+    def inWaiting(self):  # pylint: disable=C0103
+        """ Get the number of bytes pending to be read. """
+        buf = fcntl.ioctl(self.__socket.fileno(), termios.FIONREAD, "\x00" * 4)
+        return struct.unpack("I", buf)[0]
+
+    def close(self):
+        """ Close the serial port. """
+        self.__socket.close()
+
+
+class MasterSimulator(object):
+    """ Simulates the master: reads commands from a socket and answers them. Commands are
+    processed one at a time, as on the real master. """
+
+    def __init__(self, latency=0.0, jitter=0.0, drop_rate=0.0, command_latency=None,
+                 num_output_modules=4, num_input_modules=4, seed=None):
+        """ Create a simulated master.
+
+        :param latency: The time (in sec) the master needs to answer a command.
+        :param jitter: The maximum random time (in sec) that is added to the latency.
+        :param drop_rate: The fraction of the commands that is not answered.
+        :param command_latency: dict that maps an action on its latency, overrides latency.
+        :param num_output_modules: The number of output modules (8 outputs per module).
+        :param num_input_modules: The number of input modules.
+        :param seed: Seed for the random generator, to make a run reproducible.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.command_latency = command_latency or {}
+        self.num_output_modules = num_output_modules
+        self.num_input_modules = num_input_modules
+
+        self.eeprom = [bytearray("\xff" * 256) for _ in range(256)]
+        # The number of input, output and shutter modules, as the master keeps them in bank 0
+        self.eeprom[0][1:4] = bytearray([num_input_modules, num_output_modules, 0])
+        self.outputs = dict([(i, {'status': 0, 'dimmer': 100}) for i in range(num_output_modules * 8)])
+
+        self.commands_received = 0
+        self.commands_dropped = 0
+        self.unsolicited_sent = 0
+
+        self.__random = random.Random(seed)
+        self.__specs = MasterSimulator.__get_specs()
+        self.__handlers = {'BA': self.__basic_action,
+                           'EL': self.__eeprom_list,
+                           'RE': self.__read_eeprom,
+                           'WE': self.__write_eeprom,
+                           'rn': self.__number_of_io_modules,
+                           'ro': self.__read_output}
+
+        (self.__socket, gateway_socket) = socket.socketpair()
+        self.serial = SocketSerial(gateway_socket)
+        self.__write_lock = threading.Lock()
+        self.__commands = Queue()
+        self.__stopped = False
+
+    @staticmethod
+    def __get_specs():
+        """ Get the MasterCommandSpecs in master_api that can be sent to the master, by action. """
+        specs = {}
+        for name in sorted(dir(master_api)):
+            function = getattr(master_api, name)
+            if callable(function) and name not in ['memoized', 'dimmer_to_percentage'] and \
+                    not name[0].isupper():
+                try:
+                    spec = function()
+                except TypeError:
+                    continue
+                if isinstance(spec, MasterCommandSpec) and len(spec.input_fields) > 0 and \
+                        spec.output_fields is not None and spec.action not in specs:
+                    specs[spec.action] = spec
+        return specs
+
+    def start(self):
+        """ Start the simulator threads. """
+        for target in [self.__reader, self.__processor]:
+            thread = threading.Thread(target=target, name='Master simulator')
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """ Stop answering commands. The sockets are left open: closing them would make the
+        read thread of the MasterCommunicator spin on empty reads. """
+        self.__stopped = True
+        self.__commands.put(None)
+
+    def __reader(self):
+        """ Reads the commands from the socket and queues them. """
+        data = ""
+        while not self.__stopped:
+            try:
+                received = self.__socket.recv(1024)
+            except socket.error:
+                break
+            if len(received) == 0:
+                break
+            data += received
+
+            while True:
+                start = data.find("STR")
+                if start == -1 or len(data) < start + 6:
+                    break
+                action = data[start + 3:start + 5]
+                spec = self.__specs.get(action)
+                if spec is None:
+                    data = data[start + 3:]  # Unknown command, skip it
+                    continue
+                length = 6 + StructDecoder.compile(spec.input_fields).size + 2
+                if len(data) < start + length:
+                    break
+                self.__commands.put((spec, data[start:start + length]))
+                data = data[start + length:]
+
+    def __processor(self):
+        """ Answers the queued commands, one at a time. """
+        while True:
+            command = self.__commands.get()
+            if command is None or self.__stopped:
+                break
+            (spec, data) = command
+            self.commands_received += 1
+
+            cid = ord(data[5])
+            fields = StructDecoder.compile(spec.input_fields).decode(data, 6)
+
+            latency = self.command_latency.get(spec.action, self.latency)
+            if self.jitter > 0:
+                latency += self.__random.uniform(0, self.jitter)
+            if latency > 0:
+                time.sleep(latency)
+
+            if self.__random.random() < self.drop_rate:
+                self.commands_dropped += 1
+                continue
+
+            handler = self.__handlers.get(spec.action)
+            output = handler(fields) if handler is not None else {}
+            self.__send(MasterSimulator.__create_output(spec, cid, fields, output))
+
+    def __send(self, data):
+        """ Send data to the gateway. """
+        with self.__write_lock:
+            try:
+                self.__socket.sendall(data)
+            except socket.error:
+                pass
+
+    @staticmethod
+    def __create_output(spec, cid, input_fields, output_fields):
+        """ Create the answer on a command. Fields that are not provided by the handler are
+        taken from the input fields (eg. bank, id) or get a default value. """
+        fields = {}
+        for field in spec.output_fields:
+            if field.name in output_fields:
+                fields[field.name] = output_fields[field.name]
+            elif field.name in input_fields and field.name not in ['padding', 'literal']:
+                fields[field.name] = input_fields[field.name]
+            else:
+                fields[field.name] = MasterSimulator.__default_value(field)
+
+        encoded = []
+        for field in spec.output_fields:
+            if Field.is_crc(field):
+                crc = sum(bytearray("".join(encoded)))
+                encoded.append(field.encode([ord('C'), crc / 256, crc % 256]))
+            else:
+                encoded.append(field.encode(fields[field.name]))
+        return spec.output_action + chr(cid) + "".join(encoded)
+
+    @staticmethod
+    def __default_value(field):
+        """ Get the default value for a field. """
+        field_type = field.field_type
+        if field.name == 'resp':
+            return 'OK'
+        elif isinstance(field_type, FieldType):
+            return 0 if field_type.python_type == int else "\x00" * field_type.length
+        elif isinstance(field_type, BytesFieldType):
+            return [0] * field_type.length
+        elif isinstance(field_type, VarStringFieldType):
+            return ""
+        elif isinstance(field_type, SvtFieldType):
+            return master_api.Svt.temp(21.0)
+        elif isinstance(field_type, DimmerFieldType):
+            return 0
+        elif isinstance(field_type, ErrorListFieldType):
+            return []
+        return None
+
+    # Command handlers: return a dict with the output fields.
+
+    def __basic_action(self, fields):
+        """ Handle the basic actions that change the outputs. """
+        action_type = fields['action_type']
+        output = self.outputs.get(fields['action_number'])
+        if output is not None:
+            if action_type in [master_api.BA_LIGHT_ON, master_api.BA_DIMMER_MIN,
+                               master_api.BA_DIMMER_MAX] or \
+                    master_api.BA_LIGHT_ON_DIMMER_10 <= action_type <= master_api.BA_LIGHT_ON_TIMER_3120_NO_OVERRULE:
+                output['status'] = 1
+            elif action_type == master_api.BA_LIGHT_OFF:
+                output['status'] = 0
+            elif action_type == master_api.BA_LIGHT_TOGGLE:
+                output['status'] = 1 - output['status']
+            self.send_output_list()
+        return {}
+
+    def __eeprom_list(self, fields):
+        """ Read a bank of the eeprom. """
+        return {'data': str(self.eeprom[fields['bank']])}
+
+    def __read_eeprom(self, fields):
+        """ Read bytes from the eeprom. """
+        (bank, addr) = (fields['bank'], fields['addr'])
+        return {'data': str(self.eeprom[bank][addr:addr + min(fields['num'], 10)])}
+
+    def __write_eeprom(self, fields):
+        """ Write bytes to the eeprom. """
+        (bank, address, data) = (fields['bank'], fields['address'], fields['data'])
+        self.eeprom[bank][address:address + len(data)] = data
+        return {}
+
+    def __number_of_io_modules(self, _):
+        """ Get the number of modules. """
+        return {'in': self.num_input_modules, 'out': self.num_output_modules, 'shutter': 0}
+
+    def __read_output(self, fields):
+        """ Read the status of an output. """
+        output = self.outputs.get(fields['id'], {'status': 0, 'dimmer': 0})
+        return {'type': 'D', 'status': output['status'], 'dimmer': output['dimmer'],
+                'name': ('Output %d' % fields['id']).ljust(16)}
+
+    # Unsolicited messages
+
+    def send_output_list(self):
+        """ Send an OL message with the outputs that are on. """
+        on_outputs = [(output_id, output['dimmer']) for (output_id, output)
+                      in sorted(self.outputs.items()) if output['status'] == 1]
+        dimmer = DimmerFieldType()
+        data = "OL\x00" + chr(len(on_outputs)) + \
+            "".join([chr(output_id) + dimmer.encode(value) for (output_id, value) in on_outputs]) + \
+            "\r\n"
+        self.__send(data)
+        self.unsolicited_sent += 1
+
+    def send_input_list(self, input_id, output_id=255):
+        """ Send an IL message for a pressed input. """
+        self.__send(master_api.input_list().create_output(0, {'input': input_id, 'output': output_id}))
+        self.unsolicited_sent += 1
+
+    def send_event(self, code):
+        """ Send an EV message. """
+        self.__send(master_api.event_triggered().create_output(0, {'code': code}))
+        self.unsolicited_sent += 1
+
+    def send_shutter_status(self, module_nr, status):
+        """ Send an SO message. """
+        self.__send(master_api.shutter_status().create_output(0, {'module_nr': module_nr,
+                                                                  'status': status}))
+        self.unsolicited_sent += 1
+
+    def flood(self, rate, duration):
+        """ Send random unsolicited OL, IL, EV and SO messages in a background thread.
+
+        :param rate: The number of messages per second.
+        :param duration: The number of seconds to send messages.
+        """
+        def run():
+            """ Sends the messages. """
+            end = time.time() + duration
+            while time.time() < end and not self.__stopped:
+                choice = self.__random.randint(0, 3)
+                if choice == 0:
+                    output_id = self.__random.choice(self.outputs.keys())
+                    self.outputs[output_id]['status'] = self.__random.randint(0, 1)
+                    self.send_output_list()
+                elif choice == 1:
+                    self.send_input_list(self.__random.randint(0, self.num_input_modules * 8 - 1))
+                elif choice == 2:
+                    self.send_event(self.__random.randint(0, 255))
+                else:
+                    self.send_shutter_status(0, self.__random.randint(0, 255))
+                time.sleep(1.0 / rate)
+
+        thread = threading.Thread(target=run, name='Master simulator flood')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class MasterSimulatorTest(unittest.TestCase):
+    """ Tests for the MasterSimulator, using the MasterCommunicator. """
+
+    def setUp(self):
+        from master.master_communicator import MasterCommunicator
+        self.simulator = MasterSimulator(seed=0)
+        self.simulator.start()
+        self.communicator = MasterCommunicator(self.simulator.serial, init_master=False)
+        self.communicator.start()
+
+    def tearDown(self):
+        self.simulator.stop()
+
+    def test_commands(self):
+        """ Test some commands against the simulator. """
+        self.assertEquals("OK", self.communicator.do_command(
+            master_api.basic_action(), {'action_type': master_api.BA_LIGHT_ON, 'action_number': 3})['resp'])
+        self.assertEquals(1, self.communicator.do_command(master_api.read_output(), {'id': 3})['status'])
+        self.assertEquals(4, self.communicator.do_command(master_api.number_of_io_modules())['out'])
+
+        self.communicator.do_command(master_api.write_eeprom(), {'bank': 2, 'address': 4, 'data': 'abc'})
+        self.assertEquals('abc', self.communicator.do_command(
+            master_api.read_eeprom(), {'bank': 2, 'addr': 4, 'num': 3})['data'])
+        self.assertEquals('\xff' * 4 + 'abc' + '\xff' * 249, self.communicator.do_command(
+            master_api.eeprom_list(), {'bank': 2})['data'])
+
+        # Commands with a crc
+        self.assertEquals(21.0, self.communicator.do_command(
+            master_api.thermostat_list())['tmp0'].get_temperature())
+
+    def test_unsolicited(self):
+        """ Test the unsolicited messages. """
+        from master.master_communicator import BackgroundConsumer
+        received = Queue()
+        self.communicator.register_consumer(
+            BackgroundConsumer(master_api.input_list(), 0, received.put))
+
+        self.simulator.send_input_list(5)
+        self.assertEquals(5, received.get(timeout=1)['input'])
+
+    def test_drop(self):
+        """ Test dropped replies. """
+        from serial_utils import CommunicationTimedOutException
+        self.simulator.drop_rate = 1.0
+        self.assertRaises(CommunicationTimedOutException,
+                          lambda: self.communicator.do_command(master_api.status(), timeout=0.2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the command_coalescer module.
+"""
+
+import unittest
+import threading
+import time
+
+import master.master_api as master_api
+from master.command_coalescer import CommandCoalescer
+from master.command_scheduler import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from serial_utils import CommunicationTimedOutException
+
+
+class CommandCoalescerTest(unittest.TestCase):
+    """ Tests for CommandCoalescer. """
+
+    def test_single_flight(self):
+        """ Test if concurrent identical commands share one execution. """
+        coalescer = CommandCoalescer()
+        coalescer.enable(master_api.thermostat_list())
+
+        calls = []
+        release = threading.Event()
+
+        def do_command():
+            """ Slow command. """
+            calls.append(1)
+            release.wait()
+            return {'mode': len(calls)}
+
+        results = []
+
+        def execute():
+            """ Execute the command. """
+            results.append(coalescer.execute(master_api.thermostat_list(), {}, do_command))
+
+        threads = [threading.Thread(target=execute) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(1, len(calls))
+        self.assertEquals([{'mode': 1}] * 5, results)
+
+        # Without ttl, the next call executes the command again
+        self.assertEquals({'mode': 2}, coalescer.execute(master_api.thermostat_list(), {}, do_command))
+
+    def test_single_flight_exception(self):
+        """ Test if the waiting callers get the exception of the command. """
+        coalescer = CommandCoalescer()
+        coalescer.enable(master_api.error_list())
+
+        release = threading.Event()
+
+        def do_command():
+            """ Slow command that times out. """
+            release.wait()
+            raise CommunicationTimedOutException()
+
+        exceptions = []
+
+        def execute():
+            """ Execute the command. """
+            try:
+                coalescer.execute(master_api.error_list(), {}, do_command)
+            except CommunicationTimedOutException:
+                exceptions.append(1)
+
+        threads = [threading.Thread(target=execute) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(3, len(exceptions))
+
+    def test_ttl_and_invalidation(self):
+        """ Test the result cache and the invalidation by write commands. """
+        coalescer = CommandCoalescer()
+        coalescer.enable(master_api.thermostat_list(), 10, [master_api.write_setpoint()])
+        coalescer.enable(master_api.sensor_temperature_list(), 10)
+
+        calls = []
+
+        def do_command():
+            """ Count the calls. """
+            calls.append(1)
+            return {'calls': len(calls)}
+
+        self.assertEquals({'calls': 1}, coalescer.execute(master_api.thermostat_list(), {}, do_command))
+        self.assertEquals({'calls': 1}, coalescer.execute(master_api.thermostat_list(), {}, do_command))
+        self.assertEquals({'calls': 2}, coalescer.execute(master_api.sensor_temperature_list(), {}, do_command))
+
+        # Commands that don't change the thermostats don't invalidate
+        coalescer.execute(master_api.status(), {}, do_command)
+        self.assertEquals({'calls': 1}, coalescer.execute(master_api.thermostat_list(), {}, do_command))
+
+        coalescer.execute(master_api.write_setpoint(), {}, do_command)
+        self.assertEquals({'calls': 5}, coalescer.execute(master_api.thermostat_list(), {}, do_command))
+        self.assertEquals({'calls': 2}, coalescer.execute(master_api.sensor_temperature_list(), {}, do_command))
+
+        coalescer.invalidate()
+        self.assertEquals({'calls': 6}, coalescer.execute(master_api.sensor_temperature_list(), {}, do_command))
+
+    def test_result_copies(self):
+        """ Test if a caller that changes its result does not change the result of the others. """
+        coalescer = CommandCoalescer()
+        coalescer.enable(master_api.error_list(), 10)
+
+        result = coalescer.execute(master_api.error_list(), {},
+                                   lambda: {'errors': [('O1', 0)], 'resp': 'OK'})
+        result['errors'].append(('I1', 1))
+        result['resp'] = 'NOK'
+
+        self.assertEquals({'errors': [('O1', 0)], 'resp': 'OK'},
+                          coalescer.execute(master_api.error_list(), {}, lambda: None))
+
+    def test_invalidation_during_flight(self):
+        """ Test that a result is not cached if a write happened while it was read. """
+        coalescer = CommandCoalescer()
+        coalescer.enable(master_api.thermostat_list(), 10, [master_api.write_setpoint()])
+
+        calls = []
+
+        def do_command():
+            """ Write a setpoint while the list is read. """
+            calls.append(1)
+            if len(calls) == 1:
+                coalescer.execute(master_api.write_setpoint(), {}, lambda: {})
+            return {'calls': len(calls)}
+
+        self.assertEquals({'calls': 1}, coalescer.execute(master_api.thermostat_list(), {}, do_command))
+        self.assertEquals({'calls': 2}, coalescer.execute(master_api.thermostat_list(), {}, do_command))
+        self.assertEquals({'calls': 2}, coalescer.execute(master_api.thermostat_list(), {}, do_command))
+
+    def test_single_flight_priority(self):
+        """ Test if a caller only joins the flights of the same or a higher priority class. """
+        coalescer = CommandCoalescer()
+        coalescer.enable(master_api.thermostat_list())
+
+        calls = []
+        release = threading.Event()
+
+        def do_command():
+            """ Slow command. """
+            calls.append(1)
+            release.wait()
+            return {'calls': len(calls)}
+
+        def execute(priority):
+            """ Execute the command in a thread. """
+            thread = threading.Thread(target=coalescer.execute,
+                                      args=(master_api.thermostat_list(), {}, do_command, priority))
+            thread.start()
+            time.sleep(0.05)
+            return thread
+
+        # An interactive caller does not wait for a background flight
+        threads = [execute(PRIORITY_BACKGROUND), execute(PRIORITY_INTERACTIVE)]
+        self.assertEquals(2, len(calls))
+
+        # A background caller joins the interactive flight
+        threads.append(execute(PRIORITY_BACKGROUND))
+        self.assertEquals(2, len(calls))
+
+        release.set()
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the command_scheduler module.
+"""
+
+import unittest
+import threading
+import time
+
+from master.command_scheduler import CommandScheduler, command_priority, get_thread_priority, \
+    PRIORITY_INTERACTIVE, PRIORITY_SCHEDULED, PRIORITY_PLUGIN, PRIORITY_BACKGROUND
+
+
+class CommandSchedulerTest(unittest.TestCase):
+    """ Tests for CommandScheduler. """
+
+    def test_priority_order(self):
+        """ Test if the waiting callers get the slot in order of priority. """
+        scheduler = CommandScheduler(1)
+        scheduler.acquire(PRIORITY_INTERACTIVE)
+
+        order = []
+
+        def command(priority, name):
+            """ Acquire and release a slot. """
+            scheduler.acquire(priority)
+            order.append(name)
+            scheduler.release()
+
+        threads = []
+        for (priority, name) in [(PRIORITY_BACKGROUND, 'background1'),
+                                 (PRIORITY_PLUGIN, 'plugin'),
+                                 (PRIORITY_BACKGROUND, 'background2'),
+                                 (PRIORITY_INTERACTIVE, 'interactive'),
+                                 (PRIORITY_SCHEDULED, 'scheduled')]:
+            thread = threading.Thread(target=command, args=(priority, name))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.05)
+
+        statistics = scheduler.get_statistics()
+        self.assertEquals(2, statistics['background']['queue_depth'])
+        self.assertEquals(1, statistics['interactive']['queue_depth'])
+
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(['interactive', 'scheduled', 'plugin', 'background1', 'background2'],
+                          order)
+
+        statistics = scheduler.get_statistics()
+        self.assertEquals(0, statistics['background']['queue_depth'])
+        self.assertEquals(2, statistics['interactive']['commands'])
+        self.assertEquals(2, statistics['background']['commands'])
+        self.assertTrue(statistics['background']['max_wait_time'] > 0.2)
+
+    def test_preempt_bulk_job(self):
+        """ Test if an interactive command is handled between the commands of a bulk job. """
+        scheduler = CommandScheduler(1)
+        order = []
+
+        def bulk_job():
+            """ Sends a lot of background commands. """
+            for i in range(10):
+                scheduler.acquire(PRIORITY_BACKGROUND)
+                order.append(i)
+                time.sleep(0.02)
+                scheduler.release()
+
+        thread = threading.Thread(target=bulk_job)
+        thread.start()
+        time.sleep(0.05)
+
+        scheduler.acquire(PRIORITY_INTERACTIVE)
+        order.append('interactive')
+        scheduler.release()
+        thread.join()
+
+        self.assertTrue(order.index('interactive') < 5)
+        self.assertEquals(range(10), [i for i in order if i != 'interactive'])
+
+    def test_multiple_slots(self):
+        """ Test if multiple callers can hold a slot at the same time. """
+        scheduler = CommandScheduler(2)
+        scheduler.acquire(PRIORITY_BACKGROUND)
+        scheduler.acquire(PRIORITY_BACKGROUND)
+
+        acquired = threading.Event()
+
+        def command():
+            """ Acquire a third slot. """
+            scheduler.acquire(PRIORITY_INTERACTIVE)
+            acquired.set()
+
+        threading.Thread(target=command).start()
+        self.assertFalse(acquired.wait(0.1))
+        scheduler.release()
+        self.assertTrue(acquired.wait(1))
+
+    def test_idle_time(self):
+        """ Test if the idle time only takes the commands with a higher priority into account. """
+        scheduler = CommandScheduler(1)
+        self.assertEquals(float('inf'), scheduler.get_idle_time(PRIORITY_BACKGROUND))
+
+        scheduler.acquire(PRIORITY_BACKGROUND)
+        scheduler.release()
+        self.assertEquals(float('inf'), scheduler.get_idle_time(PRIORITY_BACKGROUND))
+
+        scheduler.acquire(PRIORITY_PLUGIN)
+        time.sleep(0.1)
+        self.assertTrue(scheduler.get_idle_time(PRIORITY_BACKGROUND) >= 0.1)
+        self.assertEquals(float('inf'), scheduler.get_idle_time(PRIORITY_PLUGIN))
+
+        # A waiting command makes the bus busy
+        thread = threading.Thread(target=scheduler.acquire, args=(PRIORITY_INTERACTIVE,))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEquals(0, scheduler.get_idle_time(PRIORITY_BACKGROUND))
+        self.assertEquals(0, scheduler.get_idle_time(PRIORITY_PLUGIN))
+        scheduler.release()
+        thread.join()
+        self.assertTrue(scheduler.get_idle_time(PRIORITY_PLUGIN) < 0.05)
+        scheduler.release()
+
+    def test_thread_priority(self):
+        """ Test the command_priority context manager. """
+        self.assertEquals(PRIORITY_INTERACTIVE, get_thread_priority())
+        with command_priority(PRIORITY_PLUGIN):
+            self.assertEquals(PRIORITY_PLUGIN, get_thread_priority())
+            with command_priority(PRIORITY_BACKGROUND):
+                self.assertEquals(PRIORITY_BACKGROUND, get_thread_priority())
+            self.assertEquals(PRIORITY_PLUGIN, get_thread_priority())
+        self.assertEquals(PRIORITY_INTERACTIVE, get_thread_priority())
+
+        self.assertRaises(ValueError, lambda: command_priority(42).__enter__())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the communication_statistics module.
+"""
+
+import unittest
+import time
+
+from master.communication_statistics import CommunicationStatistics, Histogram
+
+
+class HistogramTest(unittest.TestCase):
+    """ Tests for Histogram. """
+
+    def test_buckets(self):
+        """ Test if the durations are counted in the right bucket. """
+        histogram = Histogram((10, 100))
+        histogram.add(0.001)
+        histogram.add(0.010)
+        histogram.add(0.050)
+        histogram.add(5)
+
+        statistics = histogram.get_statistics()
+        self.assertEquals(4, statistics['count'])
+        self.assertEquals(5, statistics['max'])
+        self.assertAlmostEquals(5.061 / 4, statistics['avg'])
+        self.assertEquals([[10, 2], [100, 1], [None, 1]], statistics['histogram'])
+
+    def test_empty(self):
+        """ Test the statistics of an empty histogram. """
+        statistics = Histogram((10,)).get_statistics()
+        self.assertEquals(0, statistics['count'])
+        self.assertEquals(0.0, statistics['avg'])
+        self.assertEquals([[10, 0], [None, 0]], statistics['histogram'])
+
+
+class CommunicationStatisticsTest(unittest.TestCase):
+    """ Tests for CommunicationStatistics. """
+
+    def test_actions(self):
+        """ Test the counts, timeouts and crc failures per action. """
+        statistics = CommunicationStatistics()
+        statistics.command_sent()
+        statistics.command_done('BA', 0.02)
+        statistics.command_sent()
+        statistics.command_timed_out('BA')
+        statistics.command_sent()
+        statistics.command_done('tl', 0.1)
+        statistics.crc_failed('tl')
+
+        actions = statistics.get_statistics()['actions']
+        self.assertEquals(1, actions['BA']['count'])
+        self.assertEquals(1, actions['BA']['timeouts'])
+        self.assertEquals(0, actions['BA']['crc_failures'])
+        self.assertAlmostEquals(0.02, actions['BA']['avg'])
+        self.assertEquals(1, actions['tl']['count'])
+        self.assertEquals(1, actions['tl']['crc_failures'])
+
+    def test_lock_wait(self):
+        """ Test the lock wait times. """
+        statistics = CommunicationStatistics()
+        statistics.lock_waited(0.5)
+        statistics.lock_waited(1.5)
+
+        lock = statistics.get_statistics()['lock']
+        self.assertEquals(2, lock['count'])
+        self.assertAlmostEquals(1.0, lock['avg'])
+        self.assertAlmostEquals(1.5, lock['max'])
+
+    def test_bus(self):
+        """ Test the bus rates and the duty cycle. """
+        statistics = CommunicationStatistics()
+        statistics.bytes_written(100)
+        statistics.command_sent()
+        time.sleep(0.2)
+        statistics.bytes_read(50)
+        statistics.command_done('BA', 0.2)
+        time.sleep(0.2)
+
+        bus = statistics.get_statistics()['bus']
+        self.assertEquals(50, bus['bytes_read'])
+        self.assertEquals(100, bus['bytes_written'])
+        self.assertTrue(100 < bus['bytes_read_per_sec'] < 250)
+        self.assertTrue(200 < bus['bytes_written_per_sec'] < 500)
+        self.assertTrue(0.3 < bus['duty_cycle'] < 0.7)
+
+    def test_pipelined_busy_time(self):
+        """ Test if overlapping commands are only counted once in the duty cycle. """
+        statistics = CommunicationStatistics()
+        statistics.command_sent()
+        statistics.command_sent()
+        time.sleep(0.2)
+        statistics.command_done('BA', 0.2)
+        statistics.command_done('BA', 0.2)
+
+        self.assertTrue(statistics.get_statistics()['bus']['duty_cycle'] > 0.9)
+
+
+    def test_average_latency(self):
+        """ Test if the average latency is only returned when enough answers were received. """
+        statistics = CommunicationStatistics()
+        self.assertEquals(None, statistics.get_average_latency('EL'))
+        for latency in (0.01, 0.03):
+            statistics.command_sent()
+            statistics.command_done('EL', latency)
+        self.assertEquals(None, statistics.get_average_latency('EL'))
+        self.assertAlmostEquals(0.02, statistics.get_average_latency('EL', min_count=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
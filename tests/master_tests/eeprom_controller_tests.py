@@ -18,6 +18,7 @@ Tests for the eeprom_controller module.
 
 import unittest
 import os
+import time
 
 from master.eeprom_controller import EepromController, EepromFile, EepromModel, EepromAddress, \
                                      EepromData, EepromId, EepromString, EepromByte, EepromWord, \
@@ -26,6 +27,7 @@ from master.eeprom_controller import EepromController, EepromFile, EepromModel,
 
 from master.eeprom_extension import EepromExtension
 import master.master_api as master_api
+from serial_utils import CommunicationTimedOutException
 
 
 class Model1(EepromModel):
@@ -110,6 +112,7 @@ def get_eeprom_file_dummy(banks):
 
 
 EEPROM_DB_FILE = 'test.db'
+EEPROM_IMAGE_FILE = 'test.img'
 
 
 def get_eeprom_controller_dummy(banks):
@@ -204,6 +207,29 @@ class EepromControllerTest(unittest.TestCase):
         self.assertFalse("link" in models[1].__dict__)
         self.assertFalse("out" in models[1].__dict__)
 
+    def test_read_batch_prefetch(self):
+        """ Test if read_batch reads all banks in one batch. """
+        batches = []
+
+        class BatchCommunicator(MasterCommunicator):
+            """ Dummy that keeps track of the batches. """
+
+            def do_command_batch(self, cmd, fields_list, callback=None):
+                """ Execute a batch of commands on the master dummy. """
+                batches.append(sorted([fields["bank"] for fields in fields_list]))
+                return MasterCommunicator.do_command_batch(self, cmd, fields_list, callback)
+
+        banks = ["", "", "",
+                 "\x00" * 4 + "helloworld\x01\x00\x02" + "\x00" * 239,
+                 "\x00" * 4 + "secondpage\x02\x00\x03" + "\x00" * 239,
+                 "\x00" * 4 + "anotherone\x04\x00\x05" + "\x00" * 239]
+        communicator = BatchCommunicator(lambda data: {"data": banks[data["bank"]]})
+        controller = EepromController(EepromFile(communicator), EepromExtension(EEPROM_DB_FILE))
+
+        models = controller.read_batch(Model5, [0, 1, 2])
+        self.assertEquals(["helloworld", "secondpage", "anotherone"], [m.name for m in models])
+        self.assertEquals([[3, 4, 5]], batches)
+
     def test_read_all_without_id(self):
         """ Test read_all for EepromModel without id. """
         controller = get_eeprom_controller_dummy([])
@@ -397,6 +423,136 @@ class EepromControllerTest(unittest.TestCase):
             self.assertEquals('Room {0}'.format(i), models[i].name)
             self.assertEquals(i / 2, models[i].floor)
 
+    def test_has_changed(self):
+        """ Test if only the models with changed banks or eext data are reported as changed. """
+        controller = get_eeprom_controller_dummy(["\x00" * 256, "\xff" * 256, "\xff" * 256, "\xff" * 256])
+        self.assertTrue(controller.has_changed([Model1], None))
+
+        controller.read_all(Model1)
+        controller.read(Model2)
+        generation = controller.get_generation()
+        self.assertFalse(controller.has_changed([Model1, Model2], generation))
+
+        controller.write(Model1.deserialize({'id': 1, 'name': 'Hello'}))
+        self.assertTrue(controller.has_changed([Model1], generation))
+        self.assertFalse(controller.has_changed([Model2], generation))
+
+        generation = controller.get_generation()
+        controller.write(Model9.deserialize({'id': 1, 'name': 'Room', 'floor': 1}))
+        self.assertTrue(controller.has_changed([Model9], generation))
+        self.assertFalse(controller.has_changed([Model1, Model2], generation))
+
+    def test_transaction(self):
+        """ Test if a transaction writes multiple models with a single activation. """
+        banks = ["\xff" * 256] * 5
+        commands = []
+
+        def write(data):
+            """ Dummy for writing bytes to a bank. """
+            bank = banks[data["bank"]]
+            banks[data["bank"]] = bank[0:data["address"]] + data["data"] + bank[data["address"] + len(data["data"]):]
+
+        class RecordingCommunicator(MasterCommunicator):
+            """ Dummy that keeps track of the commands. """
+
+            def do_command(self, cmd, data):
+                """ Execute a command on the master dummy. """
+                commands.append(cmd.action)
+                return MasterCommunicator.do_command(self, cmd, data)
+
+        communicator = RecordingCommunicator(lambda data: {"data": banks[data["bank"]]}, write)
+        controller = EepromController(EepromFile(communicator), EepromExtension(EEPROM_DB_FILE))
+
+        transaction = controller.transaction()
+        transaction.write(Model5.deserialize({'id': 1, 'name': 'Five', 'link': 3}))
+        transaction.write_batch([Model7.deserialize({'id': 1, 'name': 'Seven', 'room': 5}),
+                                 Model9.deserialize({'id': 2, 'name': 'Room'})])
+        self.assertEquals([], commands)
+
+        transaction.commit()
+        self.assertEquals(1, commands.count("AE"))
+        self.assertEquals('Five', controller.read(Model5, 1).name)
+        self.assertEquals(5, controller.read(Model7, 1).room)
+        self.assertEquals('Room', controller.read(Model9, 2).name)
+        self.assertRaises(RuntimeError, transaction.commit)
+
+    def test_transaction_validation(self):
+        """ Test if invalid models are refused before anything is written. """
+        controller = get_eeprom_controller_dummy(["\xff" * 256, "\xff" * 256, "\xff" * 256, "\xff" * 256])
+        transaction = controller.transaction()
+        self.assertRaises(TypeError, lambda: transaction.write_batch([Model1.deserialize({'id': 1, 'name': 'One'}),
+                                                                      Model1.deserialize({'id': 11, 'name': 'Two'})]))
+        self.assertRaises(TypeError, lambda: transaction.write({'id': 1}))
+        transaction.commit()
+        self.assertEquals('', controller.read(Model1, 1).name)
+
+    def test_transaction_rollback(self):
+        """ Test if the extensions are rolled back when the eeprom write fails. """
+        def write(data):
+            """ Failing write. """
+            raise CommunicationTimedOutException()
+
+        controller = EepromController(EepromFile(MasterCommunicator(lambda data: {"data": "\xff" * 256}, write)),
+                                      EepromExtension(EEPROM_DB_FILE))
+        controller.write(Model9.deserialize({'id': 1, 'name': 'Before'}))
+        generation = controller.get_generation()
+
+        transaction = controller.transaction()
+        transaction.write(Model9.deserialize({'id': 1, 'name': 'After'}))
+        transaction.write(Model7.deserialize({'id': 1, 'name': 'Seven', 'room': 5}))
+        self.assertRaises(CommunicationTimedOutException, transaction.commit)
+        self.assertEquals('Before', controller.read(Model9, 1).name)
+        self.assertEquals(255, controller.read(Model7, 1, ['room']).room)
+        self.assertFalse(controller.has_changed([Model9], generation))
+
+    def test_warm_cache(self):
+        """ Test if the cache warmer reads the uncached banks, most read models first. """
+        reads = []
+
+        def read(data):
+            """ Read dummy. """
+            reads.append(data["bank"])
+            return {"data": "\x02" + "\x00" * 255 if data["bank"] == 0 else "\xff" * 256}
+
+        controller = EepromController(EepromFile(MasterCommunicator(read)), EepromExtension(EEPROM_DB_FILE))
+        controller.read(Model5, 2)
+        self.assertEquals([5], reads)
+
+        del reads[:]
+        controller.warm_cache([Model4, Model5, Model2])
+        self.assertEquals(0, reads[0])  # The maximum id of Model4
+        self.assertEquals([1, 3, 4], sorted(reads[1:]))
+        self.assertEquals({'running': False, 'models': ['Model5', 'Model4', 'Model2'], 'banks': 4, 'cached': 4},
+                          controller.get_warmer_status())
+
+        # Warm banks are not read again
+        del reads[:]
+        controller.warm_cache([Model4, Model5, Model2])
+        self.assertEquals([], reads)
+
+    def test_warm_cache_idle(self):
+        """ Test if the cache warmer waits until the master bus is idle. """
+        idle_times = [0, 0.2, 1]
+        reads = []
+
+        class BusyCommunicator(MasterCommunicator):
+            """ Dummy that is busy for a while. """
+
+            def get_idle_time(self, priority):
+                """ Get the next idle time. """
+                return idle_times.pop(0) if len(idle_times) > 1 else idle_times[0]
+
+        def read(data):
+            """ Read dummy. """
+            reads.append(data["bank"])
+            return {"data": "\xff" * 256}
+
+        controller = EepromController(EepromFile(BusyCommunicator(read)), EepromExtension(EEPROM_DB_FILE))
+        start = time.time()
+        controller.warm_cache([Model2], idle_time=0.3)
+        self.assertTrue(time.time() - start >= 0.4)
+        self.assertEquals([3], reads)
+
 
 class MasterCommunicator(object):
     """ Dummy for the MasterCommunicator. """
@@ -420,6 +576,23 @@ class MasterCommunicator(object):
         else:
             raise Exception("Command %s not found" % cmd)
 
+    def do_command_batch(self, cmd, fields_list, callback=None):
+        """ Execute a batch of commands on the master dummy. """
+        outputs = []
+        for index, fields in enumerate(fields_list):
+            outputs.append(self.do_command(cmd, fields))
+            if callback is not None:
+                callback(index, outputs[-1])
+        return outputs
+
+    def get_average_latency(self, cmd):
+        """ No latencies are measured by the dummy. """
+        return None
+
+    def get_idle_time(self, priority):
+        """ The dummy is always idle. """
+        return float('inf')
+
 
 class EepromFileTest(unittest.TestCase):
     """ Tests for EepromFile. """
@@ -768,6 +941,346 @@ class EepromFileTest(unittest.TestCase):
         eeprom_file.write([EepromData(EepromAddress(117, 248, 8), "test\xff\xff\xff\xff")])
         self.assertTrue(done['done'])
 
+    def test_iter_banks(self):
+        """ Test if the cached banks are served in order and the other banks are prefetched. """
+        batches = []
+
+        class BatchCommunicator(MasterCommunicator):
+            """ Dummy that keeps track of the batches. """
+
+            def do_command_batch(self, cmd, fields_list, callback=None):
+                """ Execute a batch of commands on the master dummy. """
+                batches.append([fields["bank"] for fields in fields_list])
+                return MasterCommunicator.do_command_batch(self, cmd, fields_list, callback)
+
+        eeprom_file = EepromFile(BatchCommunicator(lambda data: {"data": chr(data["bank"]) * 256}))
+        eeprom_file.read_banks([1, 4])
+        del batches[:]
+
+        banks = eeprom_file.iter_banks(range(8), prefetch=3)
+        self.assertEquals((0, "\x00" * 256), next(banks))
+        self.assertEquals([[0, 2, 3]], batches)
+        self.assertEquals([(bank, chr(bank) * 256) for bank in range(1, 8)], list(banks))
+        self.assertEquals([[0, 2, 3], [5, 6, 7]], batches)
+
+    def test_write_coalesced(self):
+        """ Test if the writes to a bank are merged into a minimal number of commands. """
+        commands = []
+        batches = []
+        bank = "\x00" * 256
+
+        class RecordingCommunicator(MasterCommunicator):
+            """ Dummy that keeps track of the commands and batches. """
+
+            def do_command(self, cmd, data):
+                """ Execute a command on the master dummy. """
+                commands.append((cmd.action, data["bank"], data.get("addr", data.get("address")), data.get("data", data.get("num"))))
+                return MasterCommunicator.do_command(self, cmd, data)
+
+            def do_command_batch(self, cmd, fields_list, callback=None):
+                """ Execute a batch of commands on the master dummy. """
+                batches.append(cmd.action)
+                return MasterCommunicator.do_command_batch(self, cmd, fields_list, callback)
+
+        communicator = RecordingCommunicator(lambda data: {"data": bank}, lambda data: data)
+        eeprom_file = EepromFile(communicator)
+        self.assertTrue(eeprom_file.write([EepromData(EepromAddress(1, 0, 2), "\x01\x02"),
+                                           EepromData(EepromAddress(1, 5, 1), "\x00"),
+                                           EepromData(EepromAddress(1, 6, 1), "\x03"),
+                                           EepromData(EepromAddress(1, 2, 1), "\x04"),
+                                           EepromData(EepromAddress(1, 0, 1), "\x05")]))
+        # Only the range with the written bytes is read, the writes are merged into one command
+        self.assertEquals([("RE", 1, 0, 7), ("WE", 1, 0, "\x05\x02\x04\x00\x00\x00\x03")], commands)
+        self.assertEquals(["RE", "WE"], batches)
+
+        # With the bank in the cache, unchanged bytes are bridged
+        eeprom_file.read_banks([2])
+        del commands[:]
+        del batches[:]
+        self.assertTrue(eeprom_file.write([EepromData(EepromAddress(2, 0, 1), "\x01"),
+                                           EepromData(EepromAddress(2, 9, 2), "\x01\x01"),
+                                           EepromData(EepromAddress(2, 100, 1), "\x00")]))
+        self.assertEquals([("WE", 2, 0, "\x01" + "\x00" * 8 + "\x01"), ("WE", 2, 10, "\x01")], commands)
+
+        # Nothing is written when nothing changed
+        del commands[:]
+        self.assertFalse(eeprom_file.write([EepromData(EepromAddress(1, 0, 3), "\x05\x02\x04")]))
+        self.assertEquals([], commands)
+
+    def test_persistent_image(self):
+        """ Test if the banks are served from the persisted image after a restart and verified
+        against the master. """
+        banks = {1: "\xff" * 256, 2: "\x00" * 256}
+        reads = []
+
+        def read(data):
+            """ Read dummy. """
+            reads.append(data["bank"])
+            return {"data": banks[data["bank"]]}
+
+        try:
+            eeprom_file = EepromFile(MasterCommunicator(read), EEPROM_IMAGE_FILE)
+            eeprom_file.read_banks([1, 2])
+            self.assertEquals([1, 2], sorted(reads))
+
+            # A restarted EepromFile serves the banks without reading from the master
+            banks[2] = "\x01" * 256
+            eeprom_file = EepromFile(MasterCommunicator(read), EEPROM_IMAGE_FILE)
+            del reads[:]
+            address = EepromAddress(2, 0, 1)
+            self.assertEquals("\x00", eeprom_file.read([address])[address].bytes)
+            self.assertEquals([], reads)
+
+            # Verify only reads the cached banks, the changed bank gets a new generation
+            generations = (eeprom_file.get_generation(1), eeprom_file.get_generation(2))
+            self.assertEquals([2], eeprom_file.verify())
+            self.assertEquals([1, 2], sorted(reads))
+            self.assertEquals(generations[0], eeprom_file.get_generation(1))
+            self.assertNotEquals(generations[1], eeprom_file.get_generation(2))
+            self.assertEquals("\x01", eeprom_file.read([address])[address].bytes)
+
+            # Verified banks are not read again
+            del reads[:]
+            self.assertEquals([], eeprom_file.verify())
+            self.assertEquals([], reads)
+        finally:
+            if os.path.exists(EEPROM_IMAGE_FILE):
+                os.remove(EEPROM_IMAGE_FILE)
+
+    def test_load_banks_retry(self):
+        """ Test if the banks that failed in a batch are retried. """
+        batches = []
+
+        class FailingCommunicator(object):
+            """ Dummy communicator that fails bank 2 in the first batch. """
+
+            def do_command_batch(self, cmd, fields_list, callback=None):
+                """ Execute a batch of eeprom_list commands. """
+                banks = [fields["bank"] for fields in fields_list]
+                batches.append(banks)
+                outputs = []
+                for index, bank in enumerate(banks):
+                    if bank == 2 and len(batches) == 1:
+                        outputs.append(None)
+                    else:
+                        outputs.append({"data": chr(bank) * 256})
+                        callback(index, outputs[-1])
+                return outputs
+
+        progress = []
+        eeprom_file = EepromFile(FailingCommunicator())
+        data = eeprom_file.load_banks([1, 2, 3], lambda done, total: progress.append((done, total)))
+
+        self.assertEquals({1: "\x01" * 256, 2: "\x02" * 256, 3: "\x03" * 256}, data)
+        self.assertEquals([[1, 2, 3], [2]], batches)
+        self.assertEquals([(1, 3), (2, 3), (3, 3)], progress)
+
+        # The banks are cached
+        address = EepromAddress(2, 0, 1)
+        self.assertEquals("\x02", eeprom_file.read([address])[address].bytes)
+        self.assertEquals(2, len(batches))
+
+    def test_invalidate_banks(self):
+        """ Test if only the invalidated banks are read again. """
+        reads = []
+
+        def read(data):
+            """ Read dummy. """
+            reads.append(data["bank"])
+            return {"data": "\xff" * 256}
+
+        eeprom_file = EepromFile(MasterCommunicator(read))
+        addresses = [EepromAddress(1, 0, 1), EepromAddress(2, 0, 1)]
+        eeprom_file.read(addresses)
+
+        eeprom_file.invalidate_cache([2])
+        del reads[:]
+        eeprom_file.read(addresses)
+        self.assertEquals([2], reads)
+
+
+    def test_mark_unverified(self):
+        """ Test if unverified banks are served from the cache and only get a new generation
+        when they changed on the master. """
+        banks = {1: "\xff" * 256, 2: "\x00" * 256}
+        reads = []
+
+        def read(data):
+            """ Read dummy. """
+            reads.append(data["bank"])
+            return {"data": banks[data["bank"]]}
+
+        eeprom_file = EepromFile(MasterCommunicator(read))
+        eeprom_file.read_banks([1, 2])
+        generation = eeprom_file.get_generation()
+        self.assertEquals((generation, set()), eeprom_file.get_changes(generation))
+
+        banks[2] = "\x01" * 256
+        eeprom_file.mark_unverified()
+        del reads[:]
+        address = EepromAddress(2, 0, 1)
+        self.assertEquals("\x00", eeprom_file.read([address])[address].bytes)
+        self.assertEquals([], reads)
+
+        self.assertEquals([2], eeprom_file.verify())
+        self.assertEquals([1, 2], sorted(reads))
+        self.assertEquals("\x01", eeprom_file.read([address])[address].bytes)
+        self.assertEquals(set([2]), eeprom_file.get_changes(generation)[1])
+
+        # Writes only register the banks that changed
+        generation = eeprom_file.get_generation()
+        eeprom_file.write([EepromData(EepromAddress(1, 0, 1), "\xff")])
+        self.assertEquals((generation, set()), eeprom_file.get_changes(generation))
+
+    def test_read_ranges(self):
+        """ Test if small reads on a cold cache use ranged reads and are cached. """
+        commands = []
+        bank = "".join(chr(i) for i in range(256))
+
+        class RecordingCommunicator(MasterCommunicator):
+            """ Dummy that keeps track of the commands. """
+
+            def do_command(self, cmd, data):
+                """ Execute a command on the master dummy. """
+                commands.append((cmd.action, data["bank"], data.get("addr"), data.get("num")))
+                return MasterCommunicator.do_command(self, cmd, data)
+
+        eeprom_file = EepromFile(RecordingCommunicator(lambda data: {"data": bank}))
+        address1 = EepromAddress(2, 0, 1)
+        address2 = EepromAddress(2, 252, 1)
+        address3 = EepromAddress(33, 0, 1)
+        data = eeprom_file.read([address1, address2, address3])
+        self.assertEquals("\x00", data[address1].bytes)
+        self.assertEquals("\xfc", data[address2].bytes)
+        self.assertEquals("\x00", data[address3].bytes)
+        self.assertEquals([("RE", 2, 0, 1), ("RE", 2, 252, 1), ("RE", 33, 0, 1)], sorted(commands))
+
+        # The bytes are cached, a bank without cached bytes is read in ranges of 10 bytes
+        del commands[:]
+        address4 = EepromAddress(34, 250, 6)
+        address5 = EepromAddress(34, 5, 2)
+        data = eeprom_file.read([address1, address2, address4, address5])
+        self.assertEquals("\x00", data[address1].bytes)
+        self.assertEquals("\xfa\xfb\xfc\xfd\xfe\xff", data[address4].bytes)
+        self.assertEquals("\x05\x06", data[address5].bytes)
+        self.assertEquals([("RE", 34, 5, 2), ("RE", 34, 250, 6)], sorted(commands))
+
+        # A large read lists the whole bank
+        del commands[:]
+        address6 = EepromAddress(2, 0, 200)
+        self.assertEquals(bank[0:200], eeprom_file.read([address6])[address6].bytes)
+        self.assertEquals([("EL", 2, None, None)], commands)
+
+        # Invalidating the bank drops the cached bytes
+        del commands[:]
+        eeprom_file.invalidate_cache([33])
+        eeprom_file.read([address3])
+        self.assertEquals([("RE", 33, 0, 1)], commands)
+
+    def test_read_plan_latency(self):
+        """ Test if the measured latency is used to choose between a bank list and ranged reads. """
+        commands = []
+
+        class SlowRangeCommunicator(MasterCommunicator):
+            """ Dummy with slow ranged reads. """
+
+            def do_command(self, cmd, data):
+                """ Execute a command on the master dummy. """
+                commands.append(cmd.action)
+                return MasterCommunicator.do_command(self, cmd, data)
+
+            def get_average_latency(self, cmd):
+                """ Ranged reads are as slow as bank lists. """
+                return 0.03
+
+        eeprom_file = EepromFile(SlowRangeCommunicator(lambda data: {"data": "\x01" * 256}))
+        address = EepromAddress(2, 0, 1)
+        self.assertEquals("\x01", eeprom_file.read([address])[address].bytes)
+        self.assertEquals(["EL"], commands)
+
+    def test_read_ranges_short(self):
+        """ Test if a ranged read with a short reply is retried. """
+        replies = ["\x00\x01", "\x00\x01\x02\x03\x04"]
+
+        def read(data):
+            """ Read dummy, the first reply is short. """
+            return {"data": replies.pop(0) if len(replies) > 0 else "\x00\x01"}
+
+        eeprom_file = EepromFile(MasterCommunicator(read))
+        address = EepromAddress(3, 0, 5)
+        self.assertEquals("\x00\x01\x02\x03\x04", eeprom_file.read([address])[address].bytes)
+        self.assertEquals([], replies)
+
+        # The retries run out if the replies stay short
+        address = EepromAddress(4, 0, 5)
+        self.assertRaises(CommunicationTimedOutException, lambda: eeprom_file.read([address]))
+
+    def test_read_ranges_complete_bank(self):
+        """ Test if a bank that is completely read in ranges is stored in the image. """
+        reads = []
+
+        def read(data):
+            """ Read dummy. """
+            reads.append(data["bank"])
+            return {"data": "\x02" * 256}
+
+        eeprom_file = EepromFile(MasterCommunicator(read))
+        for offset in range(0, 256, 10):
+            eeprom_file.read([EepromAddress(5, offset, min(10, 256 - offset))])
+        self.assertEquals(26, len(reads))
+
+        del reads[:]
+        self.assertEquals({5: "\x02" * 256}, eeprom_file.read_banks([5]))
+        self.assertEquals([], reads)
+
+    def test_write_unverified(self):
+        """ Test if the unverified banks are read from the master before a write or a backup,
+        also after a restart with a persisted image. """
+        banks = ["\x00" * 256 for _ in range(256)]
+        reads = []
+
+        def read(data):
+            """ Read dummy. """
+            reads.append(data["bank"])
+            return {"data": banks[data["bank"]]}
+
+        def write(data):
+            """ Write dummy. """
+            bank = banks[data["bank"]]
+            banks[data["bank"]] = bank[0:data["address"]] + data["data"] + bank[data["address"] + len(data["data"]):]
+
+        try:
+            eeprom_file = EepromFile(MasterCommunicator(read, write), EEPROM_IMAGE_FILE)
+            eeprom_file.read_banks([1, 2])
+
+            # The bytes changed on the master (eg. in maintenance mode)
+            banks[1] = "\x01" * 256
+            eeprom_file.mark_unverified()
+            del reads[:]
+            self.assertEquals([(1, 0, "\x00")], eeprom_file.write([EepromData(EepromAddress(1, 0, 1), "\x00")]))
+            self.assertEquals([1], reads)
+            self.assertEquals("\x00" + "\x01" * 255, banks[1])
+
+            # After a restart, the persisted banks are not trusted for writes and backups
+            banks[2] = "\x02" * 256
+            eeprom_file = EepromFile(MasterCommunicator(read, write), EEPROM_IMAGE_FILE)
+            del reads[:]
+            self.assertEquals([(2, 0, "\x00")], eeprom_file.write([EepromData(EepromAddress(2, 0, 1), "\x00")]))
+            self.assertEquals([2], reads)
+
+            banks[1] = "\x03" * 256
+            del reads[:]
+            self.assertEquals([(1, "\x03" * 256), (2, "\x00" + "\x02" * 255)],
+                              list(eeprom_file.iter_banks([1, 2])))
+            self.assertEquals([1, 2], sorted(reads))
+
+            # The banks that were read are verified
+            del reads[:]
+            list(eeprom_file.iter_banks([1, 2]))
+            self.assertEquals([], reads)
+        finally:
+            if os.path.exists(EEPROM_IMAGE_FILE):
+                os.remove(EEPROM_IMAGE_FILE)
 
 class EepromModelTest(unittest.TestCase):
     """ Tests for EepromModel. """
@@ -806,6 +1319,27 @@ class EepromModelTest(unittest.TestCase):
         self.assertEquals("name", fields[2][0])
         self.assertEquals("room", fields[3][0])
 
+    def test_get_layout(self):
+        """ Test if the layout is compiled once and contains the fields. """
+        layout = Model5.get_layout()
+        self.assertTrue(layout is Model5.get_layout())
+        self.assertEquals(['link', 'name', 'out'], layout['fields']['eeprom'])
+        self.assertEquals([], layout['fields']['eext'])
+        self.assertEquals(('name', '_name'), layout['eeprom'][1][:2])
+        self.assertTrue(layout['has_id'])
+        self.assertEquals(2, layout['max_id'])
+        self.assertTrue(isinstance(Model5.name, property))
+
+        layout = Model9.get_layout()
+        self.assertEquals(['floor', 'name'], layout['fields']['eext'])
+
+    def test_get_eeprom_banks(self):
+        """ Test get_eeprom_banks. """
+        self.assertEquals(set([4]), Model5.get_eeprom_banks(1))
+        self.assertEquals(set([4]), Model5.get_eeprom_banks(1, ['name']))
+        self.assertEquals(set([3]), Model2.get_eeprom_banks(None))
+        self.assertEquals(set(), Model9.get_eeprom_banks(1))
+
     def test_has_id(self):
         """ Test has_id. """
         self.assertTrue(Model1.has_id())
@@ -18,6 +18,7 @@ Tests for the eeprom extensions module.
 
 import unittest
 import os
+from threading import Thread
 
 from master.eeprom_extension import EepromExtension
 
@@ -56,6 +57,59 @@ class EepromExtensionTest(unittest.TestCase):
         self.assertEqual('value_2', ext.read_data('model_name', 2, 'some_field'))
         self.assertIsNone(ext.read_data('model_name', 3, 'some_field'))
 
+    def test_read_model(self):
+        """ Test reading all extensions of a model and the invalidation on write. """
+        ext = EepromExtensionTest._get_extension()
+        ext.write_data([('model_name', 0, 'some_field', 'value_0'),
+                        ('model_name', 1, 'other_field', 'value_1'),
+                        ('other_model', None, 'some_field', 'other')])
+        self.assertEqual({(0, 'some_field'): 'value_0', (1, 'other_field'): 'value_1'},
+                         ext.read_model('model_name'))
+        self.assertEqual({(0, 'some_field'): 'other'}, ext.read_model('other_model'))
+        self.assertEqual({}, ext.read_model('unknown'))
+
+        ext.write_data([('model_name', 1, 'other_field', 'new_value')])
+        self.assertEqual('new_value', ext.read_model('model_name')[(1, 'other_field')])
+        self.assertEqual('new_value', EepromExtensionTest._get_extension().read_data('model_name', 1, 'other_field'))
+
+    def test_write_transaction(self):
+        """ Test if a failing write does not write any of the extensions. """
+        ext = EepromExtensionTest._get_extension()
+        ext.write_data([('model_name', 0, 'some_field', 'value_0')])
+        self.assertRaises(Exception, lambda: ext.write_data([('model_name', 0, 'some_field', 'new'),
+                                                             ('model_name', 1, 'some_field', object())]))
+        self.assertEqual({(0, 'some_field'): 'value_0'}, ext.read_model('model_name'))
+
+    def test_write_transaction_rollback(self):
+        """ Test if the extensions are rolled back when the block of the transaction fails. """
+        ext = EepromExtensionTest._get_extension()
+        ext.write_data([('model_name', 0, 'some_field', 'value_0')])
+
+        def write():
+            """ Write in a failing transaction. """
+            with ext.write_transaction([('model_name', 0, 'some_field', 'new')]):
+                raise RuntimeError('Master write failed')
+
+        self.assertRaises(RuntimeError, write)
+        self.assertEqual({(0, 'some_field'): 'value_0'}, ext.read_model('model_name'))
+
+        with ext.write_transaction([('model_name', 0, 'some_field', 'new')]):
+            pass
+        self.assertEqual({(0, 'some_field'): 'new'}, ext.read_model('model_name'))
+
+    def test_write_transaction_read(self):
+        """ Test if the extensions can be read while the block of a transaction runs. """
+        ext = EepromExtensionTest._get_extension()
+        ext.write_data([('model_name', 0, 'some_field', 'value_0')])
+
+        reads = []
+        with ext.write_transaction([('model_name', 0, 'some_field', 'new')]):
+            thread = Thread(target=lambda: reads.append(ext.read_model('model_name')))
+            thread.start()
+            thread.join(1)
+            self.assertEqual([{(0, 'some_field'): 'value_0'}], reads)
+        self.assertEqual({(0, 'some_field'): 'new'}, ext.read_model('model_name'))
+
 
 if __name__ == "__main__":
     unittest.main()
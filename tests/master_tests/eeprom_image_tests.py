@@ -0,0 +1,91 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the eeprom_image module.
+"""
+
+import unittest
+import os
+
+from master.eeprom_image import EepromImage
+
+IMAGE_FILE = 'test.img'
+
+
+class EepromImageTest(unittest.TestCase):
+    """ Tests for EepromImage. """
+
+    def setUp(self):  # pylint: disable=C0103
+        """ Remove the image file. """
+        if os.path.exists(IMAGE_FILE):
+            os.remove(IMAGE_FILE)
+
+    def tearDown(self):  # pylint: disable=C0103
+        """ Remove the image file. """
+        if os.path.exists(IMAGE_FILE):
+            os.remove(IMAGE_FILE)
+
+    def test_set_get(self):
+        """ Test setting and getting banks and the generations. """
+        image = EepromImage()
+        self.assertFalse(image.is_valid(3))
+        self.assertEquals(None, image.get(3))
+
+        self.assertTrue(image.set(3, "\xff" * 256))
+        self.assertEquals("\xff" * 256, image.get(3))
+        self.assertEquals(1, image.get_generation(3))
+
+        self.assertFalse(image.set(3, "\xff" * 256))
+        self.assertEquals(1, image.get_generation(3))
+
+        self.assertTrue(image.set(3, "abc"))
+        self.assertEquals("abc", image.get(3))
+        self.assertEquals(2, image.get_generation(3))
+
+        image.invalidate(3)
+        self.assertEquals(None, image.get(3))
+        self.assertEquals(3, image.get_generation(3))
+        self.assertEquals(None, image.get(4))
+
+    def test_persistence(self):
+        """ Test if the banks are persisted in the file. """
+        image = EepromImage(IMAGE_FILE)
+        image.set(0, "\x01" * 256)
+        image.set(255, "\x02" * 256)
+        image.flush()
+
+        image = EepromImage(IMAGE_FILE)
+        self.assertEquals("\x01" * 256, image.get(0))
+        self.assertEquals("\x02" * 256, image.get(255))
+        self.assertEquals(1, image.get_generation(255))
+        self.assertEquals(None, image.get(1))
+
+    def test_unknown_format(self):
+        """ Test if a file with an unknown format is replaced by an empty image. """
+        image = EepromImage(IMAGE_FILE)
+        image.set(0, "\x01" * 256)
+        image.flush()
+        del image
+
+        with open(IMAGE_FILE, 'r+b') as image_file:
+            image_file.write('garbage!')
+
+        image = EepromImage(IMAGE_FILE)
+        self.assertEquals(None, image.get(0))
+        self.assertTrue(image.set(0, "\x01" * 256))
+
+
+if __name__ == "__main__":
+    unittest.main()
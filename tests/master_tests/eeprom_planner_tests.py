@@ -0,0 +1,69 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the eeprom_planner module.
+"""
+
+import unittest
+
+from master.eeprom_planner import get_ranges, plan_reads, plan_writes
+
+
+class EepromPlannerTest(unittest.TestCase):
+    """ Tests for the eeprom read planner. """
+
+    def test_get_ranges(self):
+        """ Test if the offsets are covered with a minimal number of ranges. """
+        self.assertEquals([], get_ranges(set()))
+        self.assertEquals([(0, 10)], get_ranges(set([0, 3, 9])))
+        self.assertEquals([(0, 1), (10, 2)], get_ranges(set([0, 10, 11])))
+        self.assertEquals([(5, 10), (252, 4)], get_ranges(set([5, 14, 252, 255])))
+        self.assertEquals([(250, 6)], get_ranges(set(range(250, 260))))
+
+    def test_plan_reads(self):
+        """ Test if the cheapest way to read every bank is chosen. """
+        offsets = {1: set([0]),
+                   2: set([0, 100, 200]),
+                   3: set(range(256)),
+                   4: set()}
+        (banks, reads) = plan_reads(offsets, bank_cost=0.03, range_cost=0.008)
+        self.assertEquals([3], banks)
+        self.assertEquals([(1, 0, 1), (2, 0, 1), (2, 100, 1), (2, 200, 1)], reads)
+
+        (banks, reads) = plan_reads(offsets, bank_cost=0.03, range_cost=0.011)
+        self.assertEquals([2, 3], banks)
+        self.assertEquals([(1, 0, 1)], reads)
+
+    def test_plan_reads_defaults(self):
+        """ Test if the default costs are used when no latency was measured. """
+        (banks, reads) = plan_reads({1: set([0]), 2: set(range(0, 256, 20))})
+        self.assertEquals([2], banks)
+        self.assertEquals([(1, 0, 1)], reads)
+
+    def test_plan_writes(self):
+        """ Test if the changes are covered with a minimal number of writes. """
+        self.assertEquals([], plan_writes({}, {}))
+        current = dict(enumerate("\x00" * 256))
+        self.assertEquals([(0, "\x01\x00\x01"), (12, "\x01")],
+                          plan_writes({0: "\x01", 2: "\x01", 12: "\x01"}, current))
+        self.assertEquals([(0, "\x01" + "\x00" * 8 + "\x01"), (10, "\x01")],
+                          plan_writes({0: "\x01", 9: "\x01", 10: "\x01"}, current))
+        # Bytes with an unknown value are not written
+        self.assertEquals([(0, "\x01"), (2, "\x01")],
+                          plan_writes({0: "\x01", 2: "\x01"}, {0: "\x00", 2: "\x00"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
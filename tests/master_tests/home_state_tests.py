@@ -0,0 +1,108 @@
+# Copyright (C) 2016 OpenMotics BVBA
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the home_state module.
+"""
+
+import unittest
+
+from master.home_state import HomeState
+
+
+class HomeStateTest(unittest.TestCase):
+    """ Tests for HomeState. """
+
+    def test_versions(self):
+        """ Test if only the entities that changed get a new version. """
+        state = HomeState()
+        self.assertEquals(0, state.get_version())
+
+        self.assertEquals([0, 1], sorted(state.update_all('output', {0: {'status': 0}, 1: {'status': 1}})))
+        self.assertEquals(2, state.get_version())
+
+        self.assertEquals([], state.update_all('output', {0: {'status': 0}, 1: {'status': 1}}))
+        self.assertFalse(state.update('output', 1, {'status': 1}))
+        self.assertEquals(2, state.get_version())
+
+        self.assertTrue(state.update('output', 1, {'status': 0}))
+        self.assertTrue(state.update('sensor', 3, {'temperature': 21.5}))
+        self.assertEquals(4, state.get_version())
+
+    def test_changes(self):
+        """ Test the snapshot and the changes since a version. """
+        state = HomeState()
+        state.update_all('output', {0: {'status': 0}, 1: {'status': 1}})
+        state.update('input', 5, {'output': 255})
+
+        snapshot = state.get_changes()
+        self.assertTrue(snapshot['full'])
+        self.assertEquals(3, snapshot['version'])
+        self.assertEquals([{'id': 0, 'status': 0}, {'id': 1, 'status': 1}], snapshot['state']['output'])
+        self.assertEquals([{'id': 5, 'output': 255}], snapshot['state']['input'])
+        self.assertEquals([], snapshot['state']['shutter'])
+
+        state.update('output', 0, {'status': 1})
+        changes = state.get_changes(snapshot['version'], snapshot['epoch'])
+        self.assertFalse(changes['full'])
+        self.assertEquals(4, changes['version'])
+        self.assertEquals([{'id': 0, 'status': 1}], changes['state']['output'])
+        self.assertEquals([], changes['state']['input'])
+
+        # Nothing changed
+        changes = state.get_changes(changes['version'])
+        self.assertEquals([], changes['state']['output'])
+
+        # The state of the entities is a copy
+        changes = state.get_changes()
+        changes['state']['output'][0]['status'] = 5
+        self.assertEquals(1, state.get_changes()['state']['output'][0]['status'])
+
+    def test_unknown_version(self):
+        """ Test if all entities are returned for a version of another instance. """
+        state = HomeState()
+        state.update('output', 0, {'status': 0})
+        epoch = state.get_changes()['epoch']
+
+        self.assertTrue(state.get_changes(5, epoch)['full'])
+        self.assertTrue(state.get_changes(0, epoch + 1)['full'])
+        self.assertFalse(state.get_changes(0, epoch)['full'])
+
+        # A restart gets another epoch
+        self.assertNotEquals(epoch, HomeState().get_changes()['epoch'])
+
+    def test_removed(self):
+        """ Test if a client gets all entities after entities were removed. """
+        state = HomeState()
+        state.update_all('output', dict((i, {'status': 0}) for i in range(4)), complete=True)
+        version = state.get_version()
+
+        # Only the given entities are updated, unless all entities are given
+        self.assertEquals([1], state.update_all('output', {1: {'status': 1}}))
+        self.assertFalse(state.get_changes(version)['full'])
+        version = state.get_version()
+
+        self.assertEquals([2, 3], sorted(state.update_all('output', {0: {'status': 0}, 1: {'status': 1}},
+                                                          complete=True)))
+        changes = state.get_changes(version)
+        self.assertTrue(changes['full'])
+        self.assertEquals([{'id': 0, 'status': 0}, {'id': 1, 'status': 1}], changes['state']['output'])
+
+        changes = state.get_changes(changes['version'], changes['epoch'])
+        self.assertFalse(changes['full'])
+        self.assertEquals([], changes['state']['output'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,6 +20,7 @@ Tests for master_api module.
 
 import unittest
 
+import master.master_api as master_api
 from master.master_api import Svt
 
 class SvtTest(unittest.TestCase):
@@ -49,6 +50,22 @@ class SvtTest(unittest.TestCase):
             byte_value = chr(value)
             self.assertEquals(byte_value, Svt.from_byte(byte_value).get_byte())
 
+class MasterApiTest(unittest.TestCase):
+    """ Tests for the api functions in master_api. """
+
+    def test_memoized(self):
+        """ Test if the specs are only created once. """
+        self.assertTrue(master_api.basic_action() is master_api.basic_action())
+        self.assertTrue(master_api.thermostat_list() is master_api.thermostat_list())
+        self.assertFalse(master_api.basic_action() is master_api.thermostat_list())
+        self.assertEquals("basic_action", master_api.basic_action.__name__)
+
+    def test_dimmer_to_percentage(self):
+        """ Test the conversion of dimmer values. """
+        self.assertEquals(0, master_api.dimmer_to_percentage(0))
+        self.assertEquals(90, master_api.dimmer_to_percentage(54))
+        self.assertEquals(100, master_api.dimmer_to_percentage(63))
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
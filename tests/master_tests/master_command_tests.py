@@ -252,6 +252,79 @@ class MasterCommandSpecTest(unittest.TestCase):
         self.assertEquals((2, True), (bytes_consumed, done))
         self.assertEquals("OK", result["response"])
 
+    def test_consume_output_offset(self):
+        """ Test for MasterCommandSpec.consume_output from an offset in a bytearray. """
+        basic_action = MasterCommandSpec("BA", [],
+                                [Field.str("response", 2), Field.padding(11), Field.lit("\r\n")])
+
+        # Full string after some junk
+        data = bytearray("Junk" + "OK" + ('\x00' * 11) + '\r\nMore')
+        (bytes_consumed, result, done) = basic_action.consume_output(data, None, 4, 19)
+
+        self.assertEquals((15, True), (bytes_consumed, done))
+        self.assertEquals("OK", result["response"])
+        self.assertEquals("OK" + ('\x00' * 11) + '\r\n', result.actual_bytes)
+
+        # String in 2 pieces, the length limits the available bytes
+        data = bytearray("JunkOK" + ('\x00' * 11))
+        (bytes_consumed, result, done) = basic_action.consume_output(data, None, 4, 7)
+
+        self.assertEquals((7, False), (bytes_consumed, done))
+        self.assertEquals('\x00' * 5, result.pending_bytes)
+
+        data = bytearray("Junk" + ('\x00' * 6) + '\r\n')
+        (bytes_consumed, result, done) = basic_action.consume_output(data, result, 4)
+
+        self.assertEquals((8, True), (bytes_consumed, done))
+        self.assertEquals("OK", result["response"])
+
+    def test_consume_output_compiled(self):
+        """ Test for MasterCommandSpec.consume_output with only fixed length fields. """
+        spec = MasterCommandSpec("XX", [],
+                                 [Field.byte("byte"), Field.int("int"), Field.str("str", 2),
+                                  Field.bytes("bytes", 2), Field.padding(2), Field.svt("svt"),
+                                  Field.dimmer("dimmer"), Field.varstr("varstr", 4),
+                                  Field.crc(), Field.lit("\r\n")])
+
+        data = "\x01\x01\x02ab\x03\x04\x00\x00\x68\x36\x02xy  C\x01\x02\r\n"
+
+        # Full output at once
+        (bytes_consumed, result, done) = spec.consume_output(data, None)
+
+        self.assertEquals((len(data), True), (bytes_consumed, done))
+        self.assertEquals(1, result["byte"])
+        self.assertEquals(258, result["int"])
+        self.assertEquals("ab", result["str"])
+        self.assertEquals([3, 4], result["bytes"])
+        self.assertEquals(20.0, result["svt"].get_temperature())
+        self.assertEquals(90, result["dimmer"])
+        self.assertEquals("xy", result["varstr"])
+        self.assertEquals([ord('C'), 1, 2], result["crc"])
+        self.assertEquals(data, result.actual_bytes)
+
+        # Output in 2 pieces
+        (bytes_consumed, result, done) = spec.consume_output(data[:5], None)
+        self.assertEquals((5, False), (bytes_consumed, done))
+
+        (bytes_consumed, result, done) = spec.consume_output(data[5:] + "junk", result)
+        self.assertEquals((len(data) - 5, True), (bytes_consumed, done))
+        self.assertEquals("xy", result["varstr"])
+        self.assertEquals(data, result.actual_bytes)
+
+        # Wrong literal
+        self.assertRaises(ValueError, lambda: spec.consume_output(data[:-2] + "\r\r", None))
+
+    def test_check_crc(self):
+        """ Test for MasterCommandSpec.check_crc """
+        spec = MasterCommandSpec("XX", [], [Field.byte("a"), Field.byte("b"), Field.crc(),
+                                            Field.lit("\r\n")])
+
+        (_, result, _) = spec.consume_output("\x01\xffC\x01\x00\r\n", None)
+        self.assertTrue(spec.check_crc(result))
+
+        (_, result, _) = spec.consume_output("\x01\xffC\x01\x01\r\n", None)
+        self.assertFalse(spec.check_crc(result))
+
     def test_consume_output_varlength(self):
         """ Test for MasterCommandSpec.consume_output with a variable length output field. """
         def dim(byte_value):
@@ -23,7 +23,7 @@ import threading
 import time
 
 from master.master_communicator import MasterCommunicator, InMaintenanceModeException, \
-                                       BackgroundConsumer, CrcCheckFailedException
+                                       BackgroundConsumer, CrcCheckFailedException, ReadBuffer
 import master.master_api as master_api
 
 from serial_tests import SerialMock, sin, sout
@@ -86,6 +86,128 @@ class MasterCommunicatorTest(unittest.TestCase):
         output = comm.do_command(action, in_fields)
         self.assertEquals("OK", output["resp"])
 
+    def test_do_command_pipelined(self):
+        """ Test if multiple commands can be in flight when pipelining is enabled. """
+        action = master_api.basic_action()
+        in_fields = {"action_type": 1, "action_number": 2}
+        out_fields = {"resp": "OK"}
+
+        serial_mock = SerialMock([sin(action.create_input(1, in_fields)),
+                                  sin(action.create_input(2, in_fields)),
+                                  sout(action.create_output(2, out_fields)),
+                                  sout(action.create_output(1, out_fields))])
+
+        comm = MasterCommunicator(serial_mock, init_master=False, max_pending_commands=2)
+        comm.start()
+
+        results = []
+        start = time.time()
+
+        def first_command():
+            """ Executes the first command, which is answered last. """
+            results.append(comm.do_command(action, in_fields)["resp"])
+
+        thread = threading.Thread(target=first_command)
+        thread.start()
+        time.sleep(0.1)
+
+        self.assertEquals("OK", comm.do_command(action, in_fields)["resp"])
+        thread.join()
+
+        # Without pipelining the second command could only be sent after the first timed out
+        self.assertEquals(["OK"], results)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_do_command_pipelined_timeout(self):
+        """ Test if a timed out pipelined command does not block the other commands. """
+        action = master_api.basic_action()
+        in_fields = {"action_type": 1, "action_number": 2}
+        out_fields = {"resp": "OK"}
+
+        serial_mock = SerialMock([sin(action.create_input(1, in_fields)),
+                                  sin(action.create_input(2, in_fields)),
+                                  sout(action.create_output(2, out_fields))])
+
+        comm = MasterCommunicator(serial_mock, init_master=False, max_pending_commands=2)
+        comm.start()
+
+        timeouts = []
+
+        def first_command():
+            """ Executes the first command, which is never answered. """
+            try:
+                comm.do_command(action, in_fields, timeout=0.5)
+            except CommunicationTimedOutException:
+                timeouts.append(1)
+
+        thread = threading.Thread(target=first_command)
+        thread.start()
+        time.sleep(0.1)
+
+        self.assertEquals("OK", comm.do_command(action, in_fields)["resp"])
+        thread.join()
+
+        self.assertEquals([1], timeouts)
+
+    def test_do_command_batch(self):
+        """ Test if the commands of a batch are pipelined and answered in order. """
+        action = master_api.eeprom_list()
+        banks = ["\x01" * 256, "\x02" * 256, "\x03" * 256]
+
+        serial_mock = SerialMock([sin(action.create_input(1, {"bank": 0})),
+                                  sin(action.create_input(2, {"bank": 1})),
+                                  sin(action.create_input(3, {"bank": 2})),
+                                  sout(action.create_output(2, {"bank": 1, "data": banks[1]})),
+                                  sout(action.create_output(3, {"bank": 2, "data": banks[2]})),
+                                  sout(action.create_output(1, {"bank": 0, "data": banks[0]}))])
+
+        comm = MasterCommunicator(serial_mock, init_master=False, max_pending_commands=3)
+        comm.start()
+
+        answered = []
+        outputs = comm.do_command_batch(action, [{"bank": bank} for bank in range(3)],
+                                        callback=lambda index, output: answered.append(index))
+
+        self.assertEquals(banks, [output["data"] for output in outputs])
+        self.assertEquals([0, 1, 2], answered)
+
+    def test_do_command_batch_timeout(self):
+        """ Test if a command that times out does not stop the batch. """
+        action = master_api.eeprom_list()
+        banks = ["\x01" * 256, "\x02" * 256]
+
+        for window in [1, 2]:
+            serial_mock = SerialMock([sin(action.create_input(1, {"bank": 0})),
+                                      sin(action.create_input(2, {"bank": 1})),
+                                      sout(action.create_output(2, {"bank": 1, "data": banks[1]}))])
+            comm = MasterCommunicator(serial_mock, init_master=False, max_pending_commands=window)
+            comm.start()
+
+            outputs = comm.do_command_batch(action, [{"bank": 0}, {"bank": 1}], timeout=0.2)
+            self.assertEquals(None, outputs[0])
+            self.assertEquals(banks[1], outputs[1]["data"])
+
+    def test_do_command_late_answer(self):
+        """ Test if the answer on a timed out command is sent to the passthrough. """
+        action = master_api.basic_action()
+        in_fields = {"action_type": 1, "action_number": 2}
+        out_fields = {"resp": "OK"}
+
+        serial_mock = SerialMock([sin(action.create_input(1, in_fields)),
+                                  sin(action.create_input(2, in_fields)),
+                                  sout(action.create_output(1, out_fields)),
+                                  sout(action.create_output(2, out_fields))])
+
+        comm = MasterCommunicator(serial_mock, init_master=False)
+        comm.enable_passthrough()
+        comm.start()
+
+        self.assertRaises(CommunicationTimedOutException,
+                          lambda: comm.do_command(action, in_fields, timeout=0.1))
+
+        self.assertEquals("OK", comm.do_command(action, in_fields)["resp"])
+        self.assertEquals(action.create_output(1, out_fields), comm.get_passthrough_data())
+
     def test_do_command_passthrough(self):
         """ Test for the do_command with passthrough data. """
         action = master_api.basic_action()
@@ -139,6 +261,25 @@ class MasterCommunicatorTest(unittest.TestCase):
         for i in range(1, 18):
             self.assertEquals("OK", comm.do_command(action, in_fields)["resp"])
 
+    def test_do_command_passthrough_burst(self):
+        """ Test for the do_command with a large burst of passthrough data. """
+        action = master_api.basic_action()
+        in_fields = {"action_type": 1, "action_number": 2}
+        out_fields = {"resp": "OK"}
+
+        junk = "junk data " * 1000
+
+        serial_mock = SerialMock(
+                        [sin(action.create_input(1, in_fields)),
+                         sout(junk + action.create_output(1, out_fields) + junk)])
+
+        comm = MasterCommunicator(serial_mock, init_master=False)
+        comm.enable_passthrough()
+        comm.start()
+
+        self.assertEquals("OK", comm.do_command(action, in_fields)["resp"])
+        self.assertEquals(junk + junk, comm.get_passthrough_data())
+
     def test_send_passthrough_data(self):
         """ Test the passthrough if no other communications are going on. """
         pt_input = "data from passthrough"
@@ -369,6 +510,72 @@ class MasterCommunicatorTest(unittest.TestCase):
 
         self.assertRaises(CrcCheckFailedException, lambda: comm.do_command(action))
 
+    def test_communication_statistics(self):
+        """ Test the counts, timeouts, crc failures and bytes in the communication statistics. """
+        action = master_api.basic_action()
+        in_fields = {"action_type": 1, "action_number": 2}
+        out_fields = {"resp": "OK"}
+
+        humidity = master_api.sensor_humidity_list()
+        hum_fields = {}
+        for i in range(0, 32):
+            hum_fields['hum%d' % i] = master_api.Svt(master_api.Svt.RAW, i)
+        hum_fields['crc'] = [ord('C'), 0, 0]
+
+        serial_mock = SerialMock([sin(action.create_input(1, in_fields)),
+                                  sout(action.create_output(1, out_fields)),
+                                  sin(action.create_input(2, in_fields)),
+                                  sin(humidity.create_input(3)),
+                                  sout(humidity.create_output(3, hum_fields))])
+
+        comm = MasterCommunicator(serial_mock, init_master=False)
+        comm.start()
+
+        comm.do_command(action, in_fields)
+        self.assertRaises(CommunicationTimedOutException,
+                          lambda: comm.do_command(action, in_fields, timeout=0.1))
+        self.assertRaises(CrcCheckFailedException, lambda: comm.do_command(humidity))
+
+        statistics = comm.get_communication_statistics()
+        self.assertEquals(1, statistics['actions']['BA']['count'])
+        self.assertEquals(1, statistics['actions']['BA']['timeouts'])
+        self.assertEquals(0, statistics['actions']['BA']['crc_failures'])
+        self.assertEquals(1, statistics['actions']['hl']['count'])
+        self.assertEquals(1, statistics['actions']['hl']['crc_failures'])
+        self.assertEquals(3, statistics['lock']['count'])
+        self.assertEquals(comm.get_bytes_read(), statistics['bus']['bytes_read'])
+        self.assertEquals(comm.get_bytes_written(), statistics['bus']['bytes_written'])
+        self.assertTrue(0 < statistics['bus']['duty_cycle'] <= 1)
+
+
+class ReadBufferTest(unittest.TestCase):
+    """ Tests for ReadBuffer class """
+
+    def test_append_discard(self):
+        """ Test appending and discarding bytes. """
+        buf = ReadBuffer(8)
+        buf.append("abcdef")
+        self.assertEquals(6, len(buf))
+        self.assertEquals("a", buf.get_char(0))
+        self.assertEquals("bcd", buf.get(1, 4))
+
+        buf.discard(4)
+        self.assertEquals("ef", buf.get(0, len(buf)))
+
+        # No room left at the end: bytes are moved to the front
+        buf.append("ghijkl")
+        self.assertEquals(8, len(buf.data))
+        self.assertEquals("efghijkl", buf.get(0, len(buf)))
+
+        # No room left at all: the buffer grows
+        buf.append("mn")
+        self.assertEquals(16, len(buf.data))
+        self.assertEquals("efghijklmn", buf.get(0, len(buf)))
+
+        buf.discard(len(buf))
+        self.assertEquals(0, len(buf))
+        self.assertEquals(0, buf.offset)
+
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
@@ -78,6 +78,74 @@ class OutputStatusTest(unittest.TestCase):
         self.assertEquals(0, status.get_outputs()[2]['dimmer'])
 
 
+    def test_update_outputs(self):
+        """ Test for update_outputs and get_reconcile_ids. """
+        def output(output_id, status, dimmer, ctimer):
+            """ Create an Output. """
+            return {'id': output_id, 'status': status, 'dimmer': dimmer, 'ctimer': ctimer}
+
+        status = OutputStatus([output(i, 0, 0, 0) for i in range(5)])
+
+        self.assertEquals([0, 1], status.get_reconcile_ids(2))
+        self.assertEquals([2, 3], status.get_reconcile_ids(2))
+        self.assertEquals([4], status.get_reconcile_ids(2))
+        self.assertEquals([0, 1], status.get_reconcile_ids(2))
+
+        sparse = OutputStatus([output(i, 0, 0, 0) for i in [3, 8, 9]])
+        self.assertEquals([3, 8], sparse.get_reconcile_ids(2))
+        self.assertEquals([9], sparse.get_reconcile_ids(2))
+
+        status.update_outputs([output(1, 1, 50, 100), output(7, 1, 0, 0)])
+        self.assertEquals(output(1, 1, 50, 100), status.get_outputs()[1])
+        self.assertEquals(5, len(status.get_outputs()))
+
+        # A partial update received during the read is not overwritten
+        partial_updates = status.get_partial_updates()
+        status.partial_update([(2, 30)])
+        status.update_outputs([output(2, 0, 0, 200)], partial_updates)
+        self.assertEquals(output(2, 1, 30, 200), status.get_outputs()[2])
+
+        partial_updates = status.get_partial_updates()
+        status.update_outputs([output(2, 0, 0, 150)], partial_updates)
+        self.assertEquals(output(2, 0, 0, 150), status.get_outputs()[2])
+
+    def test_transitions(self):
+        """ Test if the updates return the transitions of the outputs that changed. """
+        def output(output_id, status, dimmer, ctimer=0):
+            """ Create an Output. """
+            return {'id': output_id, 'status': status, 'dimmer': dimmer, 'ctimer': ctimer}
+
+        def transitions(changes):
+            """ Drop the timestamps of the transitions. """
+            for change in changes:
+                self.assertTrue(abs(change.pop('timestamp') - time.time()) < 1)
+            return [(change['id'], change['old'], change['new']) for change in changes]
+
+        status = OutputStatus([output(i, 0, 0) for i in range(240)])
+
+        self.assertEquals([(5, {'status': 0, 'dimmer': 0}, {'status': 1, 'dimmer': 50}),
+                           (7, {'status': 0, 'dimmer': 0}, {'status': 1, 'dimmer': 100})],
+                          transitions(status.partial_update([(7, 100), (5, 50), (300, 10)])))
+        self.assertEquals([], status.partial_update([(5, 50), (7, 100)]))
+
+        self.assertEquals([(5, {'status': 1, 'dimmer': 50}, {'status': 0, 'dimmer': 50}),
+                           (7, {'status': 1, 'dimmer': 100}, {'status': 1, 'dimmer': 80})],
+                          transitions(status.partial_update([(7, 80)])))
+        self.assertEquals(output(5, 0, 50), status.get_output(5))
+        self.assertEquals(None, status.get_output(300))
+
+        # The reconciled outputs that changed also result in transitions
+        self.assertEquals([(7, {'status': 1, 'dimmer': 80}, {'status': 0, 'dimmer': 80})],
+                          transitions(status.update_outputs([output(6, 0, 0, 100), output(7, 0, 80)])))
+        self.assertEquals([], status.partial_update([]))
+
+        outputs = [dict(current) for current in status.get_outputs()]
+        outputs[1] = output(1, 1, 10)
+        self.assertEquals([(1, {'status': 0, 'dimmer': 0}, {'status': 1, 'dimmer': 10})],
+                          transitions(status.full_update(outputs)))
+        self.assertEquals([(1, {'status': 1, 'dimmer': 10}, {'status': 0, 'dimmer': 10})],
+                          transitions(status.partial_update([])))
+
     def test_should_refresh(self):
         """ Test for should_refresh. """
         status = OutputStatus([], 100)
@@ -87,6 +155,48 @@ class OutputStatusTest(unittest.TestCase):
         time.sleep(0.01)
         self.assertTrue(status.should_refresh())
 
+    def test_age(self):
+        """ Test if the age is reset by the updates from the master. """
+        status = OutputStatus([{'id': 0, 'status': 0, 'dimmer': 0, 'ctimer': 0}])
+        time.sleep(0.05)
+        self.assertTrue(status.get_age() >= 0.05)
+
+        status.partial_update([])
+        self.assertTrue(status.get_age() < 0.05)
+        time.sleep(0.05)
+        status.update_outputs([{'id': 0, 'status': 0, 'dimmer': 0, 'ctimer': 0}])
+        self.assertTrue(status.get_age() < 0.05)
+        time.sleep(0.05)
+        status.force_refresh()
+        self.assertTrue(status.get_age() >= 0.05)
+        status.full_update([])
+        self.assertTrue(status.get_age() < 0.05)
+
+    def test_age_reconcile(self):
+        """ Test if the age is only reset once all outputs are reconciled. """
+        def output(output_id):
+            """ Create an Output. """
+            return {'id': output_id, 'status': 0, 'dimmer': 0, 'ctimer': 0}
+
+        status = OutputStatus([output(i) for i in range(3)])
+        time.sleep(0.05)
+        status.update_outputs([output(0), output(1), output(7)])
+        self.assertTrue(status.get_age() >= 0.05)
+
+        time.sleep(0.05)
+        status.update_outputs([output(2)])
+        age = status.get_age()
+        self.assertTrue(0.05 <= age < 0.1)  # The age of the oldest reconciled output
+
+        status.update_outputs([output(0), output(1)])
+        self.assertTrue(status.get_age() < 0.05)
+
+        outputs, age = status.get_outputs_with_age()
+        self.assertEquals([output(i) for i in range(3)], outputs)
+        self.assertTrue(age < 0.05)
+        outputs[0]['status'] = 1
+        self.assertEquals(0, status.get_output(0)['status'])
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -17,9 +17,10 @@
 """
 
 import unittest
+import threading
 import time
 
-from master.thermostats import ThermostatStatus
+from master.thermostats import ThermostatStatus, ThermostatStateStore
 
 class ThermostatStatusTest(unittest.TestCase):
     """ Tests for ThermostatStatus. """
@@ -37,6 +38,80 @@ class ThermostatStatusTest(unittest.TestCase):
         self.assertTrue(status.should_refresh())
 
 
+class ThermostatStateStoreTest(unittest.TestCase):
+    """ Tests for ThermostatStateStore. """
+
+    def test_refresh(self):
+        """ Test if the status is served from memory after a refresh. """
+        reads = []
+
+        def read():
+            """ Read dummy. """
+            reads.append(len(reads))
+            return {'thermostats_on': True, 'status': [{'id': 1, 'csetp': 20.0, 'read': len(reads)}]}
+
+        store = ThermostatStateStore(read)
+        self.assertEquals(None, store.get_status())
+        self.assertEquals(0, store.get_last_update())
+
+        store.refresh()
+        self.assertEquals(1, store.get_status()['status'][0]['read'])
+        self.assertEquals(1, store.get_status()['status'][0]['read'])
+        self.assertEquals(1, len(reads))
+        self.assertTrue(store.get_last_update() > 0)
+
+        # The served status is a copy
+        store.get_status()['status'][0]['csetp'] = 0
+        self.assertEquals(20.0, store.get_status()['status'][0]['csetp'])
+
+        store.update_thermostat(1, {'csetp': 22.5})
+        self.assertEquals(22.5, store.get_status()['status'][0]['csetp'])
+        store.refresh()
+        self.assertEquals(20.0, store.get_status()['status'][0]['csetp'])
+
+    def test_coalesce_refresh(self):
+        """ Test if the callers that wait for a running refresh share the next refresh. """
+        reads = []
+        proceed = threading.Event()
+
+        def read():
+            """ Read dummy that blocks the first read. """
+            reads.append(len(reads))
+            if len(reads) == 1:
+                proceed.wait()
+            return {'status': []}
+
+        store = ThermostatStateStore(read)
+        threads = [threading.Thread(target=store.refresh) for _ in range(5)]
+        threads[0].start()
+        time.sleep(0.05)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        proceed.set()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(2, len(reads))
+
+    def test_refresh_failure(self):
+        """ Test if a failed refresh does not change the status. """
+        reads = []
+
+        def read():
+            """ Read dummy that fails the second read. """
+            reads.append(len(reads))
+            if len(reads) == 2:
+                raise RuntimeError('Read failed')
+            return {'status': [], 'read': len(reads)}
+
+        store = ThermostatStateStore(read)
+        store.refresh()
+        self.assertRaises(RuntimeError, store.refresh)
+        self.assertEquals(1, store.get_status()['read'])
+        store.refresh()
+        self.assertEquals(3, store.get_status()['read'])
+
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -10,12 +10,27 @@ python2 -m master_tests.master_command_tests
 echo "Running master communicator tests"
 python2 -m master_tests.master_communicator_tests
 
+echo "Running command scheduler tests"
+python2 -m master_tests.command_scheduler_tests
+
+echo "Running command coalescer tests"
+python2 -m master_tests.command_coalescer_tests
+
+echo "Running communication statistics tests"
+python2 -m master_tests.communication_statistics_tests
+
+echo "Running master simulator tests"
+python2 -m master_simulator
+
 echo "Running outputs tests"
 python2 -m master_tests.outputs_tests
 
 echo "Running inputs tests"
 python2 -m master_tests.inputs_tests
 
+echo "Running home state tests"
+python2 -m master_tests.home_state_tests
+
 echo "Running passthrough tests"
 python2 -m master_tests.passthrough_tests
 
@@ -25,12 +40,24 @@ python2 -m master_tests.thermostats_tests
 echo "Running eeprom controller tests"
 python2 -m master_tests.eeprom_controller_tests
 
+echo "Running eeprom planner tests"
+python2 -m master_tests.eeprom_planner_tests
+
 echo "Running eeprom extension tests"
 python2 -m master_tests.eeprom_extension_tests
 
+echo "Running eeprom image tests"
+python2 -m master_tests.eeprom_image_tests
+
 echo "Running users tests"
 python2 -m gateway_tests.users_tests
 
+echo "Running event bus tests"
+python2 -m gateway_tests.event_bus_tests
+
+echo "Running gateway api tests"
+python2 -m gateway_tests.gateway_api_tests
+
 echo "Running scheduling tests"
 python2 -m gateway_tests.scheduling_tests
 